@@ -1,8 +1,9 @@
 import os
 import logging
 import base64
-from typing import Optional, List
-from anthropic import Anthropic
+import asyncio
+from typing import Optional, List, Dict, Callable, Awaitable
+from anthropic import Anthropic, RateLimitError
 try:
     from pdf2image import convert_from_path
     PDF2IMAGE_AVAILABLE = True
@@ -17,6 +18,9 @@ import sys
 # Railway環境での相対インポート対応
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import pdf_utils
+import page_cache
+
 try:
     from config import settings
 except ImportError:
@@ -25,6 +29,11 @@ except ImportError:
         ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
         UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/app/uploaded_pdfs")
         FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
+        ANALYSIS_CHUNK_SIZE = int(os.getenv("ANALYSIS_CHUNK_SIZE", "10"))
+        ANALYSIS_MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", "3"))
+        ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "auto")
+        ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL") or None
+        ANTHROPIC_MAX_RETRIES = int(os.getenv("ANTHROPIC_MAX_RETRIES", "2"))
         
         def validate(self):
             return bool(self.ANTHROPIC_API_KEY)
@@ -33,16 +42,62 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
-# Claude APIクライアントの初期化
+# Claude APIクライアントの初期化（ANTHROPIC_BASE_URLで負荷試験用のモックサーバーに向けられる）
 try:
-    anthropic = Anthropic(api_key=settings.ANTHROPIC_API_KEY) if settings.ANTHROPIC_API_KEY else None
+    anthropic = Anthropic(
+        api_key=settings.ANTHROPIC_API_KEY,
+        base_url=settings.ANTHROPIC_BASE_URL,
+        max_retries=settings.ANTHROPIC_MAX_RETRIES
+    ) if settings.ANTHROPIC_API_KEY else None
 except Exception as e:
     print(f"Anthropic API初期化エラー: {e}")
     anthropic = None
 
-async def analyze_pdf_with_claude(pdf_id: int, pdf_path: str, school: str, subject: str, year: int) -> dict:
+class AnalysisRateLimitError(Exception):
+    """Claude APIのレート制限（429）。retry_afterは再試行までの推奨待ち時間（秒）"""
+    
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """APIエラーのレスポンスヘッダーからretry-after（秒）を取得する"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+# 分析モード
+# - image: 全ページを画像に変換して送信する
+# - text: テキスト層を送信し、図を含むページのみ画像で送信する
+# - auto: テキスト層の品質が十分ならtext、そうでなければimage
+ANALYSIS_MODES = ("auto", "text", "image")
+
+# Claude APIを1回呼び出す前に待つ処理（一括分析のレート制限など）
+BeforeRequest = Optional[Callable[[], Awaitable[None]]]
+
+async def call_claude(before_request: BeforeRequest, send, *args):
+    """Claudeへの送信関数をスレッドで実行する（同期クライアントのため）。before_requestがあれば呼び出しごとに先に待つ"""
+    if before_request is not None:
+        await before_request()
+    return await asyncio.to_thread(send, *args)
+
+async def analyze_pdf_with_claude(
+    pdf_id: int,
+    pdf_path: str,
+    school: str,
+    subject: str,
+    year: int,
+    mode: Optional[str] = None,
+    before_request: BeforeRequest = None
+) -> dict:
     """
     PDFをClaudeに送信して分析を実行する
+    before_request: Claude APIを呼び出すたびに先に待つ処理（分割分析では分割数+1回呼ばれる）
     """
     try:
         logger.info(f"PDF分析開始: ID={pdf_id}, ファイル={pdf_path}")
@@ -54,6 +109,39 @@ async def analyze_pdf_with_claude(pdf_id: int, pdf_path: str, school: str, subje
                 "error": "AI分析機能は現在利用できません。管理者にお問い合わせください。"
             }
         
+        mode = (mode or settings.ANALYSIS_MODE or "auto").lower()
+        if mode not in ANALYSIS_MODES:
+            return {
+                "success": False,
+                "error": f"分析モードが不正です: {mode}（{', '.join(ANALYSIS_MODES)} のいずれかを指定してください）"
+            }
+        
+        chunk_size = max(1, settings.ANALYSIS_CHUNK_SIZE)
+        
+        if mode in ("auto", "text"):
+            # テキスト層が使えるPDF（非スキャン）はテキスト中心で分析する
+            text_by_page, figure_pages, page_count = await asyncio.to_thread(
+                pdf_utils.extract_text_layer, pdf_path
+            )
+            if not pdf_utils.is_text_layer_usable(text_by_page, page_count):
+                reason = "PDFのテキスト層が読み取れません（スキャンされたPDFの可能性があります）"
+            elif len(figure_pages) > chunk_size:
+                reason = f"図を含むページが多すぎます（{len(figure_pages)}ページ、上限{chunk_size}ページ）"
+            else:
+                return await analyze_text_first(
+                    pdf_id, pdf_path, school, subject, year, text_by_page, figure_pages, page_count,
+                    before_request
+                )
+            if mode == "text":
+                # textを指定した呼び出し元には、送信量の多い画像モードに切り替えずに失敗を返す
+                logger.info(f"テキストモードで分析できません: ID={pdf_id}, 理由={reason}")
+                return {
+                    "success": False,
+                    "error": f"テキストモードで分析できません: {reason}。mode=image または auto を指定してください。",
+                    "mode": "text"
+                }
+            logger.info(f"テキスト層が分析に適さないため画像モードで分析します: ID={pdf_id}, 理由={reason}")
+        
         # PDF2IMAGEの可用性をチェック
         if not PDF2IMAGE_AVAILABLE:
             return {
@@ -62,7 +150,7 @@ async def analyze_pdf_with_claude(pdf_id: int, pdf_path: str, school: str, subje
             }
         
         # PDFファイルを画像に変換
-        images = convert_pdf_to_images(pdf_path)
+        images = await asyncio.to_thread(convert_pdf_to_images, pdf_path)
         if not images:
             return {
                 "success": False,
@@ -72,17 +160,33 @@ async def analyze_pdf_with_claude(pdf_id: int, pdf_path: str, school: str, subje
         # Claudeへのプロンプトを作成
         prompt = create_analysis_prompt(school, subject, year)
         
-        # Claudeに画像を送信
-        analysis_result = send_images_to_claude(prompt, images)
+        if len(images) > chunk_size:
+            # 1回のリクエストに収まらない場合はページを分割して並行分析し、最後に統合する
+            analysis_result, chunk_count = await analyze_images_in_chunks(
+                school, subject, year, images, chunk_size, before_request
+            )
+        else:
+            # Claudeに画像を送信（同期クライアントのためスレッドで実行）
+            analysis_result = await call_claude(before_request, send_images_to_claude, prompt, images)
+            chunk_count = 1
         
         logger.info(f"PDF分析完了: ID={pdf_id}")
         return {
             "success": True,
             "analysis": analysis_result,
             "pdf_file_size": os.path.getsize(pdf_path),
-            "pages_converted": len(images)
+            "pages_converted": len(images),
+            "chunks": chunk_count,
+            "mode": "image"
         }
         
+    except AnalysisRateLimitError as e:
+        logger.warning(f"PDF分析レート制限: ID={pdf_id}, retry_after={e.retry_after}")
+        return {
+            "success": False,
+            "error": str(e),
+            "retry_after": e.retry_after
+        }
     except Exception as e:
         logger.error(f"PDF分析エラー: ID={pdf_id}, エラー={str(e)}")
         return {
@@ -90,9 +194,49 @@ async def analyze_pdf_with_claude(pdf_id: int, pdf_path: str, school: str, subje
             "error": f"AI分析中にエラーが発生しました。しばらくしてから再度お試しください。"
         }
 
-def convert_pdf_to_images(pdf_path: str) -> Optional[List[str]]:
+async def analyze_text_first(
+    pdf_id: int,
+    pdf_path: str,
+    school: str,
+    subject: str,
+    year: int,
+    text_by_page: Dict[int, str],
+    figure_pages: List[int],
+    page_count: int,
+    before_request: BeforeRequest = None
+) -> dict:
+    """
+    テキスト層と図を含むページの画像のみをClaudeに送信して分析する
+    """
+    figure_images = {}
+    if figure_pages:
+        if PDF2IMAGE_AVAILABLE:
+            images = await asyncio.to_thread(convert_pdf_to_images, pdf_path, figure_pages)
+            if images:
+                figure_images = dict(zip(figure_pages, images))
+        else:
+            logger.warning("pdf2imageが利用できないため、図を含むページもテキストのみで送信します")
+    
+    prompt = create_analysis_prompt(school, subject, year, source="text")
+    analysis_result = await call_claude(
+        before_request, send_text_and_figures_to_claude, prompt, text_by_page, figure_images
+    )
+    
+    logger.info(f"PDF分析完了（テキストモード）: ID={pdf_id}")
+    return {
+        "success": True,
+        "analysis": analysis_result,
+        "pdf_file_size": os.path.getsize(pdf_path),
+        "pages_converted": len(figure_images),
+        "text_pages": len(text_by_page),
+        "total_pages": page_count,
+        "chunks": 1,
+        "mode": "text"
+    }
+
+def convert_pdf_to_images(pdf_path: str, pages: Optional[List[int]] = None) -> Optional[List[str]]:
     """
-    PDFファイルを画像に変換する
+    PDFファイルを画像に変換する（pagesを指定した場合はそのページのみ）
     """
     if not PDF2IMAGE_AVAILABLE:
         logger.warning("PDF to image conversion is not available (pdf2image is not installed)")
@@ -101,8 +245,8 @@ def convert_pdf_to_images(pdf_path: str) -> Optional[List[str]]:
     try:
         logger.info(f"PDFを画像に変換中: {pdf_path}")
         
-        # PDFの各ページを画像に変換
-        images = convert_from_path(pdf_path, dpi=200)
+        # PDFの各ページを画像に変換（OCRと共有のページ画像キャッシュを使う）
+        images = page_cache.get_page_images(pdf_path, pages or None)
         logger.info(f"PDF変換完了: {len(images)} ページ")
         
         # 画像をbase64エンコード
@@ -125,12 +269,17 @@ def convert_pdf_to_images(pdf_path: str) -> Optional[List[str]]:
         logger.error(f"PDF画像変換エラー: {str(e)}")
         return None
 
-def create_analysis_prompt(school: str, subject: str, year: int) -> str:
+def create_analysis_prompt(school: str, subject: str, year: int, source: str = "images") -> str:
     """
     Claudeへの分析プロンプトを作成する
     """
+    if source == "text":
+        target = "PDFファイルから抽出したテキスト（図を含むページは画像も添付）"
+    else:
+        target = "PDFファイルの画像"
+    
     prompt = f"""
-以下のPDFファイルの画像を詳細に分析してください。
+以下の{target}を詳細に分析してください。
 
 **PDF情報:**
 - 学校: {school}
@@ -269,39 +418,165 @@ def create_analysis_prompt(school: str, subject: str, year: int) -> str:
 """
     return prompt
 
-def send_images_to_claude(prompt: str, images: List[str]) -> str:
+def split_into_chunks(images: List[str], chunk_size: int) -> List[List[str]]:
+    """
+    ページ画像をchunk_sizeページずつのグループに分割する
+    """
+    return [images[i:i + chunk_size] for i in range(0, len(images), chunk_size)]
+
+def create_chunk_prompt(school: str, subject: str, year: int, start_page: int, end_page: int, total_pages: int) -> str:
+    """
+    分割分析用（ページグループごと）のプロンプトを作成する
+    """
+    return f"""
+以下は入試問題PDF（全{total_pages}ページ）のうち、{start_page}〜{end_page}ページ目の画像です。
+
+**PDF情報:**
+- 学校: {school}
+- 科目: {subject}
+- 年度: {year}
+
+このページ範囲について、後で全体の分析に統合するための要約を作成してください：
+- 含まれる大問・小問の番号、テーマ・分野、出題形式
+- 配点や試験時間など読み取れる情報
+- 各問題の難易度と特徴的な問題
+- 思考力を問う要素や時事的要素
+
+ページ範囲外の内容を推測せず、このページ範囲で確認できる事実を箇条書きで簡潔に回答してください。
+"""
+
+def create_synthesis_prompt(school: str, subject: str, year: int, chunk_results: List[str], total_pages: int) -> str:
+    """
+    ページグループごとの分析結果を統合するためのプロンプトを作成する
+    """
+    sections = []
+    for i, result in enumerate(chunk_results, 1):
+        sections.append(f"--- 部分分析 {i} ---\n{result}")
+    joined = "\n\n".join(sections)
+    
+    return f"""
+以下は、全{total_pages}ページの入試問題PDFをページ順に分割して分析した結果です。
+これらを統合し、PDF全体についての分析を作成してください。
+
+{joined}
+
+{create_analysis_prompt(school, subject, year)}
+"""
+
+async def analyze_images_in_chunks(
+    school: str,
+    subject: str,
+    year: int,
+    images: List[str],
+    chunk_size: int,
+    before_request: BeforeRequest = None
+) -> tuple:
+    """
+    ページをグループに分割して並行に分析し、最後に統合用の呼び出しで結果をまとめる
+    戻り値: (統合された分析結果, 分割数)
+    """
+    chunks = split_into_chunks(images, chunk_size)
+    total_pages = len(images)
+    logger.info(f"分割分析開始: {total_pages} ページを {len(chunks)} グループに分割")
+    
+    # 同時リクエスト数を制限（APIのレート制限対策）
+    semaphore = asyncio.Semaphore(max(1, settings.ANALYSIS_MAX_CONCURRENCY))
+    
+    async def analyze_chunk(index: int, chunk: List[str]) -> str:
+        start_page = index * chunk_size + 1
+        end_page = start_page + len(chunk) - 1
+        prompt = create_chunk_prompt(school, subject, year, start_page, end_page, total_pages)
+        async with semaphore:
+            logger.info(f"分割分析: {start_page}〜{end_page} ページを送信")
+            return await call_claude(before_request, send_images_to_claude, prompt, chunk, 4000)
+    
+    # gatherは入力順に結果を返すため、ページ順は保たれる
+    chunk_results = await asyncio.gather(
+        *(analyze_chunk(i, chunk) for i, chunk in enumerate(chunks))
+    )
+    
+    synthesis_prompt = create_synthesis_prompt(school, subject, year, list(chunk_results), total_pages)
+    analysis_result = await call_claude(before_request, send_images_to_claude, synthesis_prompt, [])
+    logger.info(f"分割分析完了: {len(chunks)} グループを統合")
+    return analysis_result, len(chunks)
+
+def send_images_to_claude(prompt: str, images: List[str], max_tokens: int = 8000) -> str:
     """
     Claudeに画像を送信する
     """
+    logger.info(f"Claudeに画像を送信中... ({len(images)} ページ)")
+    
+    # メッセージの内容を構築
+    content = [
+        {
+            "type": "text",
+            "text": prompt
+        }
+    ]
+    
+    # 各画像を追加（1リクエストあたりの上限を超える分は分割分析で扱う）
+    max_pages = min(len(images), max(1, settings.ANALYSIS_CHUNK_SIZE))  # Claude APIの制限を考慮
+    if len(images) > max_pages:
+        logger.warning(f"{len(images)} ページ中 {max_pages} ページのみ送信します")
+    for i in range(max_pages):
+        content.append(create_image_block(images[i]))
+    
+    return send_content_to_claude(content, max_tokens)
+
+def send_text_and_figures_to_claude(
+    prompt: str,
+    text_by_page: Dict[int, str],
+    figure_images: Dict[int, str],
+    max_tokens: int = 8000
+) -> str:
+    """
+    Claudeにページごとのテキストと図を含むページの画像を送信する
+    """
+    logger.info(f"Claudeにテキストを送信中... ({len(text_by_page)} ページ, 図 {len(figure_images)} ページ)")
+    
+    content = [
+        {
+            "type": "text",
+            "text": prompt
+        }
+    ]
+    
+    # ページ順にテキストと図を並べる
+    for page_num in sorted(set(text_by_page) | set(figure_images)):
+        page_text = text_by_page.get(page_num, "")
+        content.append({
+            "type": "text",
+            "text": f"--- ページ {page_num} ---\n{page_text}"
+        })
+        if page_num in figure_images:
+            content.append(create_image_block(figure_images[page_num]))
+    
+    return send_content_to_claude(content, max_tokens)
+
+def create_image_block(image_base64: str) -> dict:
+    """
+    base64エンコード済みJPEG画像のコンテンツブロックを作成する
+    """
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": "image/jpeg",
+            "data": image_base64
+        }
+    }
+
+def send_content_to_claude(content: List[dict], max_tokens: int = 8000) -> str:
+    """
+    構築済みのメッセージ内容をClaudeに送信し、応答テキストを返す
+    """
     try:
         if not anthropic:
             raise Exception("Anthropic APIクライアントが初期化されていません")
         
-        logger.info(f"Claudeに画像を送信中... ({len(images)} ページ)")
-        
-        # メッセージの内容を構築
-        content = [
-            {
-                "type": "text",
-                "text": prompt
-            }
-        ]
-        
-        # 各画像を追加（最大10ページまで）
-        max_pages = min(len(images), 10)  # Claude APIの制限を考慮
-        for i in range(max_pages):
-            content.append({
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/jpeg",
-                    "data": images[i]
-                }
-            })
-        
         message = anthropic.messages.create(
             model="claude-3-5-sonnet-20241022",
-            max_tokens=8000,  # 詳細分析のためにトークン数を設定（上限内）
+            max_tokens=max_tokens,  # 詳細分析のためにトークン数を設定（上限内）
             messages=[
                 {
                     "role": "user",
@@ -322,7 +597,12 @@ def send_images_to_claude(prompt: str, images: List[str]) -> str:
         
         # より詳細なエラーメッセージを提供
         error_msg = str(e)
-        if "timeout" in error_msg.lower():
+        if isinstance(e, RateLimitError):
+            raise AnalysisRateLimitError(
+                "AI分析の利用制限に達しました。しばらくしてから再試行してください",
+                retry_after=get_retry_after(e)
+            )
+        elif "timeout" in error_msg.lower():
             raise Exception("AI分析がタイムアウトしました。しばらくしてから再試行してください")
         elif "rate limit" in error_msg.lower():
             raise Exception("AI分析の利用制限に達しました。しばらくしてから再試行してください")
@@ -0,0 +1,249 @@
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional, List, Dict
+
+import crud
+from database import SessionLocal, AsyncSessionLocal
+import ai_analysis
+
+# 環境設定の読み込み
+try:
+    from config import config as settings
+except ImportError:
+    # フォールバック設定
+    class FallbackSettings:
+        UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploaded_pdfs")
+        BATCH_CHECKPOINT_DIR = os.getenv("BATCH_CHECKPOINT_DIR", "batch_checkpoints")
+        BATCH_ANALYSIS_CONCURRENCY = int(os.getenv("BATCH_ANALYSIS_CONCURRENCY", "2"))
+        ANALYSIS_RATE_PER_MINUTE = float(os.getenv("ANALYSIS_RATE_PER_MINUTE", "10"))
+        ANALYSIS_RATE_BURST = int(os.getenv("ANALYSIS_RATE_BURST", "2"))
+
+    settings = FallbackSettings()
+
+logger = logging.getLogger(__name__)
+
+# レート制限で失敗したPDFを再試行する最大回数
+MAX_RATE_LIMIT_RETRIES = 5
+# retry-afterが返されなかった場合の待ち時間（秒）
+DEFAULT_RETRY_AFTER = 30.0
+# job_idはチェックポイントのファイル名になるため、ディレクトリの外を指せない文字に限る
+JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class JobNotFoundError(LookupError):
+    """再開を指定したjob_idのチェックポイントが無い"""
+
+
+class TokenBucket:
+    """
+    Claude API呼び出し用のトークンバケット
+    rate_per_minuteの速度でトークンを補充し、429を受けたらretry-afterの間すべての取得を止める
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: int):
+        self.rate = max(rate_per_minute, 0.001) / 60.0  # 1秒あたりの補充数
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        """トークンを1つ取得する（取得できるまで待機）"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """429を受けた場合に、指定秒数トークンの払い出しを止めてバケットを空にする"""
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+        self.updated_at = now
+
+
+class BatchAnalysisJob:
+    """
+    条件に一致するPDFをまとめてAI分析するジョブ
+    進捗はチェックポイントファイル（JSON）に保存し、同じjob_idで再実行すると続きから再開する
+    job_idを指定した場合は再開のみ行い、チェックポイントが無ければJobNotFoundError、形式が不正ならValueError
+    （条件なしの新しいジョブとして全PDFを分析し始めないようにする）
+    """
+
+    def __init__(
+        self,
+        job_id: Optional[str] = None,
+        school: Optional[str] = None,
+        subject: Optional[str] = None,
+        year: Optional[int] = None,
+        mode: Optional[str] = None,
+        checkpoint_dir: Optional[str] = None
+    ):
+        if job_id is not None and not JOB_ID_PATTERN.match(job_id):
+            raise ValueError(f"job_idが不正です: {job_id}（英数字・_・-のみ）")
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.checkpoint_dir = checkpoint_dir or settings.BATCH_CHECKPOINT_DIR
+        self.checkpoint_path = os.path.join(self.checkpoint_dir, f"{self.job_id}.json")
+
+        state = load_checkpoint(self.job_id, self.checkpoint_dir) if job_id else None
+        if job_id and not state:
+            raise JobNotFoundError(f"ジョブが見つかりません: {job_id}")
+        if state:
+            # 既存ジョブの再開（絞り込み条件はチェックポイントのものを使う）
+            logger.info(f"バッチ分析ジョブを再開: {self.job_id}")
+            self.state = state
+        else:
+            self.state = {
+                "job_id": self.job_id,
+                "filters": {"school": school, "subject": subject, "year": year},
+                "mode": mode,
+                "status": "pending",
+                "pending": [],
+                "done": [],
+                "skipped": [],
+                "failed": {},
+                "created_at": datetime.utcnow().isoformat(),
+                "updated_at": None,
+            }
+
+    def save_checkpoint(self) -> None:
+        """チェックポイントを書き出す（一時ファイルに書いてから置き換える）"""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self.state["updated_at"] = datetime.utcnow().isoformat()
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _plan(self) -> List[Dict]:
+        """分析対象のPDFを決定する（分析結果が保存済みのPDFとチェックポイント上の完了分は除外）"""
+        filters = self.state["filters"]
+        finished = set(self.state["done"]) | set(self.state["skipped"])
+        db = SessionLocal()
+        try:
+            pdfs = crud.get_pdfs_by_filter(db, **filters)
+            analyzed_ids = crud.get_analyzed_pdf_ids(db, [pdf.id for pdf in pdfs])
+            targets = []
+            for pdf in pdfs:
+                if pdf.id in finished:
+                    continue
+                if pdf.id in analyzed_ids:
+                    self.state["skipped"].append(pdf.id)
+                    continue
+                targets.append({
+                    "id": pdf.id,
+                    "filename": pdf.filename,
+                    "school": pdf.school,
+                    "subject": pdf.subject,
+                    "year": pdf.year,
+                })
+            return targets
+        finally:
+            db.close()
+
+    async def _analyze_one(self, pdf: Dict, bucket: TokenBucket) -> None:
+        pdf_id = pdf["id"]
+        pdf_path = os.path.join(settings.UPLOAD_DIR, pdf["filename"])
+        if not os.path.exists(pdf_path):
+            self.state["failed"][str(pdf_id)] = "PDFファイルが見つかりません"
+            return
+
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            # トークンはPDFごとではなくAPI呼び出しごとに取得する（分割分析では1件のPDFで複数回呼び出すため）
+            result = await ai_analysis.analyze_pdf_with_claude(
+                pdf_id=pdf_id,
+                pdf_path=pdf_path,
+                school=pdf["school"],
+                subject=pdf["subject"],
+                year=pdf["year"],
+                mode=self.state["mode"],
+                before_request=bucket.acquire
+            )
+            if result.get("success"):
+                break
+            if "retry_after" in result and attempt < MAX_RATE_LIMIT_RETRIES:
+                wait = result["retry_after"] or DEFAULT_RETRY_AFTER
+                logger.warning(f"レート制限のため {wait:.1f} 秒待機します: PDF ID={pdf_id}")
+                bucket.pause(wait)
+                continue
+            self.state["failed"][str(pdf_id)] = result.get("error", "不明なエラー")
+            return
+
+        async with AsyncSessionLocal() as db:
+            await crud.create_analysis_async(db, pdf_id, result)
+        self.state["done"].append(pdf_id)
+        self.state["failed"].pop(str(pdf_id), None)
+
+    async def run(self) -> dict:
+        """ジョブを実行し、最終状態を返す"""
+        targets = await asyncio.to_thread(self._plan)
+        self.state["pending"] = [pdf["id"] for pdf in targets]
+        self.state["status"] = "running"
+        self.save_checkpoint()
+        logger.info(f"バッチ分析開始: {self.job_id}, 対象 {len(targets)} 件, スキップ {len(self.state['skipped'])} 件")
+
+        bucket = TokenBucket(settings.ANALYSIS_RATE_PER_MINUTE, settings.ANALYSIS_RATE_BURST)
+        queue: asyncio.Queue = asyncio.Queue()
+        for pdf in targets:
+            queue.put_nowait(pdf)
+
+        async def worker():
+            while True:
+                try:
+                    pdf = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    await self._analyze_one(pdf, bucket)
+                except Exception as e:
+                    logger.error(f"バッチ分析エラー: PDF ID={pdf['id']}, エラー={str(e)}")
+                    self.state["failed"][str(pdf["id"])] = str(e)
+                finally:
+                    self.state["pending"].remove(pdf["id"])
+                    # 1件ごとにチェックポイントを保存（中断しても完了分はやり直さない）
+                    self.save_checkpoint()
+
+        concurrency = max(1, settings.BATCH_ANALYSIS_CONCURRENCY)
+        try:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            self.state["status"] = "completed"
+        except asyncio.CancelledError:
+            self.state["status"] = "interrupted"
+            raise
+        finally:
+            self.save_checkpoint()
+            logger.info(
+                f"バッチ分析終了: {self.job_id}, 完了 {len(self.state['done'])} 件, "
+                f"失敗 {len(self.state['failed'])} 件, スキップ {len(self.state['skipped'])} 件"
+            )
+        return self.state
+
+
+def load_checkpoint(job_id: str, checkpoint_dir: Optional[str] = None) -> Optional[dict]:
+    """チェックポイントファイルからジョブの状態を読み込む（無い・job_idの形式が不正ならNone）"""
+    if not JOB_ID_PATTERN.match(job_id):
+        return None
+    checkpoint_dir = checkpoint_dir or settings.BATCH_CHECKPOINT_DIR
+    path = os.path.join(checkpoint_dir, f"{job_id}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,88 @@
+"""
+変更の少ない一覧（学校一覧・問題タイプ一覧など）のプロセス内キャッシュ
+
+値はTTLで期限切れになるほか、crudの書き込み関数がコミット後に
+invalidate() を呼んで名前空間ごと破棄する。
+複数ワーカーで動かす場合はCACHE_SHARED_GENERATION=trueにすると、
+書き込みと同じトランザクションでDBのcache_generationsの世代番号を進め、
+読み込み時にその番号を比べて他のワーカーでの更新も検出する。
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from sqlalchemy import select
+
+import models
+
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "300"))
+CACHE_SHARED_GENERATION = os.getenv("CACHE_SHARED_GENERATION", "false").lower() == "true"
+
+# 名前空間
+SCHOOLS = "schools"
+QUESTION_TYPES = "question_types"
+FACETS = "facets"
+PDFS = "pdfs"
+QUESTIONS = "questions"
+# 重複検出の指紋（dedup.py。値はキャッシュせず、インデックスの読み直しの判定に世代番号だけを使う）
+FINGERPRINTS = "fingerprints"
+
+_lock = threading.Lock()
+# (名前空間, キー) -> (期限, DBの世代番号, 値)
+_entries: Dict[Tuple[str, Hashable], Tuple[float, int, Any]] = {}
+# 名前空間 -> プロセス内の世代番号（読み込み中に破棄された値を保存しないために使う）
+_local_generations: Dict[str, int] = {}
+
+
+def shared_generation(db, namespace: str) -> int:
+    """DBの世代番号（CACHE_SHARED_GENERATIONが無効なら常に0）"""
+    if not CACHE_SHARED_GENERATION or db is None:
+        return 0
+    generation = db.execute(
+        select(models.CacheGeneration.generation).where(models.CacheGeneration.name == namespace)
+    ).scalar()
+    return generation or 0
+
+
+def local_generation(namespace: str) -> int:
+    """プロセス内の世代番号（invalidate()のたびに増える）"""
+    with _lock:
+        return _local_generations.get(namespace, 0)
+
+
+def get_or_load(namespace: str, key: Hashable, loader: Callable[[], Any], db=None, ttl: Optional[float] = None) -> Any:
+    """
+    キャッシュされた値を返す（無い・期限切れ・DBの世代番号が変わっている場合はloader()で読み込む）
+    値は呼び出し元どうしで共有されるため、セッションに紐づかない値（スキーマや文字列）を返すこと
+    """
+    ttl = CACHE_TTL_SECONDS if ttl is None else ttl
+    generation = shared_generation(db, namespace)
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get((namespace, key))
+        local_generation = _local_generations.get(namespace, 0)
+    if entry and entry[0] > now and entry[1] == generation:
+        return entry[2]
+
+    value = loader()
+    with _lock:
+        if _local_generations.get(namespace, 0) == local_generation:
+            _entries[(namespace, key)] = (now + ttl, generation, value)
+    return value
+
+
+def invalidate(*namespaces: str) -> None:
+    """名前空間のキャッシュを破棄する"""
+    with _lock:
+        for namespace in namespaces:
+            _local_generations[namespace] = _local_generations.get(namespace, 0) + 1
+        for entry_key in [k for k in _entries if k[0] in namespaces]:
+            del _entries[entry_key]
+
+
+def clear() -> None:
+    """全てのキャッシュを破棄する"""
+    with _lock:
+        namespaces = {namespace for namespace, _ in _entries}
+    invalidate(*namespaces)
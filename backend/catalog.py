@@ -0,0 +1,259 @@
+"""
+PDF一覧のメモリ上のカタログ（/pdfs/ と /pdfs/search をDBから行を読まずに返す）
+
+PDFは数千件程度と少なく、一覧は画面を開くたびに読まれるため、
+メタデータを列ごとの配列で持ち（学校名・科目名は番号にして同じ文字列を共有する）、
+各行をPDFOutのJSONにシリアライズ済みの状態で保持してレスポンスではそれを連結する。
+
+crudの書き込み関数がコミット後に反映する。他のワーカーでの書き込みはキャッシュ（cache.py）と同じく、
+CACHE_TTL_SECONDSの期限とDBの世代番号（CACHE_SHARED_GENERATION=true）で検出して読み直す。
+PDF_CATALOG_ENABLED=falseにすると、一覧は従来どおりDBから読む。
+"""
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Iterable, List, Optional, Tuple
+
+import cache
+import models
+import pagination
+import schemas
+
+ENABLED = os.getenv("PDF_CATALOG_ENABLED", "true").lower() == "true"
+
+_EPOCH = datetime(1970, 1, 1)
+_NO_TIME = -(1 << 63)  # created_atがNULLの行
+
+# (id, 学校, 科目, 年度, 作成日時, PDFOutのJSON)
+Entry = Tuple[int, str, str, int, Optional[datetime], bytes]
+
+
+def entry(pdf) -> Entry:
+    """PDF（ORMオブジェクト）をカタログの1行にする（コミット前に作り、コミット後にcatalog.applyに渡す）"""
+    json = schemas.PDFOut.model_validate(pdf).model_dump_json().encode("utf-8")
+    return pdf.id, pdf.school, pdf.subject, pdf.year, pdf.created_at, json
+
+
+def _micros(value: Optional[datetime]) -> int:
+    if value is None:
+        return _NO_TIME
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+
+def _datetime(micros: int) -> Optional[datetime]:
+    return None if micros == _NO_TIME else _EPOCH + timedelta(microseconds=micros)
+
+
+class _Strings:
+    """文字列の番号付け（学校名・科目名を行ごとに持たず、1つの文字列を共有する）"""
+    __slots__ = ("values", "codes")
+
+    def __init__(self):
+        self.values: List[str] = []
+        self.codes = {}
+
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(sys.intern(value))
+        return code
+
+
+class PDFCatalog:
+    """
+    行はidの昇順に並べ、位置で各列を参照する
+    並び替え（created_at・year）の順序は必要になった時に作り、書き込みで破棄する
+    """
+    __slots__ = (
+        "_lock", "ids", "schools", "subjects", "years", "created_at", "rows",
+        "_school_names", "_subject_names", "_orders", "_loaded_at", "_generation", "_version",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded_at: Optional[float] = None
+        self._generation = 0
+        self._version = 0  # apply()の回数（読み直し中に反映された書き込みの検出に使う）
+        self._clear()
+
+    def _clear(self) -> None:
+        self.ids = array("q")
+        self.schools = array("i")
+        self.subjects = array("i")
+        self.years = array("i")
+        self.created_at = array("q")
+        self.rows: List[bytes] = []
+        self._school_names = _Strings()
+        self._subject_names = _Strings()
+        self._orders = {}
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def is_stale(self, generation: int) -> bool:
+        return (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at > cache.CACHE_TTL_SECONDS
+            or generation != self._generation
+        )
+
+    # ---- 読み込みと書き込みの反映 ----
+
+    def _insert_locked(self, item: Entry) -> None:
+        pdf_id, school, subject, year, created_at, json = item
+        position = bisect_left(self.ids, pdf_id)
+        values = (
+            (self.schools, self._school_names.code(school or "")),
+            (self.subjects, self._subject_names.code(subject or "")),
+            (self.years, year),
+            (self.created_at, _micros(created_at)),
+        )
+        if position < len(self.ids) and self.ids[position] == pdf_id:
+            for column, value in values:
+                column[position] = value
+            self.rows[position] = json
+            return
+        self.ids.insert(position, pdf_id)
+        for column, value in values:
+            column.insert(position, value)
+        self.rows.insert(position, json)
+
+    def _remove_locked(self, pdf_id: int) -> None:
+        position = bisect_left(self.ids, pdf_id)
+        if position < len(self.ids) and self.ids[position] == pdf_id:
+            for column in (self.ids, self.schools, self.subjects, self.years, self.created_at):
+                column.pop(position)
+            self.rows.pop(position)
+
+    def load(self, entries: Iterable[Entry], generation: int = 0, version: Optional[int] = None) -> None:
+        """
+        全てのPDFで作り直す
+        version: 読み込み前のself.version（読み込み中に反映された書き込みがあれば、次の問い合わせで読み直す）
+        """
+        with self._lock:
+            self._clear()
+            for item in sorted(entries, key=lambda item: item[0]):
+                self._insert_locked(item)
+            self._generation = generation
+            self._loaded_at = time.monotonic()
+            if version is not None and version != self._version:
+                self._loaded_at = None
+
+    def apply(self, upserted: Iterable[Entry] = (), removed: Iterable[int] = ()) -> None:
+        """コミットされた書き込みを反映する"""
+        with self._lock:
+            for item in upserted:
+                self._insert_locked(item)
+            for pdf_id in removed:
+                self._remove_locked(pdf_id)
+            self._orders = {}
+            self._version += 1
+
+    # ---- 問い合わせ ----
+
+    def _order_locked(self, sort_key: str) -> Tuple[List[int], list]:
+        """(並び替えた行の位置, 各行の (ソートキー, id)) ※昇順"""
+        order = self._orders.get(sort_key)
+        if order is None:
+            if sort_key == "id":
+                keys = [(pdf_id, pdf_id) for pdf_id in self.ids]
+            else:
+                column = self.years if sort_key == "year" else self.created_at
+                keys = list(zip(column, self.ids))
+            positions = sorted(range(len(keys)), key=keys.__getitem__)
+            order = self._orders[sort_key] = (positions, [keys[position] for position in positions])
+        return order
+
+    def query(
+        self,
+        school: Optional[str] = None,
+        school_prefix: Optional[str] = None,
+        subject: Optional[str] = None,
+        year_from: Optional[int] = None,
+        year_to: Optional[int] = None,
+        skip: int = 0,
+        limit: int = 100,
+        after: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> Tuple[bytes, Optional[str]]:
+        """
+        crud.search_pdfsと同じ条件・並び順・カーソルで検索し、(JSON配列, 次ページのカーソル) を返す
+        不正なsort・afterはValueError
+        """
+        sort_key, descending = pagination.parse_sort(models.PDF, sort)
+        if limit <= 0:
+            return b"[]", None
+        pivot = None
+        if after:
+            value, last_id = pagination.decode_cursor(models.PDF, sort_key, after)
+            pivot = (last_id if sort_key == "id" else _micros(value) if sort_key == "created_at" else value, last_id)
+
+        with self._lock:
+            if school:
+                school_codes = {self._school_names.codes.get(school)}
+            elif school_prefix:
+                school_codes = {code for name, code in self._school_names.codes.items() if name.startswith(school_prefix)}
+            else:
+                school_codes = None
+            subject_code = self._subject_names.codes.get(subject) if subject else None
+            if (school_codes is not None and not school_codes - {None}) or (subject and subject_code is None):
+                return b"[]", None
+
+            positions, keys = self._order_locked(sort_key)
+            if descending:
+                end = bisect_left(keys, pivot) if pivot else len(keys)
+                candidates = (positions[i] for i in range(end - 1, -1, -1))
+            else:
+                start = bisect_right(keys, pivot) if pivot else 0
+                candidates = (positions[i] for i in range(start, len(keys)))
+
+            matched = []
+            for position in candidates:
+                if school_codes is not None and self.schools[position] not in school_codes:
+                    continue
+                if subject_code is not None and self.subjects[position] != subject_code:
+                    continue
+                year = self.years[position]
+                if (year_from is not None and year < year_from) or (year_to is not None and year > year_to):
+                    continue
+                if skip:
+                    skip -= 1
+                    continue
+                matched.append(position)
+                if len(matched) == limit:
+                    break
+
+            body = b"[" + b",".join(self.rows[position] for position in matched) + b"]"
+            cursor = None
+            if matched and len(matched) == limit:
+                last = matched[-1]
+                item = SimpleNamespace(id=self.ids[last], year=self.years[last], created_at=_datetime(self.created_at[last]))
+                cursor = pagination.encode_cursor(item, sort_key)
+        return body, cursor
+
+
+catalog = PDFCatalog()
+_load_lock = threading.Lock()
+
+
+def ensure_current(db) -> PDFCatalog:
+    """期限切れ・他のワーカーでの書き込みがあればDBから読み直す"""
+    import crud
+
+    generation = cache.shared_generation(db, cache.PDFS)
+    if catalog.is_stale(generation):
+        with _load_lock:
+            if catalog.is_stale(generation):
+                version = catalog.version
+                catalog.load([entry(pdf) for pdf in crud.get_pdfs_by_filter(db)], generation, version)
+    return catalog
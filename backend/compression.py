@@ -0,0 +1,256 @@
+"""
+JSONレスポンスの圧縮（gzip・brotli）
+
+Accept-Encodingに合わせてbrotli（brotliパッケージがある場合）かgzipで圧縮する。
+COMPRESSION_MIN_SIZEバイト未満の小さなレスポンスは圧縮しない（圧縮しても小さくならないため）。
+エクスポートなどのストリーミングレスポンスはチャンクごとに圧縮して送る。
+
+一覧のように同じ内容を何度も返すGETは、圧縮済みの本文を
+(パス, クエリ文字列, 圧縮形式) ごとに保存し、データの世代番号（cache.py）が同じ間は
+エンドポイントを呼ばずにそのまま返す。crudの書き込みで世代番号が進むと次のリクエストで作り直す。
+"""
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+import cache
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
+# 圧縮済みレスポンスの保存に使うメモリの上限（バイト）
+COMPRESSION_CACHE_MAX_BYTES = int(os.getenv("COMPRESSION_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson")
+# 同じ品質値なら先に書いたものを使う
+ENCODINGS = ("br", "gzip") if BROTLI_AVAILABLE else ("gzip",)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Accept-Encodingから使う圧縮形式を選ぶ（使えるものが無ければNone）"""
+    qualities = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip()] = quality
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class _Compressor:
+    """gzip・brotliの逐次圧縮（flush()までの出力をクライアントに届けられる）"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        if self.encoding == "br":
+            output = self._compressor.process(data)
+            return output + self._compressor.flush() if flush else output
+        output = self._compressor.compress(data)
+        return output + self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else output
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.finish()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH)
+
+
+class ResponseCache:
+    """圧縮済みレスポンスのLRU（保存した本文の合計がmax_bytesを超えたら古いものから捨てる）"""
+
+    def __init__(self, max_bytes: int = COMPRESSION_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # キー -> (期限, 世代番号, ステータス, ヘッダー, 本文)
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._size = 0
+
+    def get(self, key: tuple, generation: tuple) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic() or entry[1] != generation:
+                self._pop_locked(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2], entry[3], entry[4]
+
+    def put(self, key: tuple, generation: tuple, status: int, headers: list, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._pop_locked(key)
+            self._entries[key] = (time.monotonic() + cache.CACHE_TTL_SECONDS, generation, status, headers, body)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                self._pop_locked(next(iter(self._entries)))
+
+    def _pop_locked(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[4])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+response_cache = ResponseCache()
+
+
+def _shared_generations(namespaces: Sequence[str]) -> tuple:
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return tuple(cache.shared_generation(db, namespace) for namespace in namespaces)
+    finally:
+        db.close()
+
+
+async def data_generation(namespaces: Sequence[str]) -> tuple:
+    """名前空間のデータの世代番号（プロセス内、CACHE_SHARED_GENERATION=trueならDBの番号も含める）"""
+    local = tuple(cache.local_generation(namespace) for namespace in namespaces)
+    if not cache.CACHE_SHARED_GENERATION:
+        return local
+    return local + await run_in_threadpool(_shared_generations, namespaces)
+
+
+class CompressionMiddleware:
+    """
+    JSONレスポンスを圧縮するASGIミドルウェア
+    cacheable: 圧縮済みの本文を保存してよいGETのパス -> 内容が依存する名前空間（cache.py）
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, cacheable: Dict[str, Tuple[str, ...]] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cacheable = cacheable or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        key = generation = None
+        namespaces = self.cacheable.get(scope["path"]) if scope["method"] == "GET" else None
+        if namespaces:
+            key = (scope["path"], scope["query_string"], encoding)
+            generation = await data_generation(namespaces)
+            cached = response_cache.get(key, generation)
+            if cached is not None:
+                status, headers, body = cached
+                # 外側のミドルウェア（CORS）がヘッダーのリストに追記するため、保存したものは渡さない
+                await send({"type": "http.response.start", "status": status, "headers": list(headers)})
+                await send({"type": "http.response.body", "body": body})
+                return
+
+        responder = _CompressingSender(send, encoding, self.minimum_size, key, generation)
+        await self.app(scope, receive, responder)
+
+
+class _CompressingSender:
+    """アプリのsendを受けて、圧縮対象なら圧縮して送る"""
+
+    def __init__(self, send, encoding: str, minimum_size: int, key: Optional[tuple], generation: Optional[tuple]):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.key = key
+        self.generation = generation
+        self.start = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+
+    def _compressible(self) -> bool:
+        headers = Headers(raw=self.start["headers"])
+        content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        return (
+            content_type in COMPRESSIBLE_TYPES
+            and "content-encoding" not in headers
+            and self.start["status"] not in (204, 206, 304)
+        )
+
+    def _compressed_headers(self) -> MutableHeaders:
+        headers = MutableHeaders(raw=list(self.start["headers"]))
+        headers["content-encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if "content-length" in headers:
+            del headers["content-length"]
+        return headers
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+        if self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            if not self._compressible() or (not more_body and len(body) < self.minimum_size):
+                self.passthrough = True
+                await self.send(self.start)
+                await self.send(message)
+                return
+            self.compressor = _Compressor(self.encoding)
+            headers = self._compressed_headers()
+            if not more_body:
+                compressed = self.compressor.finish(body)
+                headers["content-length"] = str(len(compressed))
+                if self.key is not None and self.start["status"] == 200:
+                    response_cache.put(self.key, self.generation, 200, list(headers.raw), compressed)
+                await self.send({**self.start, "headers": headers.raw})
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+            # ストリーミング（長さが分からないためContent-Lengthは付けない）
+            await self.send({**self.start, "headers": headers.raw})
+
+        if more_body:
+            chunk = self.compressor.compress(body, flush=True)
+            if chunk:
+                await self.send({"type": "http.response.body", "body": chunk, "more_body": True})
+        else:
+            await self.send({"type": "http.response.body", "body": self.compressor.finish(body)})
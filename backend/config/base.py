@@ -20,6 +20,32 @@ class BaseConfig:
         
         # API設定
         self.ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+        # APIの接続先（未設定なら公式エンドポイント。負荷試験ではscripts/mock_anthropic_server.pyを指定）
+        self.ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL") or None
+        self.ANTHROPIC_MAX_RETRIES = int(os.getenv("ANTHROPIC_MAX_RETRIES", "2"))
+        
+        # AI分析設定（1リクエストあたりのページ数と同時リクエスト数）
+        self.ANALYSIS_CHUNK_SIZE = int(os.getenv("ANALYSIS_CHUNK_SIZE", "10"))
+        self.ANALYSIS_MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", "3"))
+        # 分析モード（auto: テキスト層が使える場合はテキスト中心、text、image）
+        self.ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "auto")
+        
+        # 一括AI分析設定（トークンバケットの補充速度・バースト数、同時実行数、チェックポイント保存先）
+        self.ANALYSIS_RATE_PER_MINUTE = float(os.getenv("ANALYSIS_RATE_PER_MINUTE", "10"))
+        self.ANALYSIS_RATE_BURST = int(os.getenv("ANALYSIS_RATE_BURST", "2"))
+        self.BATCH_ANALYSIS_CONCURRENCY = int(os.getenv("BATCH_ANALYSIS_CONCURRENCY", "2"))
+        self.BATCH_CHECKPOINT_DIR = os.getenv("BATCH_CHECKPOINT_DIR", "batch_checkpoints")
+        
+        # ページ画像キャッシュ設定（OCR・AI分析・プレビューで共有）
+        self.PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", "page_cache")
+        self.PAGE_CACHE_MAX_MB = int(os.getenv("PAGE_CACHE_MAX_MB", "500"))
+        self.PAGE_RENDER_DPI = int(os.getenv("PAGE_RENDER_DPI", "200"))
+        
+        # 類似問題の索引の保存先
+        self.SIMILAR_INDEX_DIR = os.getenv("SIMILAR_INDEX_DIR", "similar_index")
+        
+        # 学校名の入力補完で使う読み（JSON: {学校名: [読み, ...]}）
+        self.SCHOOL_ALIASES_FILE = os.getenv("SCHOOL_ALIASES_FILE", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "school_aliases.json"))
         
         # セキュリティ設定
         self.SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
@@ -1,10 +1,57 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select, delete, insert, update, func, text, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
 from sqlalchemy.exc import OperationalError, IntegrityError
 import time
-import models, schemas
-from typing import List, Optional
+import asyncio
+import html
+import models, schemas, migrations, cache, catalog, dedup, similar, school_suggest
+from pagination import keyset_query, parse_sort
+from typing import List, Optional, Iterable, AsyncIterator, Dict, Tuple
+from collections import Counter
+
+def _dialect_name(db) -> str:
+    return db.get_bind().dialect.name
+
+def _insert_for(db, model):
+    """
+    接続先のDBに合わせたINSERT文を作る
+    SQLite・PostgreSQLではON CONFLICT（on_conflict_do_nothing / on_conflict_do_update）が使える
+    """
+    dialect = _dialect_name(db)
+    if dialect == "postgresql":
+        return postgresql.insert(model)
+    if dialect == "sqlite":
+        return sqlite.insert(model)
+    return None
+
+def _supports_returning(db) -> bool:
+    return bool(getattr(db.get_bind().dialect, "insert_returning", False))
+
+def _create_pdf_statement(db, pdf: schemas.PDFCreate):
+    """
+    ファイル名が重複する場合は何もしないINSERT ... RETURNING（使えないDBではNone）
+    重複チェックと挿入が1文で済み、同名の同時登録でも一意制約違反にならない
+    """
+    stmt = _insert_for(db, models.PDF)
+    if stmt is None or not _supports_returning(db) or not migrations.filename_unique:
+        return None
+    return stmt.values(**pdf.dict()).on_conflict_do_nothing().returning(models.PDF)
 
 def create_pdf(db: Session, pdf: schemas.PDFCreate):
+    stmt = _create_pdf_statement(db, pdf)
+    if stmt is not None:
+        db_pdf = db.execute(stmt).scalars().first()
+        if db_pdf is None:
+            raise ValueError(f"ファイル名 '{pdf.filename}' は既に存在します")
+        _update_facets(db, {_facet_key(db_pdf): 1})
+        _sync_catalog(db, upserted=[db_pdf])
+        _commit(db)
+        return db_pdf
+
     # ファイル名の重複チェック
     existing_pdf = db.query(models.PDF).filter(models.PDF.filename == pdf.filename).first()
     if existing_pdf:
@@ -12,44 +59,191 @@ def create_pdf(db: Session, pdf: schemas.PDFCreate):
     
     db_pdf = models.PDF(**pdf.dict())
     db.add(db_pdf)
-    db.commit()
+    _update_facets(db, {_facet_key(db_pdf): 1})
+    _sync_catalog(db, upserted=[db_pdf])
+    _commit(db)
     db.refresh(db_pdf)
     return db_pdf
 
-def get_pdfs(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.PDF).offset(skip).limit(limit).all()
+# upsert_pdfで同名PDFの同時削除と競合したときにやり直す回数
+UPSERT_ATTEMPTS = 3
+
+def upsert_pdf(db: Session, pdf: schemas.PDFCreate):
+    """
+    同じファイル名のPDFがあればメタデータを更新し、無ければ作成する
+    作成か更新かは INSERT ... ON CONFLICT DO NOTHING RETURNING の結果で決める（別のSELECTで判断しない）。
+    同名ファイルの同時アップロードでも作成として数えるのは1件だけになり、集計テーブルの件数がずれない。
+    更新の場合は変更前の値を行ロック（SQLiteではINSERTで取得した書き込みロック）を持ったまま読むため、
+    集計から減らす学校・科目・年度も他のトランザクションに変えられない
+    """
+    stmt = _create_pdf_statement(db, pdf)
+    if stmt is None:
+        existing_pdf = get_pdf_by_filename(db, pdf.filename)
+        if existing_pdf:
+            return update_pdf(db, existing_pdf.id, pdf.dict(exclude={"filename"}))
+        return create_pdf(db, pdf)
+
+    values = pdf.dict(exclude={"filename"})
+    for _ in range(UPSERT_ATTEMPTS):
+        db_pdf = db.execute(stmt).scalars().first()
+        if db_pdf is not None:
+            deltas = Counter({_facet_key(db_pdf): 1})
+            break
+        previous = db.execute(
+            select(models.PDF.id, models.PDF.school, models.PDF.subject, models.PDF.year)
+            .where(models.PDF.filename == pdf.filename)
+            .with_for_update()
+        ).first()
+        if previous is None:
+            # INSERTの後に同名のPDFが削除された。もう一度INSERTから行う
+            continue
+        # セッション内に同じPDFが読み込み済みの場合も、RETURNINGの値で更新する
+        db_pdf = db.execute(
+            update(models.PDF).where(models.PDF.id == previous.id).values(**values).returning(models.PDF),
+            execution_options={"populate_existing": True}
+        ).scalars().one()
+        deltas = Counter({_facet_key(db_pdf): 1})
+        deltas[(previous.school, previous.subject, previous.year)] -= 1
+        break
+    else:
+        raise ValueError(f"ファイル名 '{pdf.filename}' のPDFの登録と削除が競合しました。再度お試しください")
+    _update_facets(db, deltas)
+    _sync_catalog(db, upserted=[db_pdf])
+    _commit(db)
+    return db_pdf
+
+def get_pdfs(db: Session, skip: int = 0, limit: int = 100, after: Optional[str] = None, sort: Optional[str] = None):
+    query = keyset_query(db.query(models.PDF), models.PDF, sort, after)
+    return query.offset(skip).limit(limit).all()
 
-def get_pdfs_by_school(db: Session, school: str, skip: int = 0, limit: int = 100):
-    return db.query(models.PDF).filter(models.PDF.school == school).offset(skip).limit(limit).all()
+def get_pdfs_by_school(db: Session, school: str, skip: int = 0, limit: int = 100, after: Optional[str] = None, sort: Optional[str] = None):
+    query = keyset_query(db.query(models.PDF).filter(models.PDF.school == school), models.PDF, sort, after)
+    return query.offset(skip).limit(limit).all()
 
 def get_distinct_schools(db: Session):
-    """全ての学校名を重複なしで取得"""
-    result = db.query(models.PDF.school).distinct().all()
+    """全ての学校名を重複なしで取得（pdfsではなく集計テーブルから読む）"""
+    result = db.query(models.PDFFacet.school).distinct().all()
     return [school[0] for school in result if school[0]]
 
+def get_school_counts(db: Session) -> List[tuple]:
+    """学校ごとのPDF件数 [(学校名, 件数)]（集計テーブルから読む）"""
+    result = db.query(models.PDFFacet.school, func.sum(models.PDFFacet.pdf_count)).group_by(models.PDFFacet.school)
+    return [(school, int(count)) for school, count in result if school]
+
+def _prefix_upper_bound(prefix: str) -> str:
+    """前方一致を範囲検索にするための上限（prefix <= 値 < 上限）"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def search_pdfs(
+    db: Session,
+    school: Optional[str] = None,
+    school_prefix: Optional[str] = None,
+    subject: Optional[str] = None,
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    limit: int = 100,
+    after: Optional[str] = None,
+    sort: Optional[str] = None
+):
+    """
+    学校（完全一致・前方一致）・科目・年度の範囲でPDFを検索する
+    前方一致はLIKEではなく範囲条件にして、(school, subject, year) のインデックスで検索させる
+    """
+    query = db.query(models.PDF)
+    if school:
+        query = query.filter(models.PDF.school == school)
+    elif school_prefix:
+        query = query.filter(models.PDF.school >= school_prefix, models.PDF.school < _prefix_upper_bound(school_prefix))
+    if subject:
+        query = query.filter(models.PDF.subject == subject)
+    if year_from is not None:
+        query = query.filter(models.PDF.year >= year_from)
+    if year_to is not None:
+        query = query.filter(models.PDF.year <= year_to)
+    return keyset_query(query, models.PDF, sort, after).limit(limit).all()
+
+def get_facets(db: Session, school: Optional[str] = None, subject: Optional[str] = None, year: Optional[int] = None) -> dict:
+    """
+    学校・科目・年度ごとのPDF件数（絞り込みUI用）
+    集計テーブルを読むため、PDFの件数ではなく組み合わせの数に比例する
+    各項目の件数は他の項目の条件だけで絞り込む（例: school指定時も学校ごとの件数は全学校分返す）
+    """
+    table = models.PDFFacet
+    conditions = {"school": table.school == school if school else None,
+                  "subject": table.subject == subject if subject else None,
+                  "year": table.year == year if year else None}
+
+    def where(*excluded):
+        return [condition for name, condition in conditions.items() if condition is not None and name not in excluded]
+
+    def counts(name, descending=False):
+        column = getattr(table, name)
+        rows = (
+            db.query(column, func.sum(table.pdf_count))
+            .filter(*where(name))
+            .group_by(column)
+            .order_by(column.desc() if descending else column)
+        )
+        return [{"value": value, "count": int(count)} for value, count in rows]
+
+    total = db.query(func.coalesce(func.sum(table.pdf_count), 0)).filter(*where()).scalar()
+    return {
+        "total": int(total),
+        "schools": counts("school"),
+        "subjects": counts("subject"),
+        "years": counts("year", descending=True),
+    }
+
 def get_pdf_by_filename(db: Session, filename: str):
     return db.query(models.PDF).filter(models.PDF.filename == filename).first()
 
 def get_pdf_by_id(db: Session, pdf_id: int):
     return db.query(models.PDF).filter(models.PDF.id == pdf_id).first()
 
+def get_pdfs_by_filter(db: Session, school: Optional[str] = None, subject: Optional[str] = None, year: Optional[int] = None):
+    """学校・科目・年度で絞り込んだPDF一覧を取得（未指定の条件は無視）"""
+    query = db.query(models.PDF)
+    if school:
+        query = query.filter(models.PDF.school == school)
+    if subject:
+        query = query.filter(models.PDF.subject == subject)
+    if year:
+        query = query.filter(models.PDF.year == year)
+    return query.order_by(models.PDF.id).all()
+
 def update_pdf(db: Session, pdf_id: int, pdf_update: dict):
     """PDFのメタデータを更新する"""
     db_pdf = db.query(models.PDF).filter(models.PDF.id == pdf_id).first()
     if db_pdf:
+        previous = _facet_key(db_pdf)
         for key, value in pdf_update.items():
             if hasattr(db_pdf, key):
                 setattr(db_pdf, key, value)
-        db.commit()
+        deltas = Counter({previous: -1})
+        deltas[_facet_key(db_pdf)] += 1
+        _update_facets(db, deltas)
+        _sync_catalog(db, upserted=[db_pdf])
+        _commit(db)
         db.refresh(db_pdf)
     return db_pdf
 
 def _commit_with_retry(db: Session, max_retries: int = 5, base_sleep: float = 0.1) -> None:
-    """Commit with retries to mitigate SQLite 'database is locked' issues."""
+    """Commit with retries to mitigate SQLite 'database is locked' issues.
+
+    With busy_timeout set on every connection (see database.py) SQLite already
+    waits for the lock itself, so this is only a last resort. Other databases
+    roll the transaction back on a failed commit, so they are never retried.
+    """
+    if _dialect_name(db) != "sqlite":
+        db.commit()
+        _run_after_commit(db)
+        return
+
     attempt = 0
     while True:
         try:
             db.commit()
+            _run_after_commit(db)
             return
         except OperationalError as e:
             message = str(e).lower()
@@ -64,62 +258,216 @@ def _commit_with_retry(db: Session, max_retries: int = 5, base_sleep: float = 0.
             raise
 
 
-def delete_pdf(db: Session, pdf_id: int) -> bool:
-    """PDFレコードをデータベースから削除する。関連する質問も削除する。"""
-    try:
-        print(f"=== PDF削除処理開始: ID {pdf_id} ===")
+def _after_commit(db, fn) -> None:
+    """
+    コミット後に実行する処理を登録する
+    書き込みキュー内ではキューがまとめてコミットした後に実行する（database.GroupCommitWriter）
+    """
+    db.info.setdefault("after_commit", []).append(fn)
+
 
-        # PDFレコードを取得
-        db_pdf = db.query(models.PDF).filter(models.PDF.id == pdf_id).first()
-        if not db_pdf:
-            print(f"PDFが見つかりません: ID {pdf_id}")
-            return False
+@event.listens_for(Session, "after_rollback")
+def _discard_after_commit(session) -> None:
+    """ロールバックした書き込みのコミット後処理は実行しない（書き込みキューのセッションはキューが管理する）"""
+    if not session.info.get("deferred_commit"):
+        session.info.pop("after_commit", None)
 
-        print(f"PDF情報: ID {pdf_id}, ファイル名: {db_pdf.filename}")
 
-        # 子テーブル（questions）を先に削除（まずはバルク、失敗時は個別フォールバック）
+def _run_after_commit(db) -> None:
+    if db.info.get("deferred_commit"):
+        return
+    hooks = db.info.pop("after_commit", [])
+    for hook in hooks:
         try:
-            deleted_count = db.query(models.Question).filter(models.Question.pdf_id == pdf_id).delete(synchronize_session=False)
-            if deleted_count:
-                print(f"関連する質問を {deleted_count} 件バルク削除しました")
-            _commit_with_retry(db)
-        except (OperationalError, IntegrityError) as e:
-            print(f"バルク削除失敗、個別削除にフォールバックします: {str(e)}")
-            db.rollback()
-            related_questions = db.query(models.Question).filter(models.Question.pdf_id == pdf_id).all()
-            print(f"個別削除対象: {len(related_questions)} 件")
-            for idx, question in enumerate(related_questions, 1):
-                try:
-                    db.delete(question)
-                    if idx % 50 == 0:
-                        _commit_with_retry(db)
-                except Exception as qe:
-                    print(f"質問ID {getattr(question, 'id', 'unknown')} の削除エラー: {qe}")
-            _commit_with_retry(db)
-
-        # 親PDFを削除
-        print("PDFレコードを削除中...")
-        db.delete(db_pdf)
+            hook()
+        except Exception as e:
+            print(f"コミット後処理エラー: {str(e)}")
+
+
+def _generation_bump_statement(db, namespace: str):
+    """キャッシュの共有世代番号を1増やす文（行が無ければ作成する）"""
+    table = models.CacheGeneration
+    stmt = _insert_for(db, table)
+    if stmt is None:
+        return update(table).where(table.name == namespace).values(generation=table.generation + 1)
+    return stmt.values(name=namespace, generation=1).on_conflict_do_update(
+        index_elements=[table.name],
+        set_={"generation": table.generation + 1},
+    )
+
+
+def _invalidate_cache(db: Session, *namespaces: str) -> None:
+    """
+    書き込み後（コミット前）に呼び、コミット後にキャッシュを破棄する
+    共有世代番号は書き込みと同じトランザクションで進める
+    """
+    if cache.CACHE_SHARED_GENERATION:
+        for namespace in namespaces:
+            db.execute(_generation_bump_statement(db, namespace))
+    _after_commit(db, lambda: cache.invalidate(*namespaces))
+
+
+def _bump_fingerprint_generation(db: Session) -> Optional[int]:
+    """
+    指紋の共有世代番号を書き込みと同じトランザクションで進め、進めた後の番号を返す
+    （CACHE_SHARED_GENERATIONが無効ならNone）。他のワーカーの重複検出インデックスはこの番号で読み直す
+    """
+    if not cache.CACHE_SHARED_GENERATION:
+        return None
+    db.execute(_generation_bump_statement(db, cache.FINGERPRINTS))
+    return cache.shared_generation(db, cache.FINGERPRINTS)
+
+
+def _facet_key(pdf) -> Tuple[str, str, int]:
+    return (pdf.school, pdf.subject, pdf.year)
+
+
+def _facet_statements(db, deltas: Dict[Tuple[str, str, int], int]) -> list:
+    """
+    (学校, 科目, 年度) ごとのPDF件数の増減をpdf_facetsに反映する文
+    件数が0になった組み合わせは削除する
+    """
+    table = models.PDFFacet
+    statements = []
+    for (school, subject, year), delta in deltas.items():
+        if not delta:
+            continue
+        stmt = _insert_for(db, table)
+        if stmt is None:
+            # ON CONFLICTが使えないDBでは既存の行のみ更新する（起動時の再集計で補正される）
+            statements.append(
+                update(table)
+                .where(table.school == school, table.subject == subject, table.year == year)
+                .values(pdf_count=table.pdf_count + delta)
+            )
+            continue
+        stmt = stmt.values(school=school, subject=subject, year=year, pdf_count=delta)
+        statements.append(stmt.on_conflict_do_update(
+            index_elements=[table.school, table.subject, table.year],
+            set_={"pdf_count": table.pdf_count + stmt.excluded.pdf_count},
+        ))
+    if statements:
+        statements.append(delete(table).where(table.pdf_count <= 0))
+    return statements
+
+
+def _school_deltas(deltas: Dict[Tuple[str, str, int], int]) -> Dict[str, int]:
+    """学校ごとのPDF件数の増減（学校名の入力補完に反映する）"""
+    school_deltas = Counter()
+    for (school, _, _), delta in deltas.items():
+        school_deltas[school] += delta
+    return dict(school_deltas)
+
+def _update_facets(db: Session, deltas: Dict[Tuple[str, str, int], int]) -> None:
+    """PDFの登録・更新・削除と同じトランザクションで集計テーブルを更新する"""
+    statements = _facet_statements(db, deltas)
+    for stmt in statements:
+        db.execute(stmt)
+    if statements:
+        _invalidate_cache(db, cache.SCHOOLS, cache.FACETS)
+        _after_commit(db, lambda: school_suggest.index.apply(_school_deltas(deltas)))
+
+
+def _sync_catalog(db: Session, upserted: Iterable = (), removed: Iterable[int] = ()) -> None:
+    """
+    PDFの書き込み後（コミット前）に呼び、コミット後にPDFカタログ（catalog.py）へ反映する
+    upsertedのPDFはflushしてID・作成日時を確定させてからシリアライズする（db.add()しただけのPDFも渡せる）
+    他のワーカーのカタログには共有世代番号で知らせる
+    """
+    _invalidate_cache(db, cache.PDFS)
+    if catalog.ENABLED:
+        upserted = list(upserted)
+        if upserted:
+            db.flush()
+        entries = [catalog.entry(pdf) for pdf in upserted]
+        removed = list(removed)
+        _after_commit(db, lambda: catalog.catalog.apply(entries, removed))
+
+
+def _commit(db: Session) -> None:
+    """コミットする（グループコミットの書き込みキュー内ではflushのみ行い、コミットはキューに任せる）"""
+    if db.info.get("deferred_commit"):
+        db.flush()
+    else:
         _commit_with_retry(db)
-        print(f"PDF削除完了: ID {pdf_id}")
-        return True
-    except Exception as e:
-        print(f"PDF削除エラー: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        db.rollback()
+
+
+def delete_pdf(db: Session, pdf_id: int) -> bool:
+    """
+    PDFレコードをデータベースから削除する。関連する質問・分析結果・ページテキストも同じトランザクションで削除する。
+    書き込みキュー（database.run_write）からも呼べるよう、コミットは1回だけ行う
+    """
+    deleted = delete_pdfs(db, ids=[pdf_id])
+    if not deleted:
+        print(f"PDFが見つかりません: ID {pdf_id}")
         return False
+    print(f"PDF削除完了: ID {pdf_id}, ファイル名: {deleted[0]['filename']}")
+    return True
+
+# 一括削除でIN句に渡すIDの件数（SQLiteのパラメータ数上限に余裕を持たせる）
+DELETE_CHUNK_SIZE = 500
+
+def delete_pdfs(
+    db: Session,
+    ids: Optional[List[int]] = None,
+    school: Optional[str] = None,
+    subject: Optional[str] = None,
+    year: Optional[int] = None,
+    delete_all: bool = False
+) -> List[dict]:
+    """
+    PDFと関連する問題・分析結果を1トランザクションでまとめて削除する
+    ids・学校・科目・年度のいずれも指定しない場合はdelete_all=Trueが必要
+    戻り値: 削除したPDFの [{"id", "filename"}]（ファイルの削除は呼び出し側で行う）
+    """
+    if ids is None and not (school or subject or year) and not delete_all:
+        raise ValueError("削除対象の条件を指定してください")
+
+    query = db.query(models.PDF.id, models.PDF.filename, models.PDF.school, models.PDF.subject, models.PDF.year)
+    if ids is not None:
+        query = query.filter(models.PDF.id.in_(ids))
+    if school:
+        query = query.filter(models.PDF.school == school)
+    if subject:
+        query = query.filter(models.PDF.subject == subject)
+    if year:
+        query = query.filter(models.PDF.year == year)
+    rows = query.order_by(models.PDF.id).all()
+    targets = [{"id": row.id, "filename": row.filename} for row in rows]
+
+    # 外部キーのCASCADEが無い古いテーブルでも消えるよう、子テーブルから明示的に削除する
+    target_ids = [target["id"] for target in targets]
+    question_ids = []
+    for start in range(0, len(target_ids), DELETE_CHUNK_SIZE):
+        chunk = target_ids[start:start + DELETE_CHUNK_SIZE]
+        question_ids += db.scalars(select(models.Question.id).where(models.Question.pdf_id.in_(chunk))).all()
+        db.execute(delete(models.Question).where(models.Question.pdf_id.in_(chunk)))
+        db.execute(delete(models.PDFAnalysis).where(models.PDFAnalysis.pdf_id.in_(chunk)))
+        db.execute(delete(models.PDFPage).where(models.PDFPage.pdf_id.in_(chunk)))
+        db.execute(delete(models.PDFFingerprint).where(models.PDFFingerprint.pdf_id.in_(chunk)))
+        db.execute(delete(models.PDF).where(models.PDF.id.in_(chunk)))
+    _update_facets(db, {key: -count for key, count in Counter(_facet_key(row) for row in rows).items()})
+    fingerprint_generation = _bump_fingerprint_generation(db) if target_ids else None
+    _after_commit(db, lambda: dedup.index.remove(*target_ids, generation=fingerprint_generation))
+    _after_commit(db, lambda: similar.index.mark_stale(*question_ids))
+    _sync_catalog(db, removed=target_ids)
+    _invalidate_cache(db, cache.QUESTIONS)
+    _commit(db)
+    print(f"PDF一括削除: {len(targets)} 件")
+    return targets
 
 # QuestionType CRUD operations
 def create_question_type(db: Session, question_type: schemas.QuestionTypeCreate):
     db_question_type = models.QuestionType(**question_type.dict())
     db.add(db_question_type)
-    db.commit()
+    _invalidate_cache(db, cache.QUESTION_TYPES)
+    _commit(db)
     db.refresh(db_question_type)
     return db_question_type
 
-def get_question_types(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.QuestionType).offset(skip).limit(limit).all()
+def get_question_types(db: Session, skip: int = 0, limit: int = 100, after: Optional[str] = None, sort: Optional[str] = None):
+    query = keyset_query(db.query(models.QuestionType), models.QuestionType, sort, after)
+    return query.offset(skip).limit(limit).all()
 
 def get_question_type_by_id(db: Session, question_type_id: int):
     return db.query(models.QuestionType).filter(models.QuestionType.id == question_type_id).first()
@@ -127,19 +475,163 @@ def get_question_type_by_id(db: Session, question_type_id: int):
 def get_question_type_by_name(db: Session, name: str):
     return db.query(models.QuestionType).filter(models.QuestionType.name == name).first()
 
+def ensure_question_types(db: Session, question_types: List[dict]) -> List[str]:
+    """
+    問題タイプが無ければ作成し、新しく作成した名前を返す
+    複数のワーカーが同時に起動しても一意制約違反にならないようON CONFLICT DO NOTHINGを使う
+    """
+    stmt = _insert_for(db, models.QuestionType)
+    if stmt is None or not _supports_returning(db):
+        created = []
+        for type_data in question_types:
+            if not get_question_type_by_name(db, type_data["name"]):
+                create_question_type(db, schemas.QuestionTypeCreate(**type_data))
+                created.append(type_data["name"])
+        return created
+
+    stmt = (
+        stmt.values(question_types)
+        .on_conflict_do_nothing(index_elements=["name"])
+        .returning(models.QuestionType.name)
+    )
+    created = list(db.execute(stmt).scalars())
+    if created:
+        _invalidate_cache(db, cache.QUESTION_TYPES)
+    _commit(db)
+    return created
+
 # Question CRUD operations
 def create_question(db: Session, question: schemas.QuestionCreate):
     db_question = models.Question(**question.dict())
     db.add(db_question)
-    db.commit()
+    _invalidate_cache(db, cache.QUESTIONS)
+    _commit(db)
     db.refresh(db_question)
     return db_question
 
-def get_questions(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Question).offset(skip).limit(limit).all()
+# fields=で指定できる問題の列（QuestionOutと同じ）
+QUESTION_FIELDS = tuple(schemas.QuestionOut.model_fields.keys())
+
+def parse_question_fields(fields: Optional[str], sort: Optional[str] = None) -> Optional[List[str]]:
+    """
+    fields=のカンマ区切り文字列を列名のリストにする（未指定ならNone）
+    idとソートキーはページネーションに必要なため常に含める
+    """
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    invalid = [name for name in names if name not in QUESTION_FIELDS]
+    if invalid:
+        raise ValueError(f"指定できない項目です: {', '.join(invalid)}（指定可能: {', '.join(QUESTION_FIELDS)}）")
+    # 未知のソートキーを列名としてSELECTしないよう先に検証する
+    sort_key, _ = parse_sort(models.Question, sort)
+    for required in ("id", sort_key):
+        if required not in names:
+            names.insert(0, required)
+    return names
+
+def _question_query(db: Session, fields: Optional[List[str]]):
+    """
+    fields指定時は指定列だけをSELECTする
+    大きなText列（問題文・抽出テキストなど）の読み込みとORMオブジェクトの生成を省略できる
+    """
+    if fields:
+        return db.query(*(getattr(models.Question, name) for name in fields))
+    return db.query(models.Question)
 
-def get_questions_by_pdf_id(db: Session, pdf_id: int):
-    return db.query(models.Question).filter(models.Question.pdf_id == pdf_id).all()
+def get_questions(db: Session, skip: int = 0, limit: int = 100, after: Optional[str] = None, sort: Optional[str] = None, fields: Optional[List[str]] = None):
+    """問題一覧を取得（fields指定時は列名をキーとする行を返す）"""
+    query = keyset_query(_question_query(db, fields), models.Question, sort, after)
+    return query.offset(skip).limit(limit).all()
+
+def _question_type_rows(db: Session) -> Dict[int, dict]:
+    """{ID: 問題タイプの列の値}（プロセス内キャッシュ。問題タイプの作成時にコミット後に破棄される）"""
+    def load():
+        columns = [column for column in models.QuestionType.__table__.columns]
+        return {row.id: dict(row._mapping) for row in db.execute(select(*columns))}
+    return cache.get_or_load(cache.QUESTION_TYPES, "rows", load, db)
+
+def _attach_question_types(db: Session, questions: list) -> list:
+    """
+    問題タイプを各問題に設定する（問題ごとの遅延読み込みを避ける）
+    問題タイプは件数が少なく変更もまれなため、プロセス内キャッシュの値からセッションのオブジェクトを作る（SQLは発行しない）
+    キャッシュに無いID（他のワーカーで作成された直後など）だけはまとめてSELECTする
+    """
+    type_ids = {question.question_type_id for question in questions}
+    if not type_ids:
+        return questions
+    rows = _question_type_rows(db)
+    question_types = {}
+    for type_id in type_ids & rows.keys():
+        question_type = models.QuestionType(**rows[type_id])
+        make_transient_to_detached(question_type)
+        question_types[type_id] = db.merge(question_type, load=False)
+    missing = type_ids - rows.keys()
+    if missing:
+        question_types.update(
+            (question_type.id, question_type)
+            for question_type in db.query(models.QuestionType).filter(models.QuestionType.id.in_(missing))
+        )
+    for question in questions:
+        set_committed_value(question, "question_type", question_types.get(question.question_type_id))
+    return questions
+
+def get_questions_with_relations(db: Session, skip: int = 0, limit: int = 100, after: Optional[str] = None, sort: Optional[str] = None):
+    """PDFと問題タイプを含む問題一覧を取得（件数に関係なくクエリ2回）"""
+    query = db.query(models.Question).options(joinedload(models.Question.pdf))
+    questions = keyset_query(query, models.Question, sort, after).offset(skip).limit(limit).all()
+    return _attach_question_types(db, questions)
+
+def get_question_with_relations(db: Session, question_id: int):
+    """PDFと問題タイプを含む問題を取得"""
+    question = (
+        db.query(models.Question)
+        .options(joinedload(models.Question.pdf), joinedload(models.Question.question_type))
+        .filter(models.Question.id == question_id)
+        .first()
+    )
+    return question
+
+def get_questions_with_relations_by_ids(db: Session, question_ids: List[int]) -> dict:
+    """{ID: PDFと問題タイプを含む問題}"""
+    if not question_ids:
+        return {}
+    query = db.query(models.Question).options(joinedload(models.Question.pdf)).filter(models.Question.id.in_(question_ids))
+    return {question.id: question for question in _attach_question_types(db, query.all())}
+
+def get_question_texts(db: Session, after_id: int = 0, ids: Optional[List[int]] = None) -> Iterable[tuple]:
+    """問題の (ID, 問題文) をID順に少しずつ読み込む（類似問題の索引用）"""
+    query = db.query(models.Question.id, models.Question.question_text).filter(models.Question.id > after_id)
+    if ids is not None:
+        query = query.filter(models.Question.id.in_(ids))
+    for row in query.order_by(models.Question.id).yield_per(QUESTION_INSERT_CHUNK_SIZE):
+        yield row[0], row[1]
+
+def iter_batches(db: Session, model, batch_size: int = 1000) -> Iterable[list]:
+    """
+    全行をID順にbatch_size件ずつ読み込む（エクスポート用）
+    まとまりごとに別のクエリ（id > 前回の最後）にして、長い読み取りトランザクションを持ち続けない
+    """
+    last_id = 0
+    while True:
+        batch = db.query(model).filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+        if not batch:
+            return
+        last_id = batch[-1].id
+        yield batch
+        db.rollback()
+        db.expunge_all()
+
+def get_questions_by_pdf_id(db: Session, pdf_id: int, fields: Optional[List[str]] = None):
+    return _question_query(db, fields).filter(models.Question.pdf_id == pdf_id).all()
+
+def get_questions_by_ids(db: Session, question_ids: List[int]) -> list:
+    """IDを指定して問題をまとめて取得する（入力と同じ順。IN句はDELETE_CHUNK_SIZE件ずつ）"""
+    found = {}
+    for start in range(0, len(question_ids), DELETE_CHUNK_SIZE):
+        chunk = question_ids[start:start + DELETE_CHUNK_SIZE]
+        found.update((question.id, question) for question in db.query(models.Question).filter(models.Question.id.in_(chunk)))
+    return [found[question_id] for question_id in question_ids if question_id in found]
 
 def get_question_by_id(db: Session, question_id: int):
     return db.query(models.Question).filter(models.Question.id == question_id).first()
@@ -149,7 +641,10 @@ def update_question(db: Session, question_id: int, question_update: dict):
     if db_question:
         for key, value in question_update.items():
             setattr(db_question, key, value)
-        db.commit()
+        if "question_text" in question_update:
+            _after_commit(db, lambda: similar.index.mark_stale(question_id))
+        _invalidate_cache(db, cache.QUESTIONS)
+        _commit(db)
         db.refresh(db_question)
     return db_question
 
@@ -157,18 +652,314 @@ def delete_question(db: Session, question_id: int):
     db_question = db.query(models.Question).filter(models.Question.id == question_id).first()
     if db_question:
         db.delete(db_question)
-        db.commit()
+        _after_commit(db, lambda: similar.index.mark_stale(question_id))
+        _invalidate_cache(db, cache.QUESTIONS)
+        _commit(db)
         return True
     return False
 
-def create_multiple_questions(db: Session, questions: List[schemas.QuestionCreate]):
-    """複数の問題を一括で作成"""
-    db_questions = []
-    for question in questions:
-        db_question = models.Question(**question.dict())
-        db.add(db_question)
-        db_questions.append(db_question)
-    db.commit()
-    for db_question in db_questions:
-        db.refresh(db_question)
-    return db_questions
+# 一括INSERTで1回に送る件数
+QUESTION_INSERT_CHUNK_SIZE = 1000
+
+def _question_rows(questions) -> List[dict]:
+    return [question.dict() if isinstance(question, schemas.QuestionCreate) else question for question in questions]
+
+def bulk_create_questions(db: Session, questions: List[schemas.QuestionCreate]) -> List[int]:
+    """
+    複数の問題を一括INSERTし、作成した問題のIDを入力と同じ順で返す
+    INSERT ... RETURNING id（複数行VALUES）で送るため、1件ごとのINSERTやrefreshを行わない
+    """
+    rows = _question_rows(questions)
+    if not rows:
+        return []
+    if _supports_returning(db):
+        stmt = insert(models.Question).returning(models.Question.id, sort_by_parameter_order=True)
+        ids = list(db.execute(stmt, rows).scalars())
+    else:
+        db_questions = [models.Question(**row) for row in rows]
+        db.add_all(db_questions)
+        db.flush()
+        ids = [db_question.id for db_question in db_questions]
+    _invalidate_cache(db, cache.QUESTIONS)
+    _commit(db)
+    return ids
+
+def _chunked(items: Iterable, size: int):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def bulk_create_questions_stream(db: Session, questions: Iterable, chunk_size: int = QUESTION_INSERT_CHUNK_SIZE) -> int:
+    """
+    大量の問題（抽出結果など）をchunk_size件ずつexecutemanyでINSERTし、作成件数を返す
+    入力はジェネレーターでもよく、全件をメモリに載せない。全体を1トランザクションでコミットする
+    """
+    total = 0
+    for chunk in _chunked(questions, chunk_size):
+        db.execute(insert(models.Question), _question_rows(chunk))
+        total += len(chunk)
+    if total:
+        _invalidate_cache(db, cache.QUESTIONS)
+    _commit(db)
+    return total
+
+
+# PDFPage CRUD operations（全文検索）
+def get_pdf_filenames(db: Session) -> List[tuple]:
+    """全PDFの (ID, ファイル名)"""
+    return [tuple(row) for row in db.query(models.PDF.id, models.PDF.filename).order_by(models.PDF.id)]
+
+def replace_pdf_pages(db: Session, pdf_id: int, text_by_page: dict) -> int:
+    """PDFのページテキストを置き換える（全文検索の索引はトリガーで更新される）"""
+    db.execute(delete(models.PDFPage).where(models.PDFPage.pdf_id == pdf_id))
+    rows = [
+        {"pdf_id": pdf_id, "page_number": page_number, "text": page_text}
+        for page_number, page_text in sorted(text_by_page.items())
+    ]
+    if rows:
+        db.execute(insert(models.PDFPage), rows)
+    _commit(db)
+    return len(rows)
+
+def get_pdfs_by_ids(db: Session, pdf_ids: List[int]) -> dict:
+    """{ID: PDF}"""
+    if not pdf_ids:
+        return {}
+    return {pdf.id: pdf for pdf in db.query(models.PDF).filter(models.PDF.id.in_(pdf_ids))}
+
+# PDFFingerprint CRUD operations（重複検出）
+def save_fingerprint(db: Session, pdf_id: int, content_hash: str, kind: str, signature: List[int]):
+    """PDFの指紋を置き換え、コミット後に重複検出のインデックスへ反映する"""
+    db.execute(delete(models.PDFFingerprint).where(models.PDFFingerprint.pdf_id == pdf_id))
+    db.add(models.PDFFingerprint(
+        pdf_id=pdf_id,
+        content_hash=content_hash,
+        kind=kind,
+        signature=dedup.pack_signature(signature),
+    ))
+    generation = _bump_fingerprint_generation(db)
+    _after_commit(db, lambda: dedup.index.add(pdf_id, content_hash, kind, signature, generation=generation))
+    _commit(db)
+
+def get_fingerprints(db: Session) -> List[tuple]:
+    """全PDFの指紋 (pdf_id, content_hash, kind, signature)"""
+    fingerprint = models.PDFFingerprint
+    return [tuple(row) for row in db.query(fingerprint.pdf_id, fingerprint.content_hash, fingerprint.kind, fingerprint.signature)]
+
+# スニペットの強調部分の目印（HTMLエスケープした後に<mark>に置き換える）
+_MARK_START, _MARK_END = "\x02", "\x03"
+# スニペットの長さ（FTS5のトークン数。trigramでは1文字ずつ進む）
+SNIPPET_TOKENS = 32
+# LIKE検索のスニペットで一致箇所の前後に含める文字数
+SNIPPET_CONTEXT_CHARS = 30
+
+def _render_snippet(snippet: str) -> str:
+    return html.escape(snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+def _like_snippet(page_text: str, terms: List[str]) -> str:
+    """最初に一致した語の前後を切り出し、各語を目印で囲む"""
+    position = min((page_text.find(term) for term in terms if term in page_text), default=0)
+    start = max(0, position - SNIPPET_CONTEXT_CHARS)
+    end = position + SNIPPET_CONTEXT_CHARS * 2
+    snippet = page_text[start:end]
+    for term in terms:
+        snippet = snippet.replace(term, f"{_MARK_START}{term}{_MARK_END}")
+    return ("…" if start > 0 else "") + snippet + ("…" if end < len(page_text) else "")
+
+def search_pages(db: Session, q: str, skip: int = 0, limit: int = 20) -> List[dict]:
+    """
+    ページテキストを全文検索する（空白区切りの語のAND検索）
+    FTS5（trigram）は3文字以上の語しか索引を引けないため、短い語を含む場合はLIKEで検索する
+    """
+    terms = q.split()
+    if not terms:
+        return []
+
+    if migrations.page_search_available and all(len(term) >= 3 for term in terms):
+        match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        rows = db.execute(text("""
+            SELECT pdf_pages.pdf_id, pdf_pages.page_number,
+                   snippet(pdf_pages_fts, 0, :mark_start, :mark_end, '…', :tokens) AS snippet
+            FROM pdf_pages_fts
+            JOIN pdf_pages ON pdf_pages.id = pdf_pages_fts.rowid
+            WHERE pdf_pages_fts MATCH :match
+            ORDER BY bm25(pdf_pages_fts)
+            LIMIT :limit OFFSET :skip
+        """), {"mark_start": _MARK_START, "mark_end": _MARK_END, "tokens": SNIPPET_TOKENS,
+               "match": match, "limit": limit, "skip": skip}).all()
+    else:
+        query = db.query(models.PDFPage.pdf_id, models.PDFPage.page_number, models.PDFPage.text)
+        for term in terms:
+            query = query.filter(models.PDFPage.text.contains(term, autoescape=True))
+        rows = [
+            (pdf_id, page_number, _like_snippet(page_text, terms))
+            for pdf_id, page_number, page_text in query.order_by(models.PDFPage.pdf_id, models.PDFPage.page_number).offset(skip).limit(limit)
+        ]
+
+    pdfs = get_pdfs_by_ids(db, list({row[0] for row in rows}))
+    return [
+        {
+            "pdf_id": pdf_id,
+            "page_number": page_number,
+            "school": pdfs[pdf_id].school,
+            "subject": pdfs[pdf_id].subject,
+            "year": pdfs[pdf_id].year,
+            "filename": pdfs[pdf_id].filename,
+            "snippet": _render_snippet(snippet),
+        }
+        for pdf_id, page_number, snippet in rows
+        if pdf_id in pdfs
+    ]
+
+# PDFAnalysis CRUD operations
+def get_latest_analysis(db: Session, pdf_id: int, mode: Optional[str] = None):
+    """PDFの最新のAI分析結果を取得（modeを指定した場合はそのモードのみ）"""
+    query = db.query(models.PDFAnalysis).filter(models.PDFAnalysis.pdf_id == pdf_id)
+    if mode:
+        query = query.filter(models.PDFAnalysis.mode == mode)
+    return query.order_by(models.PDFAnalysis.id.desc()).first()
+
+def get_analyzed_pdf_ids(db: Session, pdf_ids: List[int]) -> set:
+    """指定したPDFのうち、AI分析結果が保存済みのPDF IDを取得"""
+    if not pdf_ids:
+        return set()
+    result = (
+        db.query(models.PDFAnalysis.pdf_id)
+        .filter(models.PDFAnalysis.pdf_id.in_(pdf_ids))
+        .distinct()
+        .all()
+    )
+    return {row[0] for row in result}
+
+def create_analysis(db: Session, pdf_id: int, result: dict):
+    """AI分析結果（analyze_pdf_with_claudeの戻り値）を保存"""
+    db_analysis = models.PDFAnalysis(
+        pdf_id=pdf_id,
+        mode=result.get("mode", "image"),
+        analysis=result["analysis"],
+        pages_converted=result.get("pages_converted"),
+    )
+    db.add(db_analysis)
+    _commit(db)
+    db.refresh(db_analysis)
+    return db_analysis
+
+
+# 非同期版（asyncエンドポイントからAsyncSessionで使う。イベントループをブロックしない）
+async def _commit_async(db: AsyncSession) -> None:
+    """
+    _commit_with_retryの非同期版
+    SQLiteのロック待ちは各接続のbusy_timeout（database.py）に任せ、それでも失敗した場合はロールバックして例外を送出する
+    （失敗したCOMMITの後はロールバックが必要で、同じセッションでコミットし直すと書き込みが失われるため再試行しない）
+    """
+    try:
+        await db.commit()
+    except OperationalError:
+        await db.rollback()
+        raise
+    _run_after_commit(db)
+
+async def _invalidate_cache_async(db: AsyncSession, *namespaces: str) -> None:
+    """_invalidate_cacheの非同期版"""
+    if cache.CACHE_SHARED_GENERATION:
+        for namespace in namespaces:
+            await db.execute(_generation_bump_statement(db, namespace))
+    _after_commit(db, lambda: cache.invalidate(*namespaces))
+
+async def _update_facets_async(db: AsyncSession, deltas: Dict[Tuple[str, str, int], int]) -> None:
+    """_update_facetsの非同期版"""
+    statements = _facet_statements(db, deltas)
+    for stmt in statements:
+        await db.execute(stmt)
+    if statements:
+        await _invalidate_cache_async(db, cache.SCHOOLS, cache.FACETS)
+        _after_commit(db, lambda: school_suggest.index.apply(_school_deltas(deltas)))
+
+async def _sync_catalog_async(db: AsyncSession, upserted: Iterable = (), removed: Iterable[int] = ()) -> None:
+    """_sync_catalogの非同期版"""
+    await _invalidate_cache_async(db, cache.PDFS)
+    if catalog.ENABLED:
+        upserted = list(upserted)
+        if upserted:
+            await db.flush()
+        entries = [catalog.entry(pdf) for pdf in upserted]
+        removed = list(removed)
+        _after_commit(db, lambda: catalog.catalog.apply(entries, removed))
+
+async def bulk_create_questions_stream_async(
+    db: AsyncSession,
+    questions: AsyncIterator,
+    chunk_size: int = QUESTION_INSERT_CHUNK_SIZE
+) -> int:
+    """bulk_create_questions_streamの非同期版（リクエストボディを読みながらINSERTする）"""
+    total = 0
+    chunk = []
+    async for question in questions:
+        chunk.append(question)
+        if len(chunk) >= chunk_size:
+            await db.execute(insert(models.Question), _question_rows(chunk))
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        await db.execute(insert(models.Question), _question_rows(chunk))
+        total += len(chunk)
+    if total:
+        await _invalidate_cache_async(db, cache.QUESTIONS)
+    await _commit_async(db)
+    return total
+
+async def get_pdf_by_id_async(db: AsyncSession, pdf_id: int):
+    return await db.get(models.PDF, pdf_id)
+
+async def get_pdf_by_filename_async(db: AsyncSession, filename: str):
+    result = await db.execute(select(models.PDF).where(models.PDF.filename == filename))
+    return result.scalars().first()
+
+async def create_pdf_async(db: AsyncSession, pdf: schemas.PDFCreate):
+    """create_pdfの非同期版"""
+    stmt = _create_pdf_statement(db, pdf)
+    if stmt is not None:
+        db_pdf = (await db.execute(stmt)).scalars().first()
+        if db_pdf is None:
+            raise ValueError(f"ファイル名 '{pdf.filename}' は既に存在します")
+        await _update_facets_async(db, {_facet_key(db_pdf): 1})
+        await _sync_catalog_async(db, upserted=[db_pdf])
+        await _commit_async(db)
+        return db_pdf
+
+    if await get_pdf_by_filename_async(db, pdf.filename):
+        raise ValueError(f"ファイル名 '{pdf.filename}' は既に存在します")
+
+    db_pdf = models.PDF(**pdf.dict())
+    db.add(db_pdf)
+    await _update_facets_async(db, {_facet_key(db_pdf): 1})
+    await _sync_catalog_async(db, upserted=[db_pdf])
+    await _commit_async(db)
+    await db.refresh(db_pdf)
+    return db_pdf
+
+async def get_latest_analysis_async(db: AsyncSession, pdf_id: int, mode: Optional[str] = None):
+    """get_latest_analysisの非同期版"""
+    query = select(models.PDFAnalysis).where(models.PDFAnalysis.pdf_id == pdf_id)
+    if mode:
+        query = query.where(models.PDFAnalysis.mode == mode)
+    result = await db.execute(query.order_by(models.PDFAnalysis.id.desc()).limit(1))
+    return result.scalars().first()
+
+async def create_analysis_async(db: AsyncSession, pdf_id: int, result: dict):
+    """create_analysisの非同期版"""
+    db_analysis = models.PDFAnalysis(
+        pdf_id=pdf_id,
+        mode=result.get("mode", "image"),
+        analysis=result["analysis"],
+        pages_converted=result.get("pages_converted"),
+    )
+    db.add(db_analysis)
+    await _commit_async(db)
+    await db.refresh(db_analysis)
+    return db_analysis
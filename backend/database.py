@@ -1,23 +1,238 @@
 from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import models
 import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+def normalize_database_url(url: str) -> str:
+    """HerokuやRenderが発行する postgres:// 形式をSQLAlchemyが認識できる postgresql:// に変換する"""
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
 
 # 環境変数のDATABASE_URLを優先的に使用（未設定ならローカルsqlite）
-SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./pdfs.db")
+SQLALCHEMY_DATABASE_URL = normalize_database_url(os.getenv("DATABASE_URL", "sqlite:///./pdfs.db"))
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+IS_SQLITE_MEMORY = IS_SQLITE and (":memory:" in SQLALCHEMY_DATABASE_URL or SQLALCHEMY_DATABASE_URL == "sqlite://")
+
+# SQLiteのパフォーマンス設定
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # 負の値はKiB単位（64MB）
+
+# コネクションプール設定
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # 秒（PostgreSQLのみ。サーバー側で切断された接続を使わない）
+
+# グループコミット設定（同時に来た書き込みを1トランザクションにまとめる）
+# 書き込みが1つずつしか行えないSQLite向けのため、PostgreSQLでは既定で無効
+DB_GROUP_COMMIT = os.getenv("DB_GROUP_COMMIT", "true" if IS_SQLITE else "false").lower() == "true"
+DB_GROUP_COMMIT_MAX_BATCH = int(os.getenv("DB_GROUP_COMMIT_MAX_BATCH", "64"))
+DB_GROUP_COMMIT_MAX_WAIT_MS = float(os.getenv("DB_GROUP_COMMIT_MAX_WAIT_MS", "5"))
+
+engine_options = {}
+if not IS_SQLITE_MEMORY:
+    engine_options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+if not IS_SQLITE:
+    # ネットワーク越しのDBでは切断済みの接続を検出・再接続する
+    engine_options.update(
+        pool_pre_ping=True,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+
+# check_same_threadはSQLite（pysqlite）専用の接続引数
+connect_args = {"check_same_thread": False} if IS_SQLITE else {}
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args, **engine_options)
 
-# SQLiteの外部キー制約を有効にする
-@event.listens_for(engine, "connect")
+# SQLiteの外部キー制約とパフォーマンス設定を有効にする（PostgreSQLでは登録しない）
 def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
     cursor.execute("PRAGMA foreign_keys=ON")
+    # busy_timeoutはjournal_modeの変更より先に設定する（変更時にもロック待ちが発生するため）
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    if not IS_SQLITE_MEMORY:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
     cursor.close()
 
+if IS_SQLITE:
+    event.listen(engine, "connect", set_sqlite_pragma)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 書き込みキュー用（コミット後もオブジェクトの値を参照できるよう期限切れにしない）
+WriteSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# 非同期エンドポイント用のエンジン（SQLiteはaiosqlite、PostgreSQLはasyncpg）
+def get_async_database_url(url: str) -> str:
+    """同期用のDATABASE_URLを非同期ドライバーのURLに変換する"""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql://", "postgresql+psycopg2://"):
+        if url.startswith(prefix):
+            async_url = make_url("postgresql+asyncpg://" + url[len(prefix):])
+            # asyncpgはlibpqのsslmodeを受け付けないため、sslに置き換える
+            sslmode = async_url.query.get("sslmode")
+            if sslmode:
+                async_url = async_url.difference_update_query(["sslmode"]).update_query_dict({"ssl": sslmode})
+            return async_url.render_as_string(hide_password=False)
+    return url
+
+async_engine_options = dict(engine_options)
+if engine_options and IS_SQLITE:
+    # aiosqliteのファイルDBは既定でNullPool（毎回接続し直す）のため、明示的にプールを使う
+    async_engine_options["poolclass"] = AsyncAdaptedQueuePool
+
+async_engine = create_async_engine(
+    get_async_database_url(SQLALCHEMY_DATABASE_URL),
+    connect_args=connect_args,
+    **async_engine_options
+)
+if IS_SQLITE:
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragma)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 def init_db():
+    import migrations
     models.Base.metadata.create_all(bind=engine)
+    migrations.run_migrations(engine)
+
+
+class GroupCommitWriter:
+    """
+    単一の書き込みスレッドで書き込み処理を実行し、同時に来た処理を1トランザクションにまとめてコミットする
+    SQLiteは書き込みが1つずつしか行えないため、ロック待ちとコミット（fsync）の回数を減らせる
+
+    投入する関数はセッションを受け取り、コミットやロールバックを自分で行わないこと
+    （crudの関数はsession.info["deferred_commit"]を見てflushのみ行う）
+    各処理はSAVEPOINTの中で実行するため、失敗した処理だけが取り消されてその呼び出し元に例外が返る。
+    他の処理は実行し直さない（冪等でない処理もそのまま投入できる）
+    """
+
+    def __init__(self, session_factory, max_batch: int = 64, max_wait_ms: float = 5):
+        self.session_factory = session_factory
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._loop, name="db-group-commit", daemon=True)
+                self._thread.start()
+
+    def submit(self, fn) -> Future:
+        """書き込み処理をキューに入れ、結果を受け取るFutureを返す"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((future, fn))
+        return future
+
+    def _loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._execute(batch)
+
+    def _execute(self, batch) -> None:
+        session = self.session_factory()
+        session.info["deferred_commit"] = True
+        session.info["after_commit"] = []
+        hooks = session.info["after_commit"]
+        outcomes = []
+        try:
+            if IS_SQLITE:
+                # pysqliteはDMLまでBEGINを送らないため、先に始めておかないと最初のSAVEPOINTが
+                # 外側のトランザクションになり、RELEASEの時点でコミットされてしまう
+                session.connection().exec_driver_sql("BEGIN IMMEDIATE")
+            for future, fn in batch:
+                registered = len(hooks)
+                savepoint = session.begin_nested()
+                try:
+                    result = fn(session)
+                    savepoint.commit()
+                except Exception as e:
+                    savepoint.rollback()
+                    # 取り消した処理のコミット後処理は実行しない
+                    del hooks[registered:]
+                    future.set_exception(e)
+                    continue
+                outcomes.append((future, result))
+            session.commit()
+        except Exception as e:
+            # コミット自体の失敗はバッチ全体の失敗として返す
+            print(f"グループコミット失敗: {str(e)}")
+            session.rollback()
+            session.close()
+            for future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for hook in hooks:
+            try:
+                hook()
+            except Exception as e:
+                print(f"コミット後処理エラー: {str(e)}")
+        session.close()
+        for future, result in outcomes:
+            future.set_result(result)
+
+
+group_commit_writer = GroupCommitWriter(
+    WriteSessionLocal,
+    max_batch=DB_GROUP_COMMIT_MAX_BATCH,
+    max_wait_ms=DB_GROUP_COMMIT_MAX_WAIT_MS,
+)
+
+def run_write(fn):
+    """
+    書き込み処理fn(session)を実行して結果を返す
+    グループコミットが有効な場合は書き込みスレッドで他の書き込みとまとめてコミットする
+    fnはコミット・ロールバックを行わないこと。fnが例外を出した場合はfnの書き込みだけが取り消され、
+    fnが実行し直されることはない
+    """
+    if DB_GROUP_COMMIT:
+        return group_commit_writer.submit(fn).result()
+
+    session = WriteSessionLocal()
+    try:
+        result = fn(session)
+        session.commit()
+        return result
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
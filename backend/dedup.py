@@ -0,0 +1,231 @@
+"""
+重複PDFの検出（別名で登録された同じ試験問題）
+
+取り込み時（ingest.py）にPDFごとの指紋を作成し、pdf_fingerprintsに保存する。
+  - exact: ファイル内容のSHA-256（同じファイルのコピー）
+  - text: テキスト層の文字シングルのMinHash（再保存・別ソースのPDFでも本文が同じもの）
+  - image: テキスト層の無いスキャンPDF向けに、描画したページのdHash（知覚ハッシュ）
+指紋はプロセス内のLSHインデックスに載せ、候補だけを比べて重複を判定する。
+このプロセスでの取り込み・削除はコミット後にインデックスへ直接反映する。
+他のワーカーでの取り込み・削除は、CACHE_SHARED_GENERATION=trueの場合に指紋の共有世代番号（cache.FINGERPRINTS）で検出し、読み直す。
+"""
+import os
+import random
+import re
+import struct
+import threading
+import unicodedata
+import zlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# MinHashの設定（BANDS * ROWSがハッシュ数。しきい値の目安は (1/BANDS)^(1/ROWS) ≒ 0.71）
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 16
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+SHINGLE_SIZE = int(os.getenv("DEDUP_SHINGLE_SIZE", "5"))
+TEXT_THRESHOLD = float(os.getenv("DEDUP_TEXT_THRESHOLD", "0.8"))
+
+# dHashの設定（64bitを16bitずつ4つに分けて索引する。距離3以下なら必ずどれかが一致する）
+IMAGE_HASH_BANDS = 4
+IMAGE_MAX_DISTANCE = int(os.getenv("DEDUP_IMAGE_MAX_DISTANCE", "3"))
+IMAGE_THRESHOLD = float(os.getenv("DEDUP_IMAGE_THRESHOLD", "0.8"))
+IMAGE_MAX_PAGES = int(os.getenv("DEDUP_IMAGE_MAX_PAGES", "10"))
+IMAGE_RENDER_DPI = int(os.getenv("DEDUP_IMAGE_RENDER_DPI", "36"))
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20240501)  # 指紋をDBに保存するため、係数は固定する
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(MINHASH_PERMUTATIONS)
+]
+
+
+def normalize_text(text: str) -> str:
+    """全角・半角を揃え、空白を除く（改行位置やスペースの違いを無視する）"""
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", text))
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[int]:
+    """size文字ずつずらした部分文字列のハッシュ集合"""
+    text = normalize_text(text)
+    if len(text) <= size:
+        return {zlib.crc32(text.encode("utf-8"))} if text else set()
+    return {zlib.crc32(text[i:i + size].encode("utf-8")) for i in range(len(text) - size + 1)}
+
+
+def minhash(text: str) -> Optional[List[int]]:
+    """テキストのMinHash署名（テキストが空ならNone）"""
+    hashes = shingles(text)
+    if not hashes:
+        return None
+    return [min((a * x + b) % _MERSENNE_PRIME for x in hashes) for a, b in _PERMUTATIONS]
+
+
+def dhash(image, hash_size: int = 8) -> int:
+    """画像のdHash（隣り合う画素の明暗の差を64bitにしたもの）"""
+    from PIL import Image
+
+    pixels = list(image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def pack_signature(values: List[int]) -> bytes:
+    return struct.pack(f"<{len(values)}Q", *values)
+
+
+def unpack_signature(data: bytes) -> List[int]:
+    return list(struct.unpack(f"<{len(data) // 8}Q", data))
+
+
+def _text_bands(signature: List[int]) -> List[Tuple]:
+    return [("text", band, tuple(signature[band * LSH_ROWS:(band + 1) * LSH_ROWS])) for band in range(LSH_BANDS)]
+
+
+def _image_bands(page_hash: int) -> List[Tuple]:
+    bits = 64 // IMAGE_HASH_BANDS
+    mask = (1 << bits) - 1
+    return [("image", band, (page_hash >> (band * bits)) & mask) for band in range(IMAGE_HASH_BANDS)]
+
+
+def _text_similarity(a: List[int], b: List[int]) -> float:
+    """MinHash署名から推定したJaccard係数"""
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def _image_similarity(a: List[int], b: List[int]) -> float:
+    """ページのdHashが近い（距離IMAGE_MAX_DISTANCE以下）ページの割合"""
+    matched = sum(any(bin(x ^ y).count("1") <= IMAGE_MAX_DISTANCE for y in b) for x in a)
+    return matched / max(len(a), len(b))
+
+
+class DuplicateIndex:
+    """
+    指紋のLSHインデックス（プロセス内）
+    バケットで候補を絞ってから署名を比べるため、問い合わせはPDFの件数にほぼ依存しない
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._state = None  # インデックスが反映済みの指紋の共有世代番号（cache.FINGERPRINTS）
+        self._fingerprints: Dict[int, Tuple[str, str, List[int]]] = {}
+        self._buckets: Dict[Tuple, Set[int]] = {}
+
+    def _keys(self, content_hash: str, kind: str, signature: List[int]) -> List[Tuple]:
+        keys = [("exact", content_hash)]
+        if kind == "text":
+            keys += _text_bands(signature)
+        else:
+            for page_hash in signature:
+                keys += _image_bands(page_hash)
+        return keys
+
+    def _add_locked(self, pdf_id: int, content_hash: str, kind: str, signature: List[int]) -> None:
+        self._remove_locked(pdf_id)
+        self._fingerprints[pdf_id] = (content_hash, kind, signature)
+        for key in self._keys(content_hash, kind, signature):
+            self._buckets.setdefault(key, set()).add(pdf_id)
+
+    def _remove_locked(self, pdf_id: int) -> None:
+        fingerprint = self._fingerprints.pop(pdf_id, None)
+        if not fingerprint:
+            return
+        for key in self._keys(*fingerprint):
+            bucket = self._buckets.get(key)
+            if bucket:
+                bucket.discard(pdf_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def _advance_locked(self, generation: Optional[int]) -> None:
+        """
+        このプロセスの書き込みで進めた世代番号を反映済みにする
+        読み込み後に他のワーカーの変更が無い（1つ前の番号から進めた）場合だけ進め、あれば次の問い合わせで読み直させる
+        """
+        if generation is not None and self._state is not None and generation == self._state + 1:
+            self._state = generation
+
+    def load(self, rows: Iterable[Tuple[int, str, str, bytes]], state: Optional[int] = None) -> None:
+        """DBの指紋 (pdf_id, content_hash, kind, signature) でインデックスを作り直す"""
+        with self._lock:
+            self._fingerprints.clear()
+            self._buckets.clear()
+            for pdf_id, content_hash, kind, signature in rows:
+                self._add_locked(pdf_id, content_hash, kind, unpack_signature(signature))
+            self._state = state
+            self._loaded = True
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def state(self) -> Optional[int]:
+        return self._state
+
+    def add(self, pdf_id: int, content_hash: str, kind: str, signature: List[int], generation: Optional[int] = None) -> None:
+        with self._lock:
+            self._add_locked(pdf_id, content_hash, kind, signature)
+            self._advance_locked(generation)
+
+    def remove(self, *pdf_ids: int, generation: Optional[int] = None) -> None:
+        with self._lock:
+            for pdf_id in pdf_ids:
+                self._remove_locked(pdf_id)
+            self._advance_locked(generation)
+
+    def find_duplicates(self, pdf_id: int) -> Optional[List[Tuple[int, float, str]]]:
+        """
+        重複とみなせるPDFを [(pdf_id, 類似度, 判定方法)] で返す（類似度の高い順）
+        指紋が無いPDFはNone
+        """
+        with self._lock:
+            fingerprint = self._fingerprints.get(pdf_id)
+            if not fingerprint:
+                return None
+            content_hash, kind, signature = fingerprint
+            candidates = set()
+            for key in self._keys(content_hash, kind, signature):
+                candidates |= self._buckets.get(key, set())
+            candidates.discard(pdf_id)
+            others = {other: self._fingerprints[other] for other in candidates}
+
+        matches = []
+        for other, (other_hash, other_kind, other_signature) in others.items():
+            if other_hash == content_hash:
+                matches.append((other, 1.0, "exact"))
+            elif kind == other_kind == "text":
+                similarity = _text_similarity(signature, other_signature)
+                if similarity >= TEXT_THRESHOLD:
+                    matches.append((other, similarity, "text"))
+            elif kind == other_kind == "image":
+                similarity = _image_similarity(signature, other_signature)
+                if similarity >= IMAGE_THRESHOLD:
+                    matches.append((other, similarity, "image"))
+        return sorted(matches, key=lambda match: (-match[1], match[0]))
+
+
+index = DuplicateIndex()
+_load_lock = threading.Lock()
+
+
+def ensure_loaded(db) -> DuplicateIndex:
+    """
+    初回の問い合わせ時と、他のワーカーで指紋が変わった場合（共有世代番号が進んだ場合）にインデックスを作り直す
+    変更の検出は世代番号の主キー検索1回（CACHE_SHARED_GENERATIONが無効なら問い合わせなし）で済む
+    """
+    import cache
+    import crud
+
+    generation = cache.shared_generation(db, cache.FINGERPRINTS)
+    if not index.loaded or index.state != generation:
+        with _load_lock:
+            if not index.loaded or index.state != generation:
+                index.load(crud.get_fingerprints(db), generation)
+    return index
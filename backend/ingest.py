@@ -0,0 +1,118 @@
+"""
+PDF取り込み後の処理
+  1. ページテキストの抽出と全文検索用の保存（pdf_pages_fts の索引にはトリガーで反映される）
+  2. 重複検出用の指紋の作成（dedup.py）
+
+アップロード・ダウンロード・クロールでPDFを登録した後にバックグラウンドで実行する。
+
+既存のPDFをまとめて処理し直す場合:
+  python ingest.py
+"""
+import os
+import logging
+from typing import Dict, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+import crud
+import dedup
+import page_cache
+import pdf_utils
+from database import SessionLocal, run_write
+
+# 環境設定の読み込み
+try:
+    from config import config as settings
+except ImportError:
+    # フォールバック設定
+    class FallbackSettings:
+        UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploaded_pdfs")
+
+    settings = FallbackSettings()
+
+logger = logging.getLogger(__name__)
+
+
+def extract_pages(file_path: str) -> Tuple[Dict[int, str], int]:
+    """
+    PDFのテキスト層をページごとに取得する（OCRは行わないため、スキャンPDFのページは登録されない）
+    戻り値: ({ページ番号: ページテキスト}, 総ページ数)
+    """
+    text_by_page, _, page_count = pdf_utils.extract_text_layer(file_path)
+    return text_by_page, page_count
+
+
+def make_fingerprint(file_path: str, text_by_page: Dict[int, str], page_count: int) -> Tuple[str, str, list]:
+    """
+    重複検出用の指紋 (ファイル内容のハッシュ, 種類, 署名) を作る
+    テキスト層が使えるPDFは本文のMinHash、使えないPDFは先頭ページのdHash
+    """
+    content_hash = page_cache.file_digest(file_path)
+    if pdf_utils.is_text_layer_usable(text_by_page, page_count):
+        text = "\n".join(text_by_page[page_number] for page_number in sorted(text_by_page))
+        return content_hash, "text", dedup.minhash(text)
+
+    page_hashes = [
+        dedup.dhash(page_cache.get_page_image(file_path, page_number, dpi=dedup.IMAGE_RENDER_DPI, color_mode="L"))
+        for page_number in range(1, min(page_count, dedup.IMAGE_MAX_PAGES) + 1)
+    ]
+    return content_hash, "image", page_hashes
+
+
+def log_duplicates(pdf_id: int) -> None:
+    db = SessionLocal()
+    try:
+        matches = dedup.ensure_loaded(db).find_duplicates(pdf_id) or []
+    finally:
+        db.close()
+    for other_id, similarity, method in matches:
+        logger.info(f"重複の可能性: ID {pdf_id} と ID {other_id}（{method}, 類似度 {similarity:.2f}）")
+
+
+def ingest_pdf(pdf_id: int, filename: str) -> None:
+    """PDFのページテキストと指紋を作成して保存する"""
+    file_path = os.path.join(settings.UPLOAD_DIR, filename)
+    if not os.path.exists(file_path):
+        logger.warning(f"取り込み処理: ファイルが見つかりません: {file_path}")
+        return
+
+    text_by_page, page_count = extract_pages(file_path)
+    try:
+        run_write(lambda session: crud.replace_pdf_pages(session, pdf_id, text_by_page))
+        logger.info(f"ページテキスト登録: ID {pdf_id} ({filename}) {len(text_by_page)} ページ")
+
+        content_hash, kind, signature = make_fingerprint(file_path, text_by_page, page_count)
+        run_write(lambda session: crud.save_fingerprint(session, pdf_id, content_hash, kind, signature))
+    except IntegrityError:
+        # 処理中にPDFが削除された
+        logger.warning(f"取り込み処理: PDFが削除されています: ID {pdf_id}")
+        return
+    log_duplicates(pdf_id)
+
+
+def ingest_pdfs(pdfs: Dict[int, str]) -> None:
+    """複数のPDF（{ID: ファイル名}）を順に取り込み処理する"""
+    for pdf_id, filename in pdfs.items():
+        try:
+            ingest_pdf(pdf_id, filename)
+        except Exception as e:
+            logger.error(f"取り込み処理エラー: ID {pdf_id} ({filename}): {str(e)}")
+
+
+def reingest_all() -> None:
+    """登録済みの全PDFを取り込み処理し直す"""
+    db = SessionLocal()
+    try:
+        pdfs = {pdf_id: filename for pdf_id, filename in crud.get_pdf_filenames(db)}
+    finally:
+        db.close()
+    print(f"取り込み処理: {len(pdfs)} 件")
+    ingest_pdfs(pdfs)
+
+
+if __name__ == "__main__":
+    from database import init_db
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    reingest_all()
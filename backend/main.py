@@ -1,10 +1,14 @@
 import os
 import shutil
 import sys
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form
+import asyncio
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Response, BackgroundTasks, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError, OperationalError
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 import httpx
 from urllib.parse import urlparse
@@ -29,12 +33,24 @@ except ImportError:
     
     settings = FallbackSettings()
 
-import crud, models, schemas
-from database import SessionLocal, engine
+import crud, models, schemas, migrations
+from database import SessionLocal, AsyncSessionLocal, engine, async_engine, run_write
 import pdf_utils
 import ai_analysis
+import batch_analysis
+import page_cache
+import ingest
+import dedup
+import similar
+import school_suggest
+import pagination
+import cache
+import catalog
+import serialization
+import compression
 
-app = FastAPI()
+# 一覧などのJSONはorjsonで出力する（orjsonが無ければ標準のjson）
+app = FastAPI(default_response_class=serialization.FastJSONResponse)
 
 # CORS設定
 origins = [
@@ -45,12 +61,29 @@ origins = [
     os.getenv("FRONTEND_URL", "http://localhost:3000")
 ]
 
+# JSONレスポンスの圧縮（CORSより内側に置き、保存する圧縮済みレスポンスにCORSのヘッダーを含めない）
+# 一覧は内容が依存するキャッシュの名前空間を指定し、書き込みがあるまで圧縮済みの本文を使い回す
+app.add_middleware(
+    compression.CompressionMiddleware,
+    cacheable={
+        "/pdfs/": (cache.PDFS,),
+        "/pdfs/search": (cache.PDFS,),
+        "/schools/": (cache.SCHOOLS,),
+        "/facets": (cache.FACETS,),
+        "/facets/": (cache.FACETS,),
+        "/question-types/": (cache.QUESTION_TYPES,),
+        "/questions/": (cache.QUESTIONS,),
+        "/questions/with-relations": (cache.QUESTIONS, cache.PDFS, cache.QUESTION_TYPES),
+    },
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER],
 )
 
 # データベース依存関係
@@ -61,6 +94,15 @@ def get_db():
     finally:
         db.close()
 
+# asyncエンドポイント用（同期セッションはイベントループをブロックするため使わない）
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def read_file_bytes(file_path: str) -> bytes:
+    with open(file_path, 'rb') as f:
+        return f.read()
+
 # アップロードディレクトリの設定
 UPLOAD_DIR = settings.UPLOAD_DIR
 
@@ -110,6 +152,7 @@ def on_startup():
     print("\n=== データベース初期化 ===")
     try:
         models.Base.metadata.create_all(bind=engine)
+        migrations.run_migrations(engine)
         print("データベース初期化完了")
     except Exception as e:
         print(f"データベース初期化エラー: {e}")
@@ -129,11 +172,8 @@ def on_startup():
             {"name": "図表問題", "description": "図表を読み取る問題"}
         ]
         
-        for type_data in default_types:
-            existing = crud.get_question_type_by_name(db, type_data["name"])
-            if not existing:
-                crud.create_question_type(db, schemas.QuestionTypeCreate(**type_data))
-                print(f"問題タイプ作成: {type_data['name']}")
+        for name in crud.ensure_question_types(db, default_types):
+            print(f"問題タイプ作成: {name}")
     except Exception as e:
         print(f"問題タイプ作成エラー: {e}")
         import traceback
@@ -141,6 +181,15 @@ def on_startup():
     finally:
         db.close()
     
+    # 類似問題の索引（バックグラウンドで読み込む）
+    similar.warm_up()
+    
+    # 学校名の入力補完
+    try:
+        school_suggest.reload()
+    except Exception as e:
+        print(f"学校名の候補の読み込みエラー: {e}")
+    
     print("\n=== アプリケーション起動完了 ===")
     port = os.getenv('PORT', '8000')
     print(f"使用ポート: {port}")
@@ -150,6 +199,11 @@ def on_startup():
     print(f"デバッグモード: {settings.DEBUG}")
     print("=== 起動プロセス完了 ===")
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    # 非同期エンジンのプールに残った接続を閉じる
+    await async_engine.dispose()
+
 @app.get("/")
 def read_root():
     return {"message": "PDF Management API"}
@@ -163,19 +217,164 @@ def health_check():
 def create_pdf(pdf: schemas.PDFCreate, db: Session = Depends(get_db)):
     return crud.create_pdf(db, pdf)
 
+def set_next_cursor(response: Response, items: list, limit: int, sort: Optional[str]) -> None:
+    """次ページがありそうな場合はカーソルをレスポンスヘッダーに設定する"""
+    cursor = pagination.next_cursor(items, limit, sort)
+    if cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = cursor
+
+def list_response(model, items: list, limit: int, sort: Optional[str]) -> Response:
+    """
+    一覧をTypeAdapterでまとめてシリアライズして返す
+    （response_modelによる1行ずつの検証・jsonable_encoderを通らない。次ページのカーソルはヘッダーに設定）
+    """
+    cursor = pagination.next_cursor(items, limit, sort)
+    headers = {pagination.NEXT_CURSOR_HEADER: cursor} if cursor else {}
+    return serialization.list_response(model, items, headers)
+
+def export_response(model, table, export_format: str) -> StreamingResponse:
+    """
+    全行をID順にJSON配列（format=json）またはNDJSON（format=ndjson）で少しずつ返す
+    レスポンスの送信中も読み込みを続けるため、リクエストのセッションではなく専用のセッションを使う
+    """
+    def batches():
+        db = SessionLocal()
+        try:
+            yield from crud.iter_batches(db, table, serialization.EXPORT_BATCH_SIZE)
+        finally:
+            db.close()
+
+    try:
+        body, media_type = serialization.stream(model, batches(), export_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(body, media_type=media_type)
+
+def catalog_response(body: bytes, cursor: Optional[str]) -> Response:
+    """PDFカタログのシリアライズ済みJSONをそのまま返す"""
+    headers = {pagination.NEXT_CURSOR_HEADER: cursor} if cursor else {}
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.get("/pdfs/", response_model=list[schemas.PDFOut])
-def read_pdfs(skip: int = 0, limit: int = 100, school: str = None, db: Session = Depends(get_db)):
-    if school:
-        return crud.get_pdfs_by_school(db, school, skip=skip, limit=limit)
-    return crud.get_pdfs(db, skip=skip, limit=limit)
+def read_pdfs(
+    skip: int = 0,
+    limit: int = 100,
+    school: str = None,
+    after: Optional[str] = None,
+    sort: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    PDF一覧を取得
+    after: 前のページのレスポンスヘッダー X-Next-Cursor の値（キーセットページネーション）
+    sort: id / created_at / year（先頭に - で降順）
+    """
+    try:
+        if catalog.ENABLED:
+            return catalog_response(*catalog.ensure_current(db).query(school=school, skip=skip, limit=limit, after=after, sort=sort))
+        if school:
+            pdfs = crud.get_pdfs_by_school(db, school, skip=skip, limit=limit, after=after, sort=sort)
+        else:
+            pdfs = crud.get_pdfs(db, skip=skip, limit=limit, after=after, sort=sort)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return list_response(schemas.PDFOut, pdfs, limit, sort)
+
+@app.get("/pdfs/search", response_model=List[schemas.PDFOut])
+def search_pdfs(
+    school: Optional[str] = None,
+    school_prefix: Optional[str] = None,
+    subject: Optional[str] = None,
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[str] = None,
+    sort: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    PDFを検索（学校の完全一致・前方一致、科目、年度の範囲）
+    after・sortは /pdfs/ と同じ（次ページのカーソルはレスポンスヘッダー X-Next-Cursor）
+    """
+    if year_from is not None and year_to is not None and year_from > year_to:
+        raise HTTPException(status_code=400, detail="year_fromはyear_to以下を指定してください")
+    try:
+        if catalog.ENABLED:
+            return catalog_response(*catalog.ensure_current(db).query(
+                school=school,
+                school_prefix=school_prefix,
+                subject=subject,
+                year_from=year_from,
+                year_to=year_to,
+                limit=limit,
+                after=after,
+                sort=sort,
+            ))
+        pdfs = crud.search_pdfs(
+            db,
+            school=school,
+            school_prefix=school_prefix,
+            subject=subject,
+            year_from=year_from,
+            year_to=year_to,
+            limit=limit,
+            after=after,
+            sort=sort,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return list_response(schemas.PDFOut, pdfs, limit, sort)
+
+@app.get("/pdfs/export", response_model=List[schemas.PDFOut])
+def export_pdfs(export_format: str = Query("ndjson", alias="format")):
+    """全てのPDFをエクスポート（format=ndjson: 1行1件 / format=json: JSON配列）"""
+    return export_response(schemas.PDFOut, models.PDF, export_format)
+
+@app.get("/search", response_model=List[schemas.PageSearchHit])
+@app.get("/search/", response_model=List[schemas.PageSearchHit], include_in_schema=False)
+def search_pages(
+    q: str = Query(..., min_length=1),
+    skip: int = 0,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """
+    PDFのページテキストを全文検索（例: /search?q=食塩水の濃度）
+    空白区切りで複数の語を指定するとAND検索。一致したPDF・ページと、一致箇所を<mark>で囲んだスニペットを返す
+    """
+    return crud.search_pages(db, q, skip=skip, limit=limit)
 
 @app.get("/schools/", response_model=List[str])
 def get_schools(db: Session = Depends(get_db)):
-    """学校一覧を取得"""
-    return crud.get_distinct_schools(db)
+    """学校一覧を取得（PDFの登録・更新・削除までキャッシュする）"""
+    return cache.get_or_load(cache.SCHOOLS, None, lambda: crud.get_distinct_schools(db), db)
+
+@app.get("/schools/suggest", response_model=List[schemas.SchoolSuggestion])
+def suggest_schools(prefix: str = "", limit: int = Query(10, ge=1, le=school_suggest.MAX_SUGGESTIONS)):
+    """
+    学校名の入力補完（前方一致、PDF件数の多い順。メモリ上のトライ木から返し、DBは読まない）
+    prefix: 入力中の学校名（ひらがな・カタカナ・ローマ字でもよい。漢字の学校名の読みは SCHOOL_ALIASES_FILE に登録する）
+    """
+    suggestions = school_suggest.ensure_loaded().suggest(prefix, limit)
+    return [{"school": school, "pdf_count": count} for school, count in suggestions]
+
+@app.get("/facets", response_model=schemas.FacetsOut)
+@app.get("/facets/", response_model=schemas.FacetsOut, include_in_schema=False)
+def get_facets(
+    school: Optional[str] = None,
+    subject: Optional[str] = None,
+    year: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    学校・科目・年度ごとのPDF件数を取得（絞り込みUI用）
+    school・subject・yearを指定すると、他の項目の件数をその条件で絞り込む
+    """
+    return cache.get_or_load(cache.FACETS, (school, subject, year), lambda: crud.get_facets(db, school, subject, year), db)
 
 @app.post("/upload_pdf/", response_model=schemas.PDFOut)
 def upload_pdf(
+    background_tasks: BackgroundTasks,
     url: str = Form(...),
     school: str = Form(...),
     subject: str = Form(...),
@@ -200,31 +399,21 @@ def upload_pdf(
             f.write(file_content)
         print(f"ファイル保存完了: {file_path}")
         
-        # 既存のPDFエントリを確認
-        existing_pdf = crud.get_pdf_by_filename(db, filename)
-        
-        if existing_pdf:
-            # 既存エントリがある場合は更新
-            print(f"既存PDFエントリを更新: {filename}")
-            pdf_update = {
-                'url': url,
-                'school': school,
-                'subject': subject,
-                'year': year
-            }
-            result = crud.update_pdf(db, existing_pdf.id, pdf_update)
-        else:
-            # 新規エントリを作成
-            pdf_in = schemas.PDFCreate(
-                url=url,
-                school=school,
-                subject=subject,
-                year=year,
-                filename=filename
-            )
-            result = crud.create_pdf(db, pdf_in)
+        # 既存エントリがある場合は更新、無ければ作成（1文のupsert）
+        pdf_in = schemas.PDFCreate(
+            url=url,
+            school=school,
+            subject=subject,
+            year=year,
+            filename=filename
+        )
+        
+        # 同時アップロードの書き込みは書き込みキューでまとめてコミットする
+        result = run_write(lambda session: crud.upsert_pdf(session, pdf_in))
         
         print(f"DB保存成功: {filename}")
+        # 全文検索用のページテキストはレスポンス後に抽出する
+        background_tasks.add_task(ingest.ingest_pdf, result.id, result.filename)
         return result
     except Exception as e:
         # エラーの場合、アップロードされたファイルを削除
@@ -236,11 +425,12 @@ def upload_pdf(
 
 @app.post("/download_pdf/", response_model=schemas.PDFOut)
 async def download_pdf_from_url_endpoint(
+    background_tasks: BackgroundTasks,
     url: str = Form(...),
     school: str = Form(None),
     subject: str = Form(None),
     year: int = Form(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     print(f"PDFダウンロード開始: {url}")
     print(f"メタデータ: 学校={school}, 科目={subject}, 年度={year}")
@@ -271,8 +461,9 @@ async def download_pdf_from_url_endpoint(
             year=year,
             filename=filename
         )
-        result = crud.create_pdf(db, pdf_in)
+        result = await crud.create_pdf_async(db, pdf_in)
         print(f"DB保存成功: {filename}")
+        background_tasks.add_task(ingest.ingest_pdf, result.id, result.filename)
         return result
     except ValueError as e:
         # ファイル名重複エラーの場合、ダウンロードされたファイルを削除
@@ -293,11 +484,12 @@ async def download_pdf_from_url_endpoint(
 
 @app.post("/crawl_pdfs/")
 async def crawl_pdfs_from_url(
+    background_tasks: BackgroundTasks,
     url: str = Form(...),
     school: str = Form(None),
     subject: str = Form(None),
     year: int = Form(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     WebサイトをクローリングしてPDFリンクを抽出し、ダウンロードする
@@ -319,6 +511,7 @@ async def crawl_pdfs_from_url(
         
         # ダウンロードされたPDFをDBに登録
         saved_pdfs = []
+        saved_ids = {}
         failed_saves = []
         
         for filename in downloaded_files:
@@ -342,8 +535,9 @@ async def crawl_pdfs_from_url(
                     year=pdf_year,
                     filename=filename
                 )
-                saved_pdf = crud.create_pdf(db, pdf_in)
-                saved_pdfs.append(saved_pdf)
+                saved_pdf = await crud.create_pdf_async(db, pdf_in)
+                saved_pdfs.append(saved_pdf.filename)
+                saved_ids[saved_pdf.id] = saved_pdf.filename
                 print(f"DB保存成功: {filename}")
                 
             except ValueError as e:
@@ -354,7 +548,8 @@ async def crawl_pdfs_from_url(
                 print(f"ファイル名重複: {filename} - {str(e)}")
                 failed_saves.append(f"重複: {filename}")
             except Exception as e:
-                # その他のエラーの場合も、ファイルを削除
+                # その他のエラーの場合も、ファイルを削除（失敗したトランザクションは破棄）
+                await db.rollback()
                 file_path = os.path.join(UPLOAD_DIR, filename)
                 if os.path.exists(file_path):
                     os.remove(file_path)
@@ -362,6 +557,7 @@ async def crawl_pdfs_from_url(
                 failed_saves.append(f"保存失敗: {filename}")
         
         print(f"保存完了: {len(saved_pdfs)}/{len(downloaded_files)}個成功")
+        background_tasks.add_task(ingest.ingest_pdfs, saved_ids)
         
         # 結果メッセージを詳細化
         message = f"{len(saved_pdfs)}個のPDFファイルをダウンロード・保存しました"
@@ -370,7 +566,7 @@ async def crawl_pdfs_from_url(
         
         return {
             "message": message,
-            "downloaded_files": [pdf.filename for pdf in saved_pdfs],
+            "downloaded_files": saved_pdfs,
             "total_found": len(downloaded_files),
             "successfully_saved": len(saved_pdfs),
             "failed_saves": failed_saves
@@ -385,15 +581,17 @@ async def crawl_pdfs_from_url(
         raise HTTPException(status_code=500, detail=f"クローリングに失敗しました: {str(e)}")
 
 @app.get("/pdfs/{pdf_id}/view")
-async def view_pdf(pdf_id: int, db: Session = Depends(get_db)):
+async def view_pdf(pdf_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     PDFファイルを表示する
     """
     from fastapi.responses import Response
     
-    pdf = db.query(models.PDF).filter(models.PDF.id == pdf_id).first()
+    pdf = await crud.get_pdf_by_id_async(db, pdf_id)
     if not pdf:
         raise HTTPException(status_code=404, detail="PDFが見つかりません")
+    # 再ダウンロード中にDB接続を保持し続けないよう読み取りトランザクションを終了する
+    await db.commit()
     
     file_path = os.path.join(UPLOAD_DIR, pdf.filename)
     
@@ -424,8 +622,7 @@ async def view_pdf(pdf_id: int, db: Session = Depends(get_db)):
                 if os.path.exists(alt_path):
                     print(f"✅ 代替パスでファイル発見: {alt_path}")
                     try:
-                        with open(alt_path, 'rb') as f:
-                            content = f.read()
+                        content = await asyncio.to_thread(read_file_bytes, alt_path)
                         print(f"📄 ファイル読み込み成功: {len(content)} bytes")
                         return Response(
                             content=content,
@@ -511,8 +708,7 @@ async def view_pdf(pdf_id: int, db: Session = Depends(get_db)):
             for alt_path in alternative_paths:
                 if os.path.exists(alt_path):
                     print(f"代替パスでファイル発見: {alt_path}")
-                    with open(alt_path, 'rb') as f:
-                        content = f.read()
+                    content = await asyncio.to_thread(read_file_bytes, alt_path)
                     return Response(
                         content=content,
                         media_type='application/pdf',
@@ -528,8 +724,7 @@ async def view_pdf(pdf_id: int, db: Session = Depends(get_db)):
     
     # PDFファイルを読み込んでCORSヘッダー付きで返す
     try:
-        with open(file_path, 'rb') as f:
-            content = f.read()
+        content = await asyncio.to_thread(read_file_bytes, file_path)
         return Response(
             content=content,
             media_type='application/pdf',
@@ -544,6 +739,31 @@ async def view_pdf(pdf_id: int, db: Session = Depends(get_db)):
         print(f"PDFファイル読み込みエラー: {e}")
         raise HTTPException(status_code=500, detail="PDFファイルの読み込みに失敗しました")
 
+@app.get("/pdfs/{pdf_id}/pages/{page_number}/image")
+async def get_pdf_page_image(pdf_id: int, page_number: int, dpi: int = 100, grayscale: bool = False, db: AsyncSession = Depends(get_async_db)):
+    """
+    PDFのページ画像（PNG）を取得する（ページ画像キャッシュから返す）
+    """
+    pdf = await crud.get_pdf_by_id_async(db, pdf_id)
+    if not pdf:
+        raise HTTPException(status_code=404, detail="PDFが見つかりません")
+    
+    file_path = os.path.join(UPLOAD_DIR, pdf.filename)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="PDFファイルが見つかりません")
+    
+    if not 50 <= dpi <= 300:
+        raise HTTPException(status_code=400, detail="dpiは50〜300の範囲で指定してください")
+    
+    page_count = await asyncio.to_thread(page_cache.get_page_count, file_path)
+    if not 1 <= page_number <= page_count:
+        raise HTTPException(status_code=404, detail=f"ページが見つかりません（全{page_count}ページ）")
+    
+    image_path = await asyncio.to_thread(
+        page_cache.get_page_image_path, file_path, page_number, dpi, "L" if grayscale else "RGB"
+    )
+    return FileResponse(image_path, media_type="image/png")
+
 @app.get("/pdfs/{pdf_id}")
 def get_pdf(pdf_id: int, db: Session = Depends(get_db)):
     """
@@ -585,12 +805,15 @@ def delete_pdf(pdf_id: int, db: Session = Depends(get_db)):
         pdf_path = os.path.join(UPLOAD_DIR, db_pdf.filename)
         print(f"ファイルパス: {pdf_path}")
         
-        # データベースからPDFレコードを削除
+        # データベースからPDFレコードを削除（書き込みキューでコミットする）
         print("データベースからの削除を開始...")
-        success = crud.delete_pdf(db, pdf_id)
+        try:
+            success = run_write(lambda session: crud.delete_pdf(session, pdf_id))
+        except Exception as e:
+            print(f"データベースからの削除に失敗しました: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"データベースからの削除に失敗しました: {str(e)}")
         if not success:
-            print("データベースからの削除に失敗しました")
-            raise HTTPException(status_code=500, detail="データベースからの削除に失敗しました")
+            raise HTTPException(status_code=404, detail="PDFが見つかりません")
         
         print("データベースからの削除が完了しました")
         
@@ -622,14 +845,92 @@ def delete_pdf(pdf_id: int, db: Session = Depends(get_db)):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"PDF削除中にエラーが発生しました: {str(e)}")
 
+def remove_pdf_files(filenames: List[str]) -> None:
+    """削除したPDFの物理ファイルを削除する（レスポンス送信後にバックグラウンドで実行）"""
+    removed = 0
+    for filename in filenames:
+        file_path = os.path.join(UPLOAD_DIR, filename)
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                removed += 1
+        except Exception as e:
+            print(f"ファイル削除警告: {file_path} - {str(e)}")
+    print(f"PDFファイル削除: {removed}/{len(filenames)} 件")
+
+@app.delete("/pdfs")
+@app.delete("/pdfs/", include_in_schema=False)
+def delete_pdfs(
+    background_tasks: BackgroundTasks,
+    ids: Optional[str] = None,
+    school: Optional[str] = None,
+    subject: Optional[str] = None,
+    year: Optional[int] = None,
+    delete_all: bool = Query(False, alias="all")
+):
+    """
+    PDFを一括削除する（管理者向け機能）
+    ids: カンマ区切りのPDF ID（例: 1,2,3）、またはschool・subject・yearで絞り込み
+    all: Trueの場合は全PDFを削除（条件を何も指定しない場合に必要）
+    関連する問題も含めて1トランザクションで削除し、ファイルはレスポンス後に削除する
+    """
+    pdf_ids = None
+    if ids is not None:
+        try:
+            pdf_ids = [int(x) for x in ids.split(",") if x.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="idsはカンマ区切りの数値で指定してください")
+        if not pdf_ids:
+            raise HTTPException(status_code=400, detail="idsが空です")
+
+    try:
+        deleted = run_write(lambda session: crud.delete_pdfs(
+            session, ids=pdf_ids, school=school, subject=subject, year=year, delete_all=delete_all
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"PDF一括削除エラー: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"PDF一括削除中にエラーが発生しました: {str(e)}")
+
+    background_tasks.add_task(remove_pdf_files, [pdf["filename"] for pdf in deleted])
+    deleted_ids = [pdf["id"] for pdf in deleted]
+    response = {
+        "success": True,
+        "deleted_count": len(deleted),
+        "deleted_ids": deleted_ids,
+    }
+    if pdf_ids is not None:
+        response["not_found_ids"] = sorted(set(pdf_ids) - set(deleted_ids))
+    return response
+
 # QuestionType エンドポイント
 @app.post("/question-types/", response_model=schemas.QuestionTypeOut)
 def create_question_type(question_type: schemas.QuestionTypeCreate, db: Session = Depends(get_db)):
     return crud.create_question_type(db, question_type)
 
 @app.get("/question-types/", response_model=List[schemas.QuestionTypeOut])
-def get_question_types(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_question_types(db, skip=skip, limit=limit)
+def get_question_types(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[str] = None,
+    sort: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    def load():
+        return [
+            schemas.QuestionTypeOut.model_validate(question_type)
+            for question_type in crud.get_question_types(db, skip=skip, limit=limit, after=after, sort=sort)
+        ]
+
+    try:
+        # 問題タイプの作成までキャッシュする
+        question_types = cache.get_or_load(cache.QUESTION_TYPES, (skip, limit, after, sort), load, db)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_next_cursor(response, question_types, limit, sort)
+    return question_types
 
 @app.get("/question-types/{question_type_id}", response_model=schemas.QuestionTypeOut)
 def get_question_type(question_type_id: int, db: Session = Depends(get_db)):
@@ -643,9 +944,97 @@ def get_question_type(question_type_id: int, db: Session = Depends(get_db)):
 def create_question(question: schemas.QuestionCreate, db: Session = Depends(get_db)):
     return crud.create_question(db, question)
 
+def sparse_response(rows: list, response: Response) -> JSONResponse:
+    """fields指定時のレスポンス（指定した項目だけを含む辞書のリスト）"""
+    content = [row._asdict() for row in rows]
+    headers = {}
+    if pagination.NEXT_CURSOR_HEADER in response.headers:
+        headers[pagination.NEXT_CURSOR_HEADER] = response.headers[pagination.NEXT_CURSOR_HEADER]
+    return serialization.FastJSONResponse(content=content, headers=headers)
+
 @app.get("/questions/", response_model=List[schemas.QuestionOut])
-def get_questions(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_questions(db, skip=skip, limit=limit)
+def get_questions(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[str] = None,
+    sort: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    問題一覧を取得
+    fields: 返す項目のカンマ区切り（例: id,question_number,question_type_id）
+            指定した列だけを読み込むため、問題文などの大きな列を省略できる
+    """
+    try:
+        field_names = crud.parse_question_fields(fields, sort)
+        questions = crud.get_questions(db, skip=skip, limit=limit, after=after, sort=sort, fields=field_names)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if field_names:
+        set_next_cursor(response, questions, limit, sort)
+        return sparse_response(questions, response)
+    return list_response(schemas.QuestionOut, questions, limit, sort)
+
+@app.get("/questions/with-relations", response_model=List[schemas.QuestionWithRelations])
+def get_questions_with_relations(
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[str] = None,
+    sort: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    PDFと問題タイプを含む問題一覧を取得（関連はまとめて読み込む）
+    """
+    try:
+        questions = crud.get_questions_with_relations(db, skip=skip, limit=limit, after=after, sort=sort)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return list_response(schemas.QuestionWithRelations, questions, limit, sort)
+
+@app.get("/questions/export", response_model=List[schemas.QuestionOut])
+def export_questions(export_format: str = Query("ndjson", alias="format")):
+    """全ての問題をエクスポート（format=ndjson: 1行1件 / format=json: JSON配列）"""
+    return export_response(schemas.QuestionOut, models.Question, export_format)
+
+@app.get("/questions/{question_id}/with-relations", response_model=schemas.QuestionWithRelations)
+def get_question_with_relations(question_id: int, db: Session = Depends(get_db)):
+    question = crud.get_question_with_relations(db, question_id)
+    if not question:
+        raise HTTPException(status_code=404, detail="問題が見つかりません")
+    return question
+
+@app.get("/questions/{question_id}/similar", response_model=List[schemas.SimilarQuestionOut])
+def get_similar_questions(
+    question_id: int,
+    limit: int = Query(10, ge=1, le=100),
+    other_schools: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    問題文が似ている問題を取得（類似度の高い順）
+    other_schools: Trueの場合は別の学校の問題だけを返す
+    """
+    if not similar.NUMPY_AVAILABLE:
+        raise HTTPException(status_code=503, detail="類似問題の検索に必要なライブラリ（numpy）がインストールされていません")
+    question = crud.get_question_with_relations(db, question_id)
+    if not question:
+        raise HTTPException(status_code=404, detail="問題が見つかりません")
+
+    # 削除済みの問題や同じ学校の問題を除いてもlimit件残るよう、多めに候補を取る
+    candidates = similar.ensure_current(db).similar(question_id, question.question_text, limit=limit * (5 if other_schools else 2))
+    questions = crud.get_questions_with_relations_by_ids(db, [candidate_id for candidate_id, _ in candidates])
+    results = []
+    for candidate_id, similarity in candidates:
+        candidate = questions.get(candidate_id)
+        if not candidate or (other_schools and candidate.pdf.school == question.pdf.school):
+            continue
+        results.append({"question": candidate, "similarity": similarity})
+        if len(results) == limit:
+            break
+    return results
 
 @app.get("/questions/{question_id}", response_model=schemas.QuestionOut)
 def get_question(question_id: int, db: Session = Depends(get_db)):
@@ -654,15 +1043,41 @@ def get_question(question_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="問題が見つかりません")
     return question
 
+@app.get("/pdfs/{pdf_id}/duplicates", response_model=List[schemas.DuplicateOut])
+def get_pdf_duplicates(pdf_id: int, db: Session = Depends(get_db)):
+    """
+    同じ試験問題とみなせる別のPDFを取得（類似度の高い順）
+    method: exact（同一ファイル）/ text（本文のMinHash）/ image（スキャンPDFのページのdHash）
+    """
+    if not crud.get_pdf_by_id(db, pdf_id):
+        raise HTTPException(status_code=404, detail="PDFが見つかりません")
+    matches = dedup.ensure_loaded(db).find_duplicates(pdf_id)
+    if matches is None:
+        raise HTTPException(status_code=404, detail="重複判定用の指紋がまだ作成されていません")
+    pdfs = crud.get_pdfs_by_ids(db, [other_id for other_id, _, _ in matches])
+    return [
+        {"pdf": pdfs[other_id], "similarity": similarity, "method": method}
+        for other_id, similarity, method in matches
+        if other_id in pdfs
+    ]
+
 @app.get("/pdfs/{pdf_id}/questions", response_model=List[schemas.QuestionOut])
-def get_questions_by_pdf(pdf_id: int, db: Session = Depends(get_db)):
+def get_questions_by_pdf(pdf_id: int, response: Response, fields: Optional[str] = None, db: Session = Depends(get_db)):
     """
     PDFに関連する問題一覧を取得
+    fields: 返す項目のカンマ区切り（/questions/ と同じ）
     """
     pdf = crud.get_pdf_by_id(db, pdf_id)
     if not pdf:
         raise HTTPException(status_code=404, detail="PDFが見つかりません")
-    return crud.get_questions_by_pdf_id(db, pdf_id)
+    try:
+        field_names = crud.parse_question_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    questions = crud.get_questions_by_pdf_id(db, pdf_id, fields=field_names)
+    if field_names:
+        return sparse_response(questions, response)
+    return questions
 
 @app.put("/questions/{question_id}", response_model=schemas.QuestionOut)
 def update_question(question_id: int, question_update: dict, db: Session = Depends(get_db)):
@@ -711,18 +1126,7 @@ def get_question_types(db: Session = Depends(get_db)):
 def create_question_type(question_type: schemas.QuestionTypeCreate, db: Session = Depends(get_db)):
     return crud.create_question_type(db, question_type)
 
-# 問題関連のエンドポイント
-@app.get("/questions/", response_model=List[schemas.QuestionWithRelations])
-def get_questions(db: Session = Depends(get_db)):
-    return crud.get_questions(db)
-
-@app.get("/questions/{question_id}", response_model=schemas.QuestionWithRelations)
-def get_question(question_id: int, db: Session = Depends(get_db)):
-    question = crud.get_question(db, question_id)
-    if not question:
-        raise HTTPException(status_code=404, detail="Question not found")
-    return question
-
+# 問題関連のエンドポイント（関連を含む取得は /questions/with-relations）
 @app.post("/questions/", response_model=schemas.QuestionOut)
 def create_question(question: schemas.QuestionCreate, db: Session = Depends(get_db)):
     return crud.create_question(db, question)
@@ -742,14 +1146,69 @@ def delete_question(question_id: int, db: Session = Depends(get_db)):
     return {"message": "Question deleted successfully"}
 
 @app.post("/questions/batch")
-def create_multiple_questions(questions: List[schemas.QuestionCreate], db: Session = Depends(get_db)):
-    created_questions = crud.create_multiple_questions(db, questions)
-    return {"message": f"Successfully created {len(created_questions)} questions", "questions": created_questions}
+def create_multiple_questions(
+    questions: List[schemas.QuestionCreate],
+    include_questions: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    複数の問題を一括作成する（作成した問題のIDを入力と同じ順で返す）
+    include_questions: trueの場合は以前のレスポンスと同じく作成した問題も "questions" で返す（1回のSELECTでまとめて読む）
+    """
+    try:
+        ids = run_write(lambda session: crud.bulk_create_questions(session, questions))
+    except IntegrityError as e:
+        raise HTTPException(status_code=400, detail=f"問題の一括作成に失敗しました（PDF・問題タイプのIDを確認してください）: {str(e.orig)}")
+    result = {"message": f"Successfully created {len(ids)} questions", "ids": ids}
+    if include_questions:
+        result["questions"] = [schemas.QuestionOut.model_validate(question) for question in crud.get_questions_by_ids(db, ids)]
+    return result
+
+@app.post("/questions/batch/ndjson")
+async def create_questions_from_ndjson(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    大量の問題を一括作成する（1行に1問のJSONを並べたNDJSONをリクエストボディで送る）
+    ボディを読みながら1000件ずつINSERTし、全体を1トランザクションでコミットする
+    """
+    async def parse_lines():
+        buffer = b""
+        line_number = 0
+        async for block in request.stream():
+            buffer += block
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                line_number += 1
+                if line.strip():
+                    yield parse_question_line(line, line_number)
+        if buffer.strip():
+            yield parse_question_line(buffer, line_number + 1)
+
+    try:
+        created = await crud.bulk_create_questions_stream_async(db, parse_lines())
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except IntegrityError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=f"問題の一括作成に失敗しました（PDF・問題タイプのIDを確認してください）: {str(e.orig)}")
+    except OperationalError as e:
+        # コミットできなかった場合は1件も保存されていない（リクエストボディは読み終えているため再送してもらう）
+        raise HTTPException(status_code=503, detail=f"データベースが使用中のため問題を保存できませんでした。再度お試しください: {str(e.orig)}")
+    return {"message": f"Successfully created {created} questions", "created_count": created}
+
+def parse_question_line(line: bytes, line_number: int) -> dict:
+    """NDJSONの1行を検証して問題の辞書にする"""
+    try:
+        return schemas.QuestionCreate.model_validate_json(line).dict()
+    except ValidationError as e:
+        raise ValueError(f"{line_number}行目が不正です: {e.errors()[0]['msg']}")
 
 @app.post("/pdfs/{pdf_id}/analyze")
-async def analyze_pdf_with_ai(pdf_id: int, db: Session = Depends(get_db)):
+async def analyze_pdf_with_ai(pdf_id: int, mode: Optional[str] = None, refresh: bool = False, db: AsyncSession = Depends(get_async_db)):
     """
     PDFをClaudeで分析する
+    mode: auto（既定）/ text / image
+    refresh: Trueの場合は保存済みの分析結果を使わずに再分析する
     """
     try:
         # ANTHROPIC_API_KEYの確認
@@ -760,10 +1219,27 @@ async def analyze_pdf_with_ai(pdf_id: int, db: Session = Depends(get_db)):
             }
         
         # PDF情報を取得
-        pdf = crud.get_pdf_by_id(db, pdf_id)
+        pdf = await crud.get_pdf_by_id_async(db, pdf_id)
         if not pdf:
             raise HTTPException(status_code=404, detail="PDFが見つかりません")
         
+        # 保存済みの分析結果があればそれを返す
+        if not refresh:
+            cached_mode = mode if mode in ("text", "image") else None
+            cached = await crud.get_latest_analysis_async(db, pdf_id, mode=cached_mode)
+            if cached:
+                return {
+                    "success": True,
+                    "analysis": cached.analysis,
+                    "pages_converted": cached.pages_converted,
+                    "mode": cached.mode,
+                    "cached": True,
+                    "analyzed_at": cached.created_at
+                }
+        
+        # 分析中に読み取りトランザクション（DB接続）を保持し続けないよう終了する
+        await db.commit()
+        
         # PDFファイルパスを構築
         pdf_path = os.path.join(UPLOAD_DIR, pdf.filename)
         if not os.path.exists(pdf_path):
@@ -793,8 +1269,11 @@ async def analyze_pdf_with_ai(pdf_id: int, db: Session = Depends(get_db)):
                 pdf_path=pdf_path,
                 school=pdf.school,
                 subject=pdf.subject,
-                year=pdf.year
+                year=pdf.year,
+                mode=mode
             )
+            if result.get("success"):
+                await crud.create_analysis_async(db, pdf_id, result)
             return result
         except ImportError as e:
             return {
@@ -817,3 +1296,47 @@ async def analyze_pdf_with_ai(pdf_id: int, db: Session = Depends(get_db)):
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"分析中にエラーが発生しました: {str(e)}")
+
+# 一括AI分析（実行中のジョブ: job_id -> asyncio.Task）
+batch_analysis_tasks = {}
+
+@app.post("/analysis/batch")
+async def start_batch_analysis(request: schemas.BatchAnalysisRequest):
+    """
+    条件（学校・科目・年度）に一致するPDFをまとめてAI分析する
+    分析済みのPDFはスキップし、job_idを指定すると中断したジョブを続きから再開する
+    """
+    if not settings.ANTHROPIC_API_KEY:
+        raise HTTPException(status_code=503, detail="AI分析機能を利用するにはANTHROPIC_API_KEYの設定が必要です")
+    
+    running = batch_analysis_tasks.get(request.job_id)
+    if running and not running.done():
+        raise HTTPException(status_code=409, detail=f"ジョブ {request.job_id} は実行中です")
+    
+    try:
+        job = batch_analysis.BatchAnalysisJob(
+            job_id=request.job_id,
+            school=request.school,
+            subject=request.subject,
+            year=request.year,
+            mode=request.mode
+        )
+    except batch_analysis.JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job.save_checkpoint()
+    batch_analysis_tasks[job.job_id] = asyncio.create_task(job.run())
+    return {"job_id": job.job_id, "status": "started", "filters": job.state["filters"]}
+
+@app.get("/analysis/batch/{job_id}")
+def get_batch_analysis(job_id: str):
+    """
+    一括AI分析ジョブの進捗を取得する
+    """
+    state = batch_analysis.load_checkpoint(job_id)
+    if not state:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    task = batch_analysis_tasks.get(job_id)
+    state["running"] = bool(task and not task.done())
+    return state
@@ -0,0 +1,151 @@
+"""
+既存データベース向けのスキーマ移行（何度実行しても同じ結果になる）
+
+create_allは既存テーブルにインデックスを追加しないため、
+起動時にこのモジュールで不足しているインデックスを作成する。
+
+使い方:
+  python migrations.py
+"""
+import sqlite3
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# (インデックス名, 作成SQL)
+INDEXES = [
+    ("ix_pdfs_school_subject_year", "CREATE INDEX IF NOT EXISTS ix_pdfs_school_subject_year ON pdfs (school, subject, year)"),
+    ("ix_pdfs_subject_year", "CREATE INDEX IF NOT EXISTS ix_pdfs_subject_year ON pdfs (subject, year)"),
+    ("ix_questions_pdf_id", "CREATE INDEX IF NOT EXISTS ix_questions_pdf_id ON questions (pdf_id)"),
+    ("ix_pdf_analyses_pdf_id", "CREATE INDEX IF NOT EXISTS ix_pdf_analyses_pdf_id ON pdf_analyses (pdf_id)"),
+    ("ix_pdfs_created_at_id", "CREATE INDEX IF NOT EXISTS ix_pdfs_created_at_id ON pdfs (created_at, id)"),
+    ("ix_pdfs_year_id", "CREATE INDEX IF NOT EXISTS ix_pdfs_year_id ON pdfs (year, id)"),
+    ("ix_questions_created_at_id", "CREATE INDEX IF NOT EXISTS ix_questions_created_at_id ON questions (created_at, id)"),
+]
+
+# ファイル名が重複している既存データでは一意インデックスを作成できないため、
+# 重複が解消されるまでは通常のインデックスで代用する
+FILENAME_UNIQUE_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS ix_pdfs_filename ON pdfs (filename)"
+FILENAME_FALLBACK_INDEX = "CREATE INDEX IF NOT EXISTS ix_pdfs_filename_nonunique ON pdfs (filename)"
+
+# pdfs.filenameに一意インデックスがあるか（Falseの間はON CONFLICTで重複を防げないため、crudは事前チェックを行う）
+filename_unique = True
+
+
+def find_duplicate_filenames(conn, limit: int = 5) -> list:
+    """pdfs.filenameの重複を検出する"""
+    result = conn.execute(text(
+        "SELECT filename, COUNT(*) FROM pdfs GROUP BY filename HAVING COUNT(*) > 1 LIMIT :limit"
+    ), {"limit": limit})
+    return [(row[0], row[1]) for row in result]
+
+
+def migrate_filename_index(conn) -> None:
+    global filename_unique
+    duplicates = find_duplicate_filenames(conn)
+    filename_unique = not duplicates
+    if duplicates:
+        print("警告: ファイル名の重複があるため、pdfs.filenameに一意インデックスを作成できません")
+        for filename, count in duplicates:
+            print(f"  重複: {filename} ({count}件)")
+        print("  重複を解消した後に再起動すると一意インデックスに切り替わります")
+        conn.execute(text(FILENAME_FALLBACK_INDEX))
+        return
+
+    conn.execute(text(FILENAME_UNIQUE_INDEX))
+    conn.execute(text("DROP INDEX IF EXISTS ix_pdfs_filename_nonunique"))
+
+
+# pdf_facetsをpdfsから集計し直す（既存データの初期集計と、ずれの補正）
+SYNC_PDF_FACETS = [
+    """
+    INSERT INTO pdf_facets (school, subject, year, pdf_count)
+    SELECT school, subject, year, COUNT(*) FROM pdfs WHERE 1 = 1 GROUP BY school, subject, year
+    ON CONFLICT (school, subject, year) DO UPDATE SET pdf_count = excluded.pdf_count
+    WHERE pdf_facets.pdf_count <> excluded.pdf_count
+    """,
+    """
+    DELETE FROM pdf_facets WHERE NOT EXISTS (
+        SELECT 1 FROM pdfs
+        WHERE pdfs.school = pdf_facets.school AND pdfs.subject = pdf_facets.subject AND pdfs.year = pdf_facets.year
+    )
+    """,
+]
+
+
+# ページテキストの全文検索（SQLiteのFTS5。trigramトークナイザーなら形態素解析なしで日本語を部分一致検索できる）
+# pdf_pagesを外部コンテンツとし、トリガーで索引を追従させる
+PAGE_SEARCH_STATEMENTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS pdf_pages_fts USING fts5(text, content='pdf_pages', content_rowid='id', tokenize='trigram')",
+    """
+    CREATE TRIGGER IF NOT EXISTS pdf_pages_fts_insert AFTER INSERT ON pdf_pages BEGIN
+        INSERT INTO pdf_pages_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pdf_pages_fts_delete AFTER DELETE ON pdf_pages BEGIN
+        INSERT INTO pdf_pages_fts (pdf_pages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pdf_pages_fts_update AFTER UPDATE ON pdf_pages BEGIN
+        INSERT INTO pdf_pages_fts (pdf_pages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO pdf_pages_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+]
+
+# pdf_pages_ftsが使えるか（Falseの間はcrud.search_pagesがLIKEで検索する）
+page_search_available = False
+
+
+def fts5_trigram_supported(conn) -> bool:
+    """FTS5が有効で、trigramトークナイザーがあるSQLite（3.34以降）か"""
+    if sqlite3.sqlite_version_info < (3, 34, 0):
+        return False
+    return bool(conn.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar())
+
+
+def migrate_page_search(conn) -> None:
+    global page_search_available
+    page_search_available = conn.dialect.name == "sqlite" and fts5_trigram_supported(conn)
+    if not page_search_available:
+        if conn.dialect.name == "sqlite":
+            print("警告: FTS5（trigram）が使えないため、全文検索は部分一致（LIKE）で行います")
+        return
+
+    # 索引かトリガーが無い（新規作成、またはpdf_pagesが作り直された）場合は索引を作り直す
+    existing = {row[0] for row in conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE name IN ('pdf_pages_fts', 'pdf_pages_fts_insert')"
+    ))}
+    for statement in PAGE_SEARCH_STATEMENTS:
+        conn.execute(text(statement))
+    if len(existing) < 2:
+        conn.execute(text("INSERT INTO pdf_pages_fts (pdf_pages_fts) VALUES ('rebuild')"))
+
+
+def sync_pdf_facets(conn) -> None:
+    for statement in SYNC_PDF_FACETS:
+        conn.execute(text(statement))
+
+
+def run_migrations(engine: Engine) -> None:
+    """不足しているインデックスを作成し、集計テーブルをpdfsと揃える"""
+    with engine.begin() as conn:
+        migrate_filename_index(conn)
+        for name, statement in INDEXES:
+            conn.execute(text(statement))
+        sync_pdf_facets(conn)
+        migrate_page_search(conn)
+        if engine.dialect.name == "sqlite":
+            # クエリプランナーの統計情報を必要に応じて更新する
+            conn.execute(text("PRAGMA optimize"))
+    print("データベース移行完了")
+
+
+if __name__ == "__main__":
+    from database import engine
+    import models
+
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Float, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -12,9 +12,18 @@ class PDF(Base):
     school = Column(String, nullable=False)
     subject = Column(String, nullable=False)
     year = Column(Integer, nullable=False)
-    filename = Column(String, nullable=False)
+    filename = Column(String, nullable=False, unique=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        Index("ix_pdfs_school_subject_year", "school", "subject", "year"),
+        # 学校を指定しない検索（科目・年度）
+        Index("ix_pdfs_subject_year", "subject", "year"),
+        # キーセットページネーションの並び順（ソートキー, id）
+        Index("ix_pdfs_created_at_id", "created_at", "id"),
+        Index("ix_pdfs_year_id", "year", "id"),
+    )
+    
     # リレーションシップ
     questions = relationship(
         "Question",
@@ -22,6 +31,12 @@ class PDF(Base):
         cascade="all, delete-orphan",
         passive_deletes=True,
     )
+    analyses = relationship(
+        "PDFAnalysis",
+        back_populates="pdf",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
 
 class QuestionType(Base):
     __tablename__ = "question_types"
@@ -36,7 +51,7 @@ class QuestionType(Base):
 class Question(Base):
     __tablename__ = "questions"
     id = Column(Integer, primary_key=True, index=True)
-    pdf_id = Column(Integer, ForeignKey("pdfs.id", ondelete="CASCADE"), nullable=False)
+    pdf_id = Column(Integer, ForeignKey("pdfs.id", ondelete="CASCADE"), nullable=False, index=True)
     question_type_id = Column(Integer, ForeignKey("question_types.id"), nullable=False)
     question_number = Column(String, nullable=False)  # 問題番号（例：1, 2, 3-1, 3-2）
     question_text = Column(Text, nullable=False)  # 問題文
@@ -48,6 +63,52 @@ class Question(Base):
     keywords = Column(Text)  # キーワード（カンマ区切り）
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        Index("ix_questions_created_at_id", "created_at", "id"),
+    )
+    
     # リレーションシップ
     pdf = relationship("PDF", back_populates="questions")
     question_type = relationship("QuestionType", back_populates="questions")
+
+class PDFAnalysis(Base):
+    __tablename__ = "pdf_analyses"
+    id = Column(Integer, primary_key=True, index=True)
+    pdf_id = Column(Integer, ForeignKey("pdfs.id", ondelete="CASCADE"), nullable=False, index=True)
+    mode = Column(String, nullable=False)  # 分析モード（text / image）
+    analysis = Column(Text, nullable=False)  # Claudeの分析結果
+    pages_converted = Column(Integer)  # 画像として送信したページ数
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # リレーションシップ
+    pdf = relationship("PDF", back_populates="analyses")
+
+class PDFPage(Base):
+    __tablename__ = "pdf_pages"
+    # 全文検索用のページテキスト（ingest.pyが取り込み時に抽出する）
+    id = Column(Integer, primary_key=True)
+    pdf_id = Column(Integer, ForeignKey("pdfs.id", ondelete="CASCADE"), nullable=False, index=True)
+    page_number = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+
+class PDFFingerprint(Base):
+    __tablename__ = "pdf_fingerprints"
+    # 重複判定用の指紋（dedup.py）
+    pdf_id = Column(Integer, ForeignKey("pdfs.id", ondelete="CASCADE"), primary_key=True)
+    content_hash = Column(String, nullable=False, index=True)  # ファイル内容のSHA-256
+    kind = Column(String, nullable=False)  # text（MinHash）/ image（ページのdHash）
+    signature = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class PDFFacet(Base):
+    __tablename__ = "pdf_facets"
+    # 学校・科目・年度の組み合わせごとのPDF件数（crudがPDFの登録・更新・削除のたびに増減する）
+    school = Column(String, primary_key=True)
+    subject = Column(String, primary_key=True)
+    year = Column(Integer, primary_key=True)
+    pdf_count = Column(Integer, nullable=False, default=0)
+
+class CacheGeneration(Base):
+    __tablename__ = "cache_generations"
+    name = Column(String, primary_key=True)  # キャッシュの名前空間（cache.py）
+    generation = Column(Integer, nullable=False, default=0)  # 書き込みのたびに1増やす
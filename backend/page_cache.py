@@ -0,0 +1,202 @@
+import os
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+from typing import Optional, List
+
+import pdfplumber
+from PIL import Image
+try:
+    from pdf2image import convert_from_path
+    PDF2IMAGE_AVAILABLE = True
+except ImportError:
+    PDF2IMAGE_AVAILABLE = False
+
+# 環境設定の読み込み
+try:
+    from config import config as settings
+except ImportError:
+    # フォールバック設定
+    class FallbackSettings:
+        PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", "page_cache")
+        PAGE_CACHE_MAX_MB = int(os.getenv("PAGE_CACHE_MAX_MB", "500"))
+        PAGE_RENDER_DPI = int(os.getenv("PAGE_RENDER_DPI", "200"))
+
+    settings = FallbackSettings()
+
+logger = logging.getLogger(__name__)
+
+# サポートするカラーモード（RGB: カラー, L: グレースケール）
+COLOR_MODES = ("RGB", "L")
+
+# 上限を超えたら、この割合まで古いものから削除する
+EVICT_TARGET_RATIO = 0.9
+
+# ファイル内容のハッシュを覚えておく件数（(パス, サイズ, 更新時刻) ごと。超えたら古いものから忘れる）
+DIGEST_MEMO_SIZE = 1024
+
+_lock = threading.Lock()
+# キャッシュディレクトリの合計サイズ（初回アクセス時に集計）
+_cache_bytes: Optional[int] = None
+
+
+def file_digest(pdf_path: str) -> str:
+    """PDFファイル内容のSHA-256（同じ内容なら別名ファイルでもキャッシュを共有する）"""
+    stat = os.stat(pdf_path)
+    return _hash_file(os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=DIGEST_MEMO_SIZE)
+def _hash_file(path: str, size: int, mtime_ns: int) -> str:
+    """ファイル内容のSHA-256（サイズ・更新時刻が変わればキーが変わり、計算し直す）"""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_page_count(pdf_path: str) -> int:
+    """PDFのページ数を取得する"""
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+def _cache_path(digest: str, page_number: int, dpi: int, color_mode: str) -> str:
+    return os.path.join(settings.PAGE_CACHE_DIR, digest[:2], f"{digest}_p{page_number}_{dpi}dpi_{color_mode}.png")
+
+
+def _render_page(pdf_path: str, page_number: int, dpi: int, color_mode: str) -> Image.Image:
+    """1ページをラスタライズする（pdf2image/popplerが使えない場合はpdfplumberで描画）"""
+    image = None
+    if PDF2IMAGE_AVAILABLE:
+        try:
+            images = convert_from_path(
+                pdf_path,
+                dpi=dpi,
+                first_page=page_number,
+                last_page=page_number,
+                grayscale=(color_mode == "L")
+            )
+            image = images[0] if images else None
+        except Exception as e:
+            logger.warning(f"pdf2imageでの描画に失敗したためpdfplumberで描画します: {str(e)}")
+    if image is None:
+        with pdfplumber.open(pdf_path) as pdf:
+            image = pdf.pages[page_number - 1].to_image(resolution=dpi).original
+    return image.convert(color_mode)
+
+
+def _scan_cache_bytes() -> int:
+    total = 0
+    for root, _, files in os.walk(settings.PAGE_CACHE_DIR):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _evict_if_needed() -> None:
+    """キャッシュの合計サイズが上限を超えたら、最終アクセスが古い順に削除する（_lock保持中に呼ぶ）"""
+    global _cache_bytes
+    max_bytes = settings.PAGE_CACHE_MAX_MB * 1024 * 1024
+    if _cache_bytes is None or _cache_bytes <= max_bytes:
+        return
+
+    entries = []
+    for root, _, files in os.walk(settings.PAGE_CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries)
+    target = max_bytes * EVICT_TARGET_RATIO
+    removed = 0
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError:
+            pass
+    _cache_bytes = total
+    logger.info(f"ページ画像キャッシュを整理: {removed} 件削除, 現在 {total / 1024 / 1024:.1f}MB")
+
+
+def get_page_image_path(
+    pdf_path: str,
+    page_number: int,
+    dpi: Optional[int] = None,
+    color_mode: str = "RGB"
+) -> str:
+    """
+    ページ画像（PNG）のキャッシュファイルパスを返す（未キャッシュなら描画して保存する）
+    キーは (PDF内容のハッシュ, ページ番号, dpi, カラーモード)
+    """
+    global _cache_bytes
+    dpi = dpi or settings.PAGE_RENDER_DPI
+    if color_mode not in COLOR_MODES:
+        raise ValueError(f"カラーモードが不正です: {color_mode}")
+
+    path = _cache_path(file_digest(pdf_path), page_number, dpi, color_mode)
+    if os.path.exists(path):
+        # 更新時刻を最終アクセス時刻として使う（LRU）
+        try:
+            os.utime(path)
+            return path
+        except OSError:
+            pass  # 直前に削除された場合は再描画する
+
+    image = _render_page(pdf_path, page_number, dpi, color_mode)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    image.save(tmp_path, format="PNG")
+    os.replace(tmp_path, path)
+
+    with _lock:
+        if _cache_bytes is None:
+            _cache_bytes = _scan_cache_bytes()
+        else:
+            _cache_bytes += os.path.getsize(path)
+        _evict_if_needed()
+    return path
+
+
+def get_page_image(
+    pdf_path: str,
+    page_number: int,
+    dpi: Optional[int] = None,
+    color_mode: str = "RGB"
+) -> Image.Image:
+    """ページ画像をキャッシュ経由で取得する"""
+    path = get_page_image_path(pdf_path, page_number, dpi, color_mode)
+    try:
+        with Image.open(path) as image:
+            image.load()
+            return image
+    except FileNotFoundError:
+        # パスを受け取ってから開くまでの間に、他のリクエストの整理で削除された
+        logger.info(f"ページ画像キャッシュが削除されていたため再描画します: {path}")
+        return _render_page(pdf_path, page_number, dpi or settings.PAGE_RENDER_DPI, color_mode)
+
+
+def get_page_images(
+    pdf_path: str,
+    pages: Optional[List[int]] = None,
+    dpi: Optional[int] = None,
+    color_mode: str = "RGB"
+) -> List[Image.Image]:
+    """複数ページの画像をキャッシュ経由で取得する（pages未指定なら全ページ）"""
+    if pages is None:
+        pages = list(range(1, get_page_count(pdf_path) + 1))
+    return [get_page_image(pdf_path, page_number, dpi, color_mode) for page_number in pages]
@@ -0,0 +1,105 @@
+"""
+一覧APIのキーセット（カーソル）ページネーション
+
+OFFSETは読み飛ばす行数に比例して遅くなるため、
+直前のページの最後の行の (ソートキー, id) より後ろを
+インデックスで直接検索する。
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, List, Tuple
+
+from sqlalchemy import tuple_, literal
+
+# モデルごとに並び替えに使える列（pdfs・questionsは (列, id) の複合インデックスあり、question_typesは少量のため不要）
+SORT_KEYS = {
+    "pdfs": ("id", "created_at", "year"),
+    "questions": ("id", "created_at"),
+    "question_types": ("id", "created_at"),
+}
+
+# 次ページのカーソルを返すレスポンスヘッダー
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def parse_sort(model, sort: Optional[str]) -> Tuple[str, bool]:
+    """
+    sortパラメータを (列名, 降順かどうか) に変換する
+    先頭に "-" を付けると降順（例: -created_at）
+    """
+    sort = sort or "id"
+    descending = sort.startswith("-")
+    key = sort.lstrip("-")
+    allowed = SORT_KEYS.get(model.__tablename__, ("id",))
+    if key not in allowed:
+        raise ValueError(f"並び替えに使用できない列です: {key}（使用可能: {', '.join(allowed)}）")
+    return key, descending
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _decode_value(column, value):
+    if value is not None and column.type.python_type is datetime:
+        return datetime.fromisoformat(value)
+    return value
+
+
+def encode_cursor(item, sort_key: str) -> str:
+    """行から次ページ用のカーソル文字列を作成する"""
+    if sort_key == "id":
+        return str(item.id)
+    payload = json.dumps([_encode_value(getattr(item, sort_key)), item.id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(model, sort_key: str, cursor: str):
+    """カーソル文字列を (ソートキーの値, id) に戻す"""
+    if sort_key == "id":
+        try:
+            return None, int(cursor)
+        except ValueError:
+            raise ValueError("カーソルが不正です")
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, last_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return _decode_value(getattr(model, sort_key), value), int(last_id)
+    except (ValueError, TypeError):
+        raise ValueError("カーソルが不正です")
+
+
+def keyset_query(query, model, sort: Optional[str] = None, after: Optional[str] = None):
+    """
+    クエリにキーセット条件と並び順を適用する
+    同じソートキーの行はidで順序を確定させる（ソートキーの列はNULLにならない前提）
+    """
+    sort_key, descending = parse_sort(model, sort)
+    id_column = model.id
+    sort_column = getattr(model, sort_key)
+
+    if after:
+        value, last_id = decode_cursor(model, sort_key, after)
+        if sort_key == "id":
+            query = query.filter(id_column < last_id if descending else id_column > last_id)
+        else:
+            current = tuple_(sort_column, id_column)
+            last = tuple_(literal(value, sort_column.type), literal(last_id, id_column.type))
+            query = query.filter(current < last if descending else current > last)
+
+    if sort_key == "id":
+        order = [id_column.desc() if descending else id_column]
+    else:
+        order = [sort_column.desc(), id_column.desc()] if descending else [sort_column, id_column]
+    return query.order_by(*order)
+
+
+def next_cursor(items: List, limit: int, sort: Optional[str] = None) -> Optional[str]:
+    """取得件数がlimitに達していれば最後の行から次ページのカーソルを作成する"""
+    if not items or len(items) < limit:
+        return None
+    sort_key = (sort or "id").lstrip("-")
+    return encode_cursor(items[-1], sort_key)
@@ -21,6 +21,8 @@ except ImportError:
 from PIL import Image
 import io
 
+import page_cache
+
 # ロガー設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -38,6 +40,10 @@ try:
 except:
     pass  # デフォルトパスを使用
 
+def _write_file(file_path: str, content: bytes) -> None:
+    with open(file_path, "wb") as f:
+        f.write(content)
+
 async def download_pdf_from_url(url: str, upload_dir: str = "uploaded_pdfs") -> Tuple[str, Optional[str]]:
     """
     URLからPDFをダウンロードし、ファイル名を返す
@@ -93,8 +99,7 @@ async def download_pdf_from_url(url: str, upload_dir: str = "uploaded_pdfs") ->
 
             # PDFを保存
             try:
-                with open(file_path, "wb") as f:
-                    f.write(response.content)
+                await asyncio.to_thread(_write_file, file_path, response.content)
                 logger.info(f"PDF保存完了: {filename}")
                 return filename, None
             except IOError as e:
@@ -503,6 +508,9 @@ async def extract_text_from_pdf(pdf_path: str) -> Optional[str]:
         logger.error(f"テキスト抽出エラー: {str(e)}")
         return None
 
+# OCR用にページを描画する解像度（AI分析用のPAGE_RENDER_DPIとは別のキャッシュになる）
+OCR_RENDER_DPI = 72
+
 def extract_text_from_pdf_with_ocr(file_path: str) -> Tuple[str, Dict[int, str]]:
     """
     OCRを使用してPDFからテキストを抽出する
@@ -518,46 +526,43 @@ def extract_text_from_pdf_with_ocr(file_path: str) -> Tuple[str, Dict[int, str]]
         text_by_page = {}
         full_text = ""
         
-        with pdfplumber.open(file_path) as pdf:
-            logger.info(f"OCR - PDFページ数: {len(pdf.pages)}")
-            
-            for page_num, page in enumerate(pdf.pages, 1):
-                try:
-                    # ページを画像に変換
-                    page_image = page.to_image()
-                    if page_image:
-                        # PIL Imageに変換
-                        pil_image = page_image.original
-                        
-                        # 画像の前処理（コントラスト向上）
-                        from PIL import ImageEnhance
-                        enhancer = ImageEnhance.Contrast(pil_image)
-                        pil_image = enhancer.enhance(1.5)  # コントラストを1.5倍に
-                        
-                        # OCRでテキスト抽出（日本語優先）
-                        page_text = pytesseract.image_to_string(
-                            pil_image, 
-                            lang='jpn',  # 日本語のみ
-                            config='--psm 6 --oem 1 -c preserve_interword_spaces=1'
-                        )
-                        
-                        if page_text and page_text.strip():
-                            # テキストの後処理
-                            cleaned_text = clean_ocr_text(page_text)
-                            if cleaned_text:
-                                text_by_page[page_num] = cleaned_text
-                                full_text += f"\n--- ページ {page_num} ---\n{cleaned_text}\n"
-                                logger.info(f"OCR - ページ {page_num}: {len(cleaned_text)} 文字抽出")
-                            else:
-                                logger.warning(f"OCR - ページ {page_num}: クリーンアップ後にテキストが空になりました")
+        page_count = page_cache.get_page_count(file_path)
+        logger.info(f"OCR - PDFページ数: {page_count}")
+        
+        for page_num in range(1, page_count + 1):
+            try:
+                # ページ画像を取得（ページ画像キャッシュを使う。解像度は以前のto_image()と同じ72dpi）
+                pil_image = page_cache.get_page_image(file_path, page_num, dpi=OCR_RENDER_DPI)
+                if pil_image:
+                    # 画像の前処理（コントラスト向上）
+                    from PIL import ImageEnhance
+                    enhancer = ImageEnhance.Contrast(pil_image)
+                    pil_image = enhancer.enhance(1.5)  # コントラストを1.5倍に
+                    
+                    # OCRでテキスト抽出（日本語優先）
+                    page_text = pytesseract.image_to_string(
+                        pil_image, 
+                        lang='jpn',  # 日本語のみ
+                        config='--psm 6 --oem 1 -c preserve_interword_spaces=1'
+                    )
+                    
+                    if page_text and page_text.strip():
+                        # テキストの後処理
+                        cleaned_text = clean_ocr_text(page_text)
+                        if cleaned_text:
+                            text_by_page[page_num] = cleaned_text
+                            full_text += f"\n--- ページ {page_num} ---\n{cleaned_text}\n"
+                            logger.info(f"OCR - ページ {page_num}: {len(cleaned_text)} 文字抽出")
                         else:
-                            logger.warning(f"OCR - ページ {page_num}: テキストが抽出できませんでした")
+                            logger.warning(f"OCR - ページ {page_num}: クリーンアップ後にテキストが空になりました")
                     else:
-                        logger.warning(f"OCR - ページ {page_num}: 画像変換に失敗")
-                        
-                except Exception as e:
-                    logger.error(f"OCR - ページ {page_num} のテキスト抽出エラー: {str(e)}")
-        
+                        logger.warning(f"OCR - ページ {page_num}: テキストが抽出できませんでした")
+                else:
+                    logger.warning(f"OCR - ページ {page_num}: 画像変換に失敗")
+                    
+            except Exception as e:
+                logger.error(f"OCR - ページ {page_num} のテキスト抽出エラー: {str(e)}")
+    
         if full_text.strip():
             logger.info(f"OCRでテキスト抽出成功: {len(full_text)} 文字")
             return full_text, text_by_page
@@ -713,6 +718,68 @@ def extract_text_from_pdf(file_path: str) -> Tuple[str, Dict[int, str]]:
         logger.error(f"PDFテキスト抽出全体エラー: {str(e)}")
         return "", {}
 
+# テキスト層の品質判定に使う閾値
+TEXT_LAYER_MIN_CHARS_PER_PAGE = 50  # これ未満のページはテキスト層なしとみなす
+TEXT_LAYER_MIN_PAGE_RATIO = 0.8  # テキスト層を持つページの割合
+TEXT_LAYER_MIN_READABLE_RATIO = 0.9  # 読める文字（日本語・英数字・記号）の割合
+FIGURE_MIN_VECTOR_OBJECTS = 20  # この数以上の線・曲線・矩形を含むページは図ありとみなす
+
+def extract_text_layer(file_path: str) -> Tuple[Dict[int, str], List[int], int]:
+    """
+    PDFのテキスト層をページごとに取得し、図を含むページを判定する（OCRは行わない）
+    戻り値: ({ページ番号: ページテキスト}, 図を含むページ番号のリスト, 総ページ数)
+    """
+    text_by_page = {}
+    figure_pages = []
+    page_count = 0
+    
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            page_count = len(pdf.pages)
+            for page_num, page in enumerate(pdf.pages, 1):
+                try:
+                    page_text = page.extract_text()
+                    if page_text and page_text.strip():
+                        text_by_page[page_num] = page_text.strip()
+                    
+                    # 埋め込み画像、または多数のベクター図形があるページは図ありとする
+                    vector_objects = len(page.lines) + len(page.curves) + len(page.rects)
+                    if page.images or vector_objects >= FIGURE_MIN_VECTOR_OBJECTS:
+                        figure_pages.append(page_num)
+                except Exception as e:
+                    logger.error(f"ページ {page_num} のテキスト層取得エラー: {str(e)}")
+    except Exception as e:
+        logger.error(f"テキスト層取得エラー: {str(e)}")
+        return {}, [], 0
+    
+    logger.info(f"テキスト層取得: {len(text_by_page)}/{page_count} ページ, 図あり {len(figure_pages)} ページ")
+    return text_by_page, figure_pages, page_count
+
+def is_text_layer_usable(text_by_page: Dict[int, str], page_count: int) -> bool:
+    """
+    テキスト層が分析に使える品質かどうかを判定する（スキャンPDFや文字化けを除外）
+    """
+    if page_count == 0:
+        return False
+    
+    pages_with_text = [
+        text for text in text_by_page.values()
+        if len(text) >= TEXT_LAYER_MIN_CHARS_PER_PAGE
+    ]
+    if len(pages_with_text) / page_count < TEXT_LAYER_MIN_PAGE_RATIO:
+        return False
+    
+    full_text = "".join(pages_with_text)
+    # フォントの対応表がないPDFでは "(cid:123)" のような文字列が出力される
+    if "(cid:" in full_text:
+        return False
+    
+    non_space = re.sub(r'\s', '', full_text)
+    if not non_space:
+        return False
+    readable = re.findall(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF\u3000-\u303F\uFF00-\uFFEF\u0021-\u007E\u00D7\u00F7\u2190-\u22FF\u2460-\u24FF\u25A0-\u25FF]', non_space)
+    return len(readable) / len(non_space) >= TEXT_LAYER_MIN_READABLE_RATIO
+
 def analyze_questions(text: str, subject: str = "unknown") -> List[Dict]:
     """
     テキストから問題を分析して抽出する
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Union, Literal
 
 class PDFBase(BaseModel):
     url: str
@@ -61,3 +61,43 @@ class QuestionWithRelations(QuestionOut):
 
 class PDFWithQuestions(PDFOut):
     questions: List[QuestionOut] = []
+
+class BatchAnalysisRequest(BaseModel):
+    school: Optional[str] = None
+    subject: Optional[str] = None
+    year: Optional[int] = None
+    mode: Optional[Literal["auto", "text", "image"]] = None
+    # 指定した場合は既存ジョブをチェックポイントから再開（チェックポイントのファイル名になるため英数字・_・-のみ）
+    job_id: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9_-]+$", max_length=64)
+
+class FacetCount(BaseModel):
+    value: Union[int, str]
+    count: int
+
+class SchoolSuggestion(BaseModel):
+    school: str
+    pdf_count: int
+
+class FacetsOut(BaseModel):
+    total: int
+    schools: List[FacetCount]
+    subjects: List[FacetCount]
+    years: List[FacetCount]
+
+class PageSearchHit(BaseModel):
+    pdf_id: int
+    page_number: int
+    school: str
+    subject: str
+    year: int
+    filename: str
+    snippet: str  # 一致箇所を<mark>で囲んだHTML（それ以外はエスケープ済み）
+
+class SimilarQuestionOut(BaseModel):
+    question: QuestionWithRelations
+    similarity: float  # 問題文のコサイン類似度（0〜1）
+
+class DuplicateOut(BaseModel):
+    pdf: PDFOut
+    similarity: float  # 0〜1
+    method: str  # exact（同一ファイル）/ text（本文のMinHash）/ image（ページのdHash）
@@ -0,0 +1,328 @@
+"""
+学校名の入力補完（プロセス内のトライ木）
+
+学校名は正規化した文字列（全角・半角、カタカナ・ひらがな、大文字・小文字を揃えたもの）で登録し、
+入力もローマ字をひらがなにしてから引く（「waseda」「ワセダ」「わせだ」は同じ読みになる）。
+漢字の学校名を読みで引けるようにするには、SCHOOL_ALIASES_FILE（JSON: {学校名: [読み, ...]}）に読みを書く。
+
+各ノードに候補の上位（PDF件数の多い順）を持たせているため、問い合わせは入力の長さに比例する時間で終わり、DBを読まない。
+PDFの登録・更新・削除ではコミット後に件数の差分を反映し（crud._update_facets）、
+他のワーカーでの変更は SCHOOL_SUGGEST_REFRESH_SECONDS ごとにバックグラウンドで読み直して反映する。
+"""
+import os
+import heapq
+import json
+import re
+import threading
+import time
+import unicodedata
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# 環境設定の読み込み
+try:
+    from config import config as settings
+except ImportError:
+    # フォールバック設定
+    class FallbackSettings:
+        SCHOOL_ALIASES_FILE = os.getenv("SCHOOL_ALIASES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "school_aliases.json"))
+
+    settings = FallbackSettings()
+
+logger = logging.getLogger(__name__)
+
+# 各ノードが持つ候補の数（/schools/suggestのlimitの上限）
+MAX_SUGGESTIONS = 20
+REFRESH_SECONDS = float(os.getenv("SCHOOL_SUGGEST_REFRESH_SECONDS", "300"))
+
+# 学校名の先頭にあっても省略して入力されやすい語（省略した形でも登録する）
+OPTIONAL_PREFIXES = ("私立", "国立", "公立", "都立", "道立", "府立", "県立", "市立", "区立")
+
+_VOWELS = {"a": 0, "i": 1, "u": 2, "e": 3, "o": 4}
+_ROWS = {
+    "": "あいうえお", "k": "かきくけこ", "s": "さしすせそ", "t": "たちつてと", "n": "なにぬねの",
+    "h": "はひふへほ", "m": "まみむめも", "y": "や\0ゆ\0よ", "r": "らりるれろ", "w": "わゐ\0ゑを",
+    "g": "がぎぐげご", "z": "ざじずぜぞ", "d": "だぢづでど", "b": "ばびぶべぼ", "p": "ぱぴぷぺぽ",
+    "l": "らりるれろ", "x": "ぁぃぅぇぉ",
+}
+_YOON = {"ky": "き", "sy": "し", "ty": "ち", "cy": "ち", "ny": "に", "hy": "ひ", "my": "み", "ry": "り",
+         "gy": "ぎ", "zy": "じ", "jy": "じ", "dy": "ぢ", "by": "び", "py": "ぴ"}
+_SMALL_Y = {"a": "ゃ", "u": "ゅ", "o": "ょ", "e": "ぇ"}
+
+
+def _romaji_table() -> Dict[str, str]:
+    table = {}
+    for consonant, kana in _ROWS.items():
+        for vowel, position in _VOWELS.items():
+            if kana[position] != "\0":
+                table[consonant + vowel] = kana[position]
+    for consonant, kana in _YOON.items():
+        for vowel, small in _SMALL_Y.items():
+            table[consonant + vowel] = kana + small
+    for consonant, kana in {"sh": "し", "ch": "ち", "j": "じ"}.items():
+        for vowel, small in _SMALL_Y.items():
+            table[consonant + vowel] = kana + small
+    table.update({
+        "shi": "し", "chi": "ち", "tsu": "つ", "fu": "ふ", "ji": "じ", "wo": "を",
+        "fa": "ふぁ", "fi": "ふぃ", "fe": "ふぇ", "fo": "ふぉ", "va": "ゔぁ", "vi": "ゔぃ", "vu": "ゔ", "ve": "ゔぇ", "vo": "ゔぉ",
+        "nn": "ん", "n'": "ん", "xtu": "っ", "xya": "ゃ", "xyu": "ゅ", "xyo": "ょ", "-": "ー",
+    })
+    return table
+
+
+ROMAJI = _romaji_table()
+_MAX_ROMAJI = max(len(key) for key in ROMAJI)
+
+
+def normalize(text: str) -> str:
+    """全角・半角と大文字・小文字を揃え、カタカナをひらがなにして、空白と中黒を除く"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in text)
+    return re.sub(r"[\s・]+", "", text)
+
+
+def romaji_to_kana(text: str) -> Tuple[str, str]:
+    """
+    ローマ字の部分をひらがなにする（normalize済みの文字列を渡す）
+    戻り値: (変換した部分, 末尾の変換できなかった部分)。「wased」は ("わせ", "d")
+    """
+    result, i = [], 0
+    while i < len(text):
+        c = text[i]
+        if not ("a" <= c <= "z" or c in "'-"):
+            result.append(c)
+            i += 1
+            continue
+        # 子音の連続は促音（kk -> っk）。nは次が母音・yでなければ撥音
+        if i + 1 < len(text) and c == text[i + 1] and c not in "aiueon":
+            result.append("っ")
+            i += 1
+            continue
+        if c == "n" and i + 1 < len(text) and text[i + 1] not in "aiueoy'n":
+            result.append("ん")
+            i += 1
+            continue
+        for length in range(min(_MAX_ROMAJI, len(text) - i), 0, -1):
+            kana = ROMAJI.get(text[i:i + length])
+            if kana:
+                result.append(kana)
+                i += length
+                break
+        else:
+            rest = text[i:]
+            if all("a" <= r <= "z" for r in rest) and len(rest) < _MAX_ROMAJI:
+                return "".join(result), rest
+            result.append(c)
+            i += 1
+    return "".join(result), ""
+
+
+def _completion_table() -> Dict[str, Set[str]]:
+    """入力途中のローマ字（「d」「ky」など） -> それで始まるかなの候補"""
+    table: Dict[str, Set[str]] = {}
+    for key, kana in ROMAJI.items():
+        for length in range(1, len(key)):
+            table.setdefault(key[:length], set()).add(kana)
+    return table
+
+
+COMPLETIONS = _completion_table()
+
+
+class _Node:
+    __slots__ = ("children", "schools", "top")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.schools: Set[str] = set()  # この位置で読みが終わる学校
+        self.top: List[Tuple[int, str]] = []  # 配下の候補の上位 (-PDF件数, 学校名)
+
+
+class SchoolTrie:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._root = _Node()
+        self._counts: Dict[str, int] = {}
+        self._keys: Dict[str, Set[str]] = {}
+        self._aliases: Dict[str, List[str]] = {}
+        self._loaded_at: Optional[float] = None
+        self._version = 0  # apply()の回数（読み直し中に反映された差分の検出に使う）
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    def _keys_for(self, school: str) -> Set[str]:
+        keys = {normalize(school)}
+        for prefix in OPTIONAL_PREFIXES:
+            if school.startswith(prefix) and len(school) > len(prefix):
+                keys.add(normalize(school[len(prefix):]))
+        for alias in self._aliases.get(school, []):
+            kana, pending = romaji_to_kana(normalize(alias))
+            keys.add(kana + pending)
+        keys.discard("")
+        return keys
+
+    def _rank(self, node: _Node) -> None:
+        candidates = {(-self._counts[school], school) for school in node.schools}
+        for child in node.children.values():
+            candidates.update(child.top)
+        node.top = heapq.nsmallest(MAX_SUGGESTIONS, candidates)
+
+    def _rank_all(self, node: _Node) -> None:
+        for child in node.children.values():
+            self._rank_all(child)
+        self._rank(node)
+
+    def _update_path(self, key: str, school: str, add: bool) -> None:
+        """keyの経路を更新し、葉から根に向かって候補の上位を作り直す"""
+        path = [self._root]
+        for c in key:
+            child = path[-1].children.get(c)
+            if child is None:
+                if not add:
+                    return
+                child = path[-1].children[c] = _Node()
+            path.append(child)
+        if add:
+            path[-1].schools.add(school)
+        else:
+            path[-1].schools.discard(school)
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            if depth and not node.schools and not node.children:
+                del path[depth - 1].children[key[depth - 1]]
+                continue
+            self._rank(node)
+
+    def _apply_locked(self, deltas: Dict[str, int]) -> None:
+        for school, delta in deltas.items():
+            if not school or not delta:
+                continue
+            count = self._counts.get(school, 0) + delta
+            keys = self._keys.pop(school, set())
+            self._counts.pop(school, None)
+            for key in keys:
+                self._update_path(key, school, add=False)
+            if count > 0:
+                self._counts[school] = count
+                self._keys[school] = self._keys_for(school)
+                for key in self._keys[school]:
+                    self._update_path(key, school, add=True)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def load(self, counts: Iterable[Tuple[str, int]], aliases: Optional[Dict[str, List[str]]] = None, version: Optional[int] = None) -> None:
+        """
+        学校ごとのPDF件数と読みで作り直す
+        version: 件数を読む前のself.version（その後に反映された差分が読んだ件数に含まれていない可能性がある場合は、
+                 次の問い合わせで読み直す）
+        """
+        trie = SchoolTrie()
+        trie._aliases = aliases or {}
+        for school, count in counts:
+            if not school or count <= 0:
+                continue
+            trie._counts[school] = count
+            trie._keys[school] = trie._keys_for(school)
+            for key in trie._keys[school]:
+                node = trie._root
+                for c in key:
+                    node = node.children.setdefault(c, _Node())
+                node.schools.add(school)
+        trie._rank_all(trie._root)
+        with self._lock:
+            self._root, self._counts, self._keys, self._aliases = trie._root, trie._counts, trie._keys, trie._aliases
+            self._loaded_at = time.monotonic()
+            if version is not None and version != self._version:
+                self._loaded_at -= REFRESH_SECONDS
+
+    def apply(self, deltas: Dict[str, int]) -> None:
+        """学校ごとのPDF件数の増減を反映する（件数が0になった学校は候補から消える）"""
+        with self._lock:
+            self._apply_locked(deltas)
+            self._version += 1
+
+    def _find(self, key: str) -> Optional[_Node]:
+        node = self._root
+        for c in key:
+            node = node.children.get(c)
+            if node is None:
+                return None
+        return node
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[Tuple[str, int]]:
+        """入力に前方一致する学校を [(学校名, PDF件数)] で返す（PDF件数の多い順）"""
+        typed = normalize(prefix)
+        kana, pending = romaji_to_kana(typed)
+        keys = {typed, kana + pending}
+        if pending:
+            keys.update(kana + completion for completion in COMPLETIONS.get(pending, ()))
+        with self._lock:
+            tops = [node.top for node in map(self._find, keys) if node is not None]
+        results, seen = [], set()
+        for count, school in heapq.merge(*tops):
+            if school not in seen:
+                seen.add(school)
+                results.append((school, -count))
+                if len(results) == limit:
+                    break
+        return results
+
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > REFRESH_SECONDS
+
+
+index = SchoolTrie()
+_load_lock = threading.Lock()
+
+
+def load_aliases(path: Optional[str] = None) -> Dict[str, List[str]]:
+    """学校名の読み（SCHOOL_ALIASES_FILE）"""
+    path = path or settings.SCHOOL_ALIASES_FILE
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return {school: list(aliases) for school, aliases in json.load(f).items()}
+    except (OSError, ValueError, AttributeError) as e:
+        logger.error(f"学校名の読みファイルの読み込みエラー: {path}: {str(e)}")
+        return {}
+
+
+def reload() -> None:
+    """DBの学校ごとのPDF件数からトライ木を作り直す"""
+    import crud
+    from database import SessionLocal
+
+    version = index.version
+    db = SessionLocal()
+    try:
+        counts = crud.get_school_counts(db)
+    finally:
+        db.close()
+    index.load(counts, load_aliases(), version)
+
+
+def ensure_loaded() -> SchoolTrie:
+    """
+    初回はその場で読み込み、期限が切れていればバックグラウンドで読み直す
+    （読み直しの間は今のトライ木で答えるため、入力ごとの問い合わせはDBを待たない）
+    """
+    if not index.loaded:
+        with _load_lock:
+            if not index.loaded:
+                reload()
+    elif index.is_stale() and _load_lock.acquire(blocking=False):
+        def run():
+            try:
+                reload()
+            except Exception as e:
+                logger.error(f"学校名の候補の読み直しエラー: {str(e)}")
+            finally:
+                _load_lock.release()
+
+        threading.Thread(target=run, name="school-suggest-refresh", daemon=True).start()
+    return index
@@ -0,0 +1,95 @@
+"""
+一覧レスポンスの高速なJSONシリアライズ
+
+FastAPIの既定の経路（response_modelで1行ずつ検証 → jsonable_encoder → json.dumps）は、
+行数の多いページではCPU時間の大半を占める。ここではPydanticのTypeAdapterで
+行のリストをまとめて検証・シリアライズし（Rust側で処理される）、辞書のレスポンスはorjsonで出力する。
+全件のエクスポートはJSON配列・NDJSONとして少しずつ返す（全行をメモリに載せない）。
+
+orjsonが無い環境では標準のjsonにフォールバックする。
+"""
+import json
+import os
+from functools import lru_cache
+from typing import Any, Iterable, Iterator, List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from pydantic import TypeAdapter
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# エクスポートで1回に読み込む行数
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+JSON_MEDIA_TYPE = "application/json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+EXPORT_FORMATS = ("json", "ndjson")
+
+
+def dumps(content: Any) -> bytes:
+    """辞書・リストをJSONのバイト列にする（datetimeなどはjsonable_encoderと同じ表現）"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """orjsonで出力するJSONResponse（orjsonが無ければ標準のjson）"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+@lru_cache(maxsize=None)
+def _list_adapter(model) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+
+def dump_list(model, items: Iterable) -> bytes:
+    """
+    ORMオブジェクトのリストをmodelのJSON配列にする
+    response_modelと同じ検証（from_attributes）をリスト全体に対して1回で行う
+    """
+    adapter = _list_adapter(model)
+    return adapter.dump_json(adapter.validate_python(list(items), from_attributes=True))
+
+
+def list_response(model, items: Iterable, headers: dict = None) -> Response:
+    """dump_listの結果をそのまま返すレスポンス（response_modelによる再検証を通らない）"""
+    return Response(content=dump_list(model, items), media_type=JSON_MEDIA_TYPE, headers=headers)
+
+
+def iter_json_array(model, batches: Iterable[list]) -> Iterator[bytes]:
+    """行のまとまりを1つのJSON配列として少しずつ出力する"""
+    yield b"["
+    first = True
+    for batch in batches:
+        if not batch:
+            continue
+        body = dump_list(model, batch)[1:-1]
+        yield body if first else b"," + body
+        first = False
+    yield b"]"
+
+
+def iter_ndjson(model, batches: Iterable[list]) -> Iterator[bytes]:
+    """行のまとまりを1行1オブジェクトのNDJSONとして出力する"""
+    adapter = _list_adapter(model)
+    for batch in batches:
+        if batch:
+            rows = adapter.validate_python(batch, from_attributes=True)
+            yield b"".join(row.model_dump_json().encode("utf-8") + b"\n" for row in rows)
+
+
+def stream(model, batches: Iterable[list], export_format: str = "ndjson"):
+    """エクスポート用の (本文のイテレータ, media_type)"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"formatは {' / '.join(EXPORT_FORMATS)} のいずれかを指定してください")
+    if export_format == "json":
+        return iter_json_array(model, batches), JSON_MEDIA_TYPE
+    return iter_ndjson(model, batches), NDJSON_MEDIA_TYPE
@@ -0,0 +1,492 @@
+"""
+類似問題の検索（問題文の文字n-gramのTF-IDFとコサイン類似度）
+
+索引は特徴（n-gramのハッシュ）ごとの転置リスト（CSC形式の疎行列）で、
+ディスクに保存してmmapで読み込む（起動直後から、必要な部分だけを読む）。
+  - 索引に無い新しい問題（IDが索引の最大IDより大きいもの）は、問い合わせ時に差分として追加する
+  - 差分が SIMILAR_DELTA_MAX 件を超えたら索引に統合して保存し直す（IDFとノルムもこのとき計算し直す）
+  - 問題文の更新・削除は次の問い合わせで反映する。他のプロセスでの変更は、読み込み時と統合時にDBと突き合わせて反映する
+
+作り直す場合:
+  python similar.py
+"""
+import os
+import json
+import math
+import re
+import shutil
+import threading
+import time
+import unicodedata
+import zlib
+import logging
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# 環境設定の読み込み
+try:
+    from config import config as settings
+except ImportError:
+    # フォールバック設定
+    class FallbackSettings:
+        SIMILAR_INDEX_DIR = os.getenv("SIMILAR_INDEX_DIR", "similar_index")
+
+    settings = FallbackSettings()
+
+logger = logging.getLogger(__name__)
+
+# 特徴数（n-gramをハッシュしてこの数に畳み込む。語彙を持たないため、追加時に列が増えない）
+FEATURE_BITS = 20
+NUM_FEATURES = 1 << FEATURE_BITS
+NGRAM_SIZES = (2, 3)
+# 差分がこの件数を超えたら索引に統合する
+DELTA_MAX = int(os.getenv("SIMILAR_DELTA_MAX", "5000"))
+# 問い合わせに使う特徴の数（重みの大きい順）。多くの問題に現れる特徴は転置リストが長い割に順位への影響が小さい
+QUERY_TERMS = int(os.getenv("SIMILAR_QUERY_TERMS", "64"))
+
+INDEX_VERSION = 1
+CURRENT_FILE = "CURRENT"
+
+
+def normalize_text(text: str) -> str:
+    """全角・半角を揃え、空白を除く"""
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", text or ""))
+
+
+def term_frequencies(text: str) -> Dict[int, float]:
+    """文字n-gramの特徴ごとの重み（1 + log(出現回数)）"""
+    text = normalize_text(text)
+    counts = Counter(
+        zlib.crc32(text[i:i + n].encode("utf-8")) & (NUM_FEATURES - 1)
+        for n in NGRAM_SIZES
+        for i in range(len(text) - n + 1)
+    )
+    return {feature: 1.0 + math.log(count) for feature, count in counts.items()}
+
+
+def _checksum(text: str) -> int:
+    return zlib.crc32((text or "").encode("utf-8"))
+
+
+class _Postings:
+    """
+    転置リスト（CSC形式）
+    indptr[f]:indptr[f+1] が特徴fを含む行の範囲。rowsは行番号、tfは重み
+    """
+
+    def __init__(self, indptr, rows, tf):
+        self.indptr = indptr
+        self.rows = rows
+        self.tf = tf
+
+    @classmethod
+    def from_triples(cls, features, rows, tf) -> "_Postings":
+        """(特徴, 行, 重み) の並びから作る（同じ特徴の中では行番号順を保つ）"""
+        order = np.argsort(features, kind="stable")
+        counts = np.bincount(features, minlength=NUM_FEATURES)
+        indptr = np.zeros(NUM_FEATURES + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(indptr, rows[order].astype(np.int32), tf[order].astype(np.float32))
+
+    @classmethod
+    def empty(cls) -> "_Postings":
+        return cls(np.zeros(NUM_FEATURES + 1, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+
+    def features(self):
+        """各要素の特徴番号"""
+        return np.repeat(np.arange(NUM_FEATURES, dtype=np.int32), np.diff(self.indptr))
+
+    def scores(self, query: Dict[int, float], num_rows: int):
+        """queryとの内積（行ごと）"""
+        if not query or num_rows == 0:
+            return np.zeros(num_rows, dtype=np.float32)
+        features = np.fromiter(query.keys(), dtype=np.int64, count=len(query))
+        starts, ends = self.indptr[features], self.indptr[features + 1]
+        rows = [self.rows[start:end] for start, end in zip(starts, ends) if end > start]
+        if not rows:
+            return np.zeros(num_rows, dtype=np.float32)
+        weights = [
+            self.tf[start:end] * weight
+            for (start, end), weight in zip(zip(starts, ends), query.values())
+            if end > start
+        ]
+        return np.bincount(np.concatenate(rows), weights=np.concatenate(weights), minlength=num_rows)
+
+
+class SimilarQuestionIndex:
+    """
+    保存済みの索引（mmap）と、その後に追加した差分（メモリ上）
+    行番号は索引の行のあとに差分の行が続く
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or settings.SIMILAR_INDEX_DIR
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self) -> None:
+        self._base = _Postings.empty() if NUMPY_AVAILABLE else None
+        self._base_ids = np.zeros(0, dtype=np.int64) if NUMPY_AVAILABLE else None
+        self._base_norms = np.zeros(0, dtype=np.float32) if NUMPY_AVAILABLE else None
+        self._base_checksums = np.zeros(0, dtype=np.uint32) if NUMPY_AVAILABLE else None
+        self._df = np.zeros(NUM_FEATURES, dtype=np.int64) if NUMPY_AVAILABLE else None
+        self._idf = None
+        self._max_id = 0
+        # 差分（追加順）
+        self._delta_ids: List[int] = []
+        self._delta_norms = array("f")
+        self._delta_checksums = array("I")
+        self._delta_features = array("i")
+        self._delta_rows = array("i")
+        self._delta_tf = array("f")
+        self._delta: Optional[_Postings] = None
+        # 問題ID -> 行番号（問題文を更新した場合は新しい行を指す）
+        self._row_of_id: Dict[int, int] = {}
+        self._dead: Set[int] = set()
+        # 問題文の更新・削除があり、DBから読み直す必要がある問題
+        self._stale: Set[int] = set()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def size(self) -> int:
+        return len(self._row_of_id)
+
+    # ---- 保存と読み込み ----
+
+    def _current_path(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.directory, CURRENT_FILE), encoding="utf-8") as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isdir(path) else None
+
+    def load(self) -> bool:
+        """保存済みの索引をmmapで読み込む（無ければFalse）"""
+        path = self._current_path()
+        if not path:
+            return False
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION or meta.get("features") != NUM_FEATURES:
+            logger.info("類似問題の索引の形式が古いため作り直します")
+            return False
+
+        def mapped(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        with self._lock:
+            self._reset()
+            self._base = _Postings(mapped("indptr"), mapped("rows"), mapped("tf"))
+            self._base_ids = mapped("ids")
+            self._base_norms = mapped("norms")
+            self._base_checksums = mapped("checksums")
+            self._df = np.array(mapped("df"), dtype=np.int64)
+            self._max_id = meta["max_id"]
+            self._row_of_id = {int(question_id): row for row, question_id in enumerate(self._base_ids)}
+            self._idf = self._compute_idf()
+            self._loaded = True
+        return True
+
+    def _save_locked(self) -> None:
+        """索引を新しい世代のディレクトリに書き出し、CURRENTを切り替える"""
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"v{time.time_ns()}"
+        path = os.path.join(self.directory, name)
+        os.makedirs(path)
+        arrays = {
+            "indptr": self._base.indptr, "rows": self._base.rows, "tf": self._base.tf,
+            "ids": self._base_ids, "norms": self._base_norms, "checksums": self._base_checksums,
+            "df": self._df.astype(np.int32),
+        }
+        for key, value in arrays.items():
+            np.save(os.path.join(path, f"{key}.npy"), value)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "features": NUM_FEATURES, "max_id": self._max_id, "rows": len(self._base_ids)}, f)
+
+        tmp = os.path.join(self.directory, f"{CURRENT_FILE}.{name}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(tmp, os.path.join(self.directory, CURRENT_FILE))
+
+        # 古い世代を削除する（直前の世代は他のプロセスが読み込み中の可能性があるため残す）
+        generations = sorted(entry for entry in os.listdir(self.directory) if entry.startswith("v") and entry != name)
+        for old in generations[:-1]:
+            shutil.rmtree(os.path.join(self.directory, old), ignore_errors=True)
+
+        # 書き出した索引をmmapで開き直す（統合時に作った配列のメモリを解放する）
+        def mapped(key):
+            return np.load(os.path.join(path, f"{key}.npy"), mmap_mode="r")
+
+        self._base = _Postings(mapped("indptr"), mapped("rows"), mapped("tf"))
+        self._base_ids = mapped("ids")
+        self._base_norms = mapped("norms")
+        self._base_checksums = mapped("checksums")
+
+    # ---- 追加と統合 ----
+
+    def _compute_idf(self):
+        num_docs = len(self._row_of_id)
+        return (np.log((1 + num_docs) / (1 + self._df)) + 1).astype(np.float32)
+
+    def _checksum_of_row(self, row: int) -> int:
+        num_base = len(self._base_ids)
+        return int(self._base_checksums[row]) if row < num_base else self._delta_checksums[row - num_base]
+
+    def _add_locked(self, questions: Iterable[Tuple[int, str]]) -> int:
+        added = 0
+        for question_id, text in questions:
+            tf = term_frequencies(text)
+            old_row = self._row_of_id.get(question_id)
+            if old_row is not None:
+                self._dead.add(old_row)
+            else:
+                for feature in tf:
+                    self._df[feature] += 1
+            row = len(self._base_ids) + len(self._delta_ids)
+            self._row_of_id[question_id] = row
+            self._delta_ids.append(question_id)
+            self._delta_features.extend(tf.keys())
+            self._delta_rows.extend([row - len(self._base_ids)] * len(tf))
+            self._delta_tf.extend(tf.values())
+            self._delta_norms.append(0.0)
+            self._delta_checksums.append(_checksum(text))
+            self._max_id = max(self._max_id, question_id)
+            added += 1
+        if added:
+            self._idf = self._compute_idf()
+            self._rebuild_delta_locked()
+        return added
+
+    def _remove_locked(self, question_ids: Iterable[int]) -> None:
+        for question_id in question_ids:
+            row = self._row_of_id.pop(question_id, None)
+            if row is not None:
+                self._dead.add(row)
+        # SQLiteは最大のIDが削除されるとそのIDを再利用するため、追加の起点を残っている最大のIDに戻す
+        if self._max_id not in self._row_of_id:
+            self._max_id = max(self._row_of_id, default=0)
+
+    def _rebuild_delta_locked(self) -> None:
+        features = np.frombuffer(self._delta_features, dtype=np.int32)
+        rows = np.frombuffer(self._delta_rows, dtype=np.int32)
+        tf = np.frombuffer(self._delta_tf, dtype=np.float32)
+        self._delta = _Postings.from_triples(features, rows, tf)
+        norms = np.sqrt(np.bincount(rows, weights=(tf * self._idf[features]) ** 2, minlength=len(self._delta_ids)))
+        self._delta_norms = array("f", norms.astype(np.float32).tobytes())
+
+    def _compact_locked(self) -> None:
+        """差分を索引に統合し、削除・更新された行を除いて保存する"""
+        num_base = len(self._base_ids)
+        ids = np.concatenate([np.asarray(self._base_ids, dtype=np.int64), np.array(self._delta_ids, dtype=np.int64)])
+        checksums = np.concatenate([np.asarray(self._base_checksums, dtype=np.uint32), np.array(self._delta_checksums, dtype=np.uint32)])
+        live = np.ones(len(ids), dtype=bool)
+        if self._dead:
+            live[np.fromiter(self._dead, dtype=np.int64)] = False
+        new_row = np.cumsum(live, dtype=np.int64) - 1
+
+        features = np.concatenate([self._base.features(), np.frombuffer(self._delta_features, dtype=np.int32)])
+        rows = np.concatenate([np.asarray(self._base.rows, dtype=np.int64), np.frombuffer(self._delta_rows, dtype=np.int32).astype(np.int64) + num_base])
+        tf = np.concatenate([np.asarray(self._base.tf), np.frombuffer(self._delta_tf, dtype=np.float32)])
+        keep = live[rows]
+        features, rows, tf = features[keep], new_row[rows[keep]], tf[keep]
+        ids, checksums = ids[live], checksums[live]
+
+        self._df = np.bincount(features, minlength=NUM_FEATURES).astype(np.int64)
+        self._row_of_id = {int(question_id): row for row, question_id in enumerate(ids)}
+        self._idf = self._compute_idf()
+        self._base = _Postings.from_triples(features, rows, tf)
+        self._base_ids = ids
+        self._base_checksums = checksums
+        self._max_id = int(ids.max()) if len(ids) else 0
+        self._base_norms = np.sqrt(np.bincount(rows, weights=(tf * self._idf[features]) ** 2, minlength=len(ids))).astype(np.float32)
+        self._delta_ids = []
+        self._delta_norms = array("f")
+        self._delta_checksums = array("I")
+        self._delta_features, self._delta_rows, self._delta_tf = array("i"), array("i"), array("f")
+        self._delta = None
+        self._dead = set()
+        self._save_locked()
+
+    def build(self, questions: Iterable[Tuple[int, str]]) -> None:
+        """全ての問題から索引を作り直して保存する"""
+        with self._lock:
+            self._reset()
+            self._add_locked(questions)
+            self._compact_locked()
+            self._loaded = True
+
+    def verify(self, questions: Iterable[Tuple[int, str]]) -> int:
+        """
+        DBの全ての問題 (ID, 問題文) と突き合わせ、問題文が変わった問題を入れ直し、削除された問題を除く
+        （他のプロセスでの更新・削除を反映する。変更があった件数を返す）
+        """
+        changed, seen = [], set()
+        for question_id, text in questions:
+            seen.add(question_id)
+            row = self._row_of_id.get(question_id)
+            if row is None or self._checksum_of_row(row) != _checksum(text):
+                changed.append((question_id, text))
+        with self._lock:
+            removed = [question_id for question_id in self._row_of_id if question_id not in seen]
+            self._remove_locked(removed)
+            self._add_locked(changed)
+        return len(changed) + len(removed)
+
+    def add(self, questions: Iterable[Tuple[int, str]]) -> int:
+        """問題を差分に追加する（追加した件数を返す）"""
+        with self._lock:
+            return self._add_locked(questions)
+
+    def remove(self, *question_ids: int) -> None:
+        with self._lock:
+            self._remove_locked(question_ids)
+
+    def mark_stale(self, *question_ids: int) -> None:
+        """問題文が更新・削除された問題（次の問い合わせでDBから読み直す）"""
+        with self._lock:
+            self._stale.update(question_id for question_id in question_ids if question_id in self._row_of_id)
+
+    def take_stale(self) -> List[int]:
+        with self._lock:
+            stale, self._stale = list(self._stale), set()
+            return stale
+
+    @property
+    def max_id(self) -> int:
+        return self._max_id
+
+    @property
+    def delta_size(self) -> int:
+        return len(self._delta_ids)
+
+    def compact(self) -> None:
+        with self._lock:
+            self._compact_locked()
+
+    # ---- 問い合わせ ----
+
+    def similar(self, question_id: int, text: str, limit: int = 10) -> List[Tuple[int, float]]:
+        """
+        問題文が似ている問題を [(問題ID, コサイン類似度)] で返す（類似度の高い順、自身を除く）
+        """
+        with self._lock:
+            idf = self._idf
+            if idf is None or not self._row_of_id:
+                return []
+            weights = {feature: tf * float(idf[feature]) for feature, tf in term_frequencies(text).items()}
+            norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+            if not norm:
+                return []
+            # 重みの大きい特徴だけで絞り込む
+            top = sorted(weights.items(), key=lambda item: item[1], reverse=True)[:QUERY_TERMS]
+            query = {feature: weight * float(idf[feature]) / norm for feature, weight in top}
+            base, base_ids, base_norms = self._base, self._base_ids, self._base_norms
+            delta, delta_ids = self._delta, list(self._delta_ids)
+            delta_norms = np.frombuffer(self._delta_norms, dtype=np.float32).copy()
+            dead = np.fromiter(self._dead, dtype=np.int64, count=len(self._dead))
+            own_row = self._row_of_id.get(question_id)
+
+        scores = base.scores(query, len(base_ids)) / np.maximum(base_norms, 1e-12)
+        if delta_ids:
+            scores = np.concatenate([scores, delta.scores(query, len(delta_ids)) / np.maximum(delta_norms, 1e-12)])
+        if len(dead):
+            scores[dead] = 0
+        if own_row is not None:
+            scores[own_row] = 0
+
+        limit = min(limit, int(np.count_nonzero(scores)))
+        if limit <= 0:
+            return []
+        top_rows = np.argpartition(scores, -limit)[-limit:]
+        top_rows = top_rows[np.argsort(-scores[top_rows], kind="stable")]
+        num_base = len(base_ids)
+        return [
+            (int(base_ids[row]) if row < num_base else delta_ids[row - num_base], min(float(scores[row]), 1.0))
+            for row in top_rows
+        ]
+
+
+index = SimilarQuestionIndex()
+_refresh_lock = threading.Lock()
+
+
+def ensure_current(db) -> SimilarQuestionIndex:
+    """
+    索引を最新にする
+    初回は保存済みの索引を読み込み（無ければ全問題から作成）、その後は新しい問題と更新された問題を差分に追加する
+    """
+    import crud
+
+    with _refresh_lock:
+        if not index.loaded:
+            if index.load():
+                # 保存後に他のプロセスで更新・削除された問題を反映する
+                index.verify(crud.get_question_texts(db))
+            else:
+                logger.info("類似問題の索引を作成します")
+                index.build(crud.get_question_texts(db))
+
+        stale = index.take_stale()
+        if stale:
+            texts = dict(crud.get_question_texts(db, ids=stale))
+            index.remove(*(question_id for question_id in stale if question_id not in texts))
+            index.add(texts.items())
+        index.add(crud.get_question_texts(db, after_id=index.max_id))
+        if index.delta_size > DELTA_MAX:
+            index.verify(crud.get_question_texts(db))
+            index.compact()
+    return index
+
+
+def warm_up() -> None:
+    """起動時に別スレッドで索引を読み込む（索引が無い場合の作成に時間がかかるため、最初の問い合わせを待たせない）"""
+    if not NUMPY_AVAILABLE:
+        return
+
+    def run():
+        from database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            ensure_current(db)
+            logger.info(f"類似問題の索引を読み込みました: {index.size} 件")
+        except Exception as e:
+            logger.error(f"類似問題の索引の読み込みエラー: {str(e)}")
+        finally:
+            db.close()
+
+    threading.Thread(target=run, name="similar-warm-up", daemon=True).start()
+
+
+def rebuild() -> None:
+    """全ての問題から索引を作り直す"""
+    import crud
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        index.build(crud.get_question_texts(db))
+    finally:
+        db.close()
+    print(f"類似問題の索引を作成しました: {index.size} 件 ({index.directory})")
+
+
+if __name__ == "__main__":
+    from database import init_db
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    rebuild()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Run AI analysis for every PDF matching a school/subject/year filter.
+PDFs that already have a saved analysis are skipped. Claude calls are
+throttled by a token bucket that backs off on 429 / retry-after, and
+progress is checkpointed so an interrupted run can be resumed.
+
+Usage:
+  python3 scripts/batch_analyze.py --school 早稲田中学校 --subject 算数
+  python3 scripts/batch_analyze.py --resume <job_id>
+  python3 scripts/batch_analyze.py --status <job_id>
+
+Notes:
+  - Runs in-process against the backend database (same settings / env vars
+    as the API server, resolved relative to backend/)
+  - Rate limits are configured with ANALYSIS_RATE_PER_MINUTE,
+    ANALYSIS_RATE_BURST and BATCH_ANALYSIS_CONCURRENCY
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+
+def print_summary(state: dict):
+    print(f"Job:       {state['job_id']}")
+    print(f"Status:    {state['status']}")
+    print(f"Filters:   {json.dumps(state['filters'], ensure_ascii=False)}")
+    print(f"Done:      {len(state['done'])}")
+    print(f"Skipped:   {len(state['skipped'])} (already analysed)")
+    print(f"Pending:   {len(state['pending'])}")
+    print(f"Failed:    {len(state['failed'])}")
+    for pdf_id, error in list(state["failed"].items())[:10]:
+        print(f"  - PDF {pdf_id}: {error}")
+
+
+async def run_job(job):
+    from database import async_engine
+    try:
+        return await job.run()
+    finally:
+        # プールに残った非同期DB接続を閉じる（aiosqliteの接続スレッドが残るとプロセスが終了しない）
+        await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch AI analysis of PDFs")
+    parser.add_argument("--school", help="Filter by school name")
+    parser.add_argument("--subject", help="Filter by subject")
+    parser.add_argument("--year", type=int, help="Filter by year")
+    parser.add_argument("--mode", choices=["auto", "text", "image"], help="Analysis mode")
+    parser.add_argument("--resume", metavar="JOB_ID", help="Resume an interrupted job from its checkpoint")
+    parser.add_argument("--status", metavar="JOB_ID", help="Print the checkpointed status of a job and exit")
+    args = parser.parse_args()
+
+    # バックエンドと同じ相対パス（DB・アップロード先）を使う
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+    import batch_analysis
+
+    if args.status:
+        state = batch_analysis.load_checkpoint(args.status)
+        if not state:
+            print(f"Job not found: {args.status}")
+            sys.exit(1)
+        print_summary(state)
+        return
+
+    try:
+        job = batch_analysis.BatchAnalysisJob(
+            job_id=args.resume,
+            school=args.school,
+            subject=args.subject,
+            year=args.year,
+            mode=args.mode,
+        )
+    except (batch_analysis.JobNotFoundError, ValueError) as e:
+        # 存在しないjob_idで条件なしの新しいジョブを始めない
+        print(f"Cannot resume: {e}")
+        sys.exit(1)
+    print(f"Starting job {job.job_id} (checkpoint: {job.checkpoint_path})")
+    try:
+        state = asyncio.run(run_job(job))
+    except KeyboardInterrupt:
+        print(f"\nInterrupted. Resume with: --resume {job.job_id}")
+        sys.exit(130)
+    print_summary(state)
+    if state["failed"]:
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Load test POST /pdfs/{pdf_id}/analyze with concurrent requests.
+
+While the analyze requests run, a probe polls GET /health at a fixed
+interval. Its latency shows how responsive the backend's event loop
+stays: if analysis blocks the loop, /health latency rises with it.
+
+Usage:
+  # 1. start the mock Claude API
+  python3 scripts/mock_anthropic_server.py --port 8090 --latency-ms 2000
+  # 2. start the backend against it
+  cd backend && ANTHROPIC_API_KEY=mock ANTHROPIC_BASE_URL=http://localhost:8090 uvicorn main:app --port 8000
+  # 3. run the benchmark
+  python3 scripts/benchmark_analyze.py --base-url http://localhost:8000 --pdf-ids 1,2,3 \
+      --requests 30 --concurrency 10
+
+Notes:
+  - Uses refresh=true so saved analyses are not served from the DB cache
+  - Pass --mock-url to print the mock server's counters at the end
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def describe(label, values):
+    if not values:
+        print(f"{label}: no samples")
+        return
+    print(
+        f"{label}: n={len(values)} "
+        f"p50={percentile(values, 50) * 1000:.0f}ms "
+        f"p95={percentile(values, 95) * 1000:.0f}ms "
+        f"max={max(values) * 1000:.0f}ms "
+        f"mean={statistics.mean(values) * 1000:.0f}ms"
+    )
+
+
+async def run_analyze(client, base_url, pdf_ids, total, concurrency, mode):
+    latencies = []
+    outcomes = {"success": 0, "failed": 0, "http_error": 0}
+    errors = {}
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            pdf_id = pdf_ids[i % len(pdf_ids)]
+            params = {"refresh": "true"}
+            if mode:
+                params["mode"] = mode
+            start = time.perf_counter()
+            try:
+                resp = await client.post(f"{base_url}/pdfs/{pdf_id}/analyze", params=params)
+                elapsed = time.perf_counter() - start
+                latencies.append(elapsed)
+                if resp.status_code != 200:
+                    outcomes["http_error"] += 1
+                    errors[f"HTTP {resp.status_code}"] = errors.get(f"HTTP {resp.status_code}", 0) + 1
+                    continue
+                body = resp.json()
+                if body.get("success"):
+                    outcomes["success"] += 1
+                else:
+                    outcomes["failed"] += 1
+                    key = body.get("error", "unknown")[:60]
+                    errors[key] = errors.get(key, 0) + 1
+            except httpx.HTTPError as e:
+                latencies.append(time.perf_counter() - start)
+                outcomes["http_error"] += 1
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, outcomes, errors
+
+
+async def probe_health(client, base_url, interval, stop_event, samples):
+    while not stop_event.is_set():
+        start = time.perf_counter()
+        try:
+            await client.get(f"{base_url}/health")
+            samples.append(time.perf_counter() - start)
+        except httpx.HTTPError:
+            samples.append(float("inf"))
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main_async(args):
+    base_url = args.base_url.rstrip("/")
+    pdf_ids = [int(x) for x in args.pdf_ids.split(",") if x.strip()]
+    limits = httpx.Limits(max_connections=args.concurrency + 2)
+    timeout = httpx.Timeout(args.timeout)
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client, \
+            httpx.AsyncClient(timeout=httpx.Timeout(30.0)) as probe_client:
+        # ベースライン（負荷なし）のヘルスチェック遅延
+        idle_samples = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_health(probe_client, base_url, args.probe_interval, stop, idle_samples))
+        await asyncio.sleep(max(1.0, args.probe_interval * 10))
+        stop.set()
+        await probe
+
+        load_samples = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_health(probe_client, base_url, args.probe_interval, stop, load_samples))
+        start = time.perf_counter()
+        latencies, outcomes, errors = await run_analyze(
+            client, base_url, pdf_ids, args.requests, args.concurrency, args.mode
+        )
+        wall = time.perf_counter() - start
+        stop.set()
+        await probe
+
+        print("=== analyze benchmark ===")
+        print(f"requests={args.requests} concurrency={args.concurrency} wall={wall:.2f}s "
+              f"throughput={args.requests / wall:.2f} req/s")
+        print(f"outcomes: {outcomes}")
+        for key, count in sorted(errors.items(), key=lambda kv: -kv[1]):
+            print(f"  {count:4d}  {key}")
+        describe("analyze latency", latencies)
+        print("=== event loop health (/health latency) ===")
+        describe("idle", idle_samples)
+        describe("under load", [s for s in load_samples if s != float("inf")])
+        failed_probes = sum(1 for s in load_samples if s == float("inf"))
+        if failed_probes:
+            print(f"failed health probes under load: {failed_probes}")
+
+        if args.mock_url:
+            resp = await probe_client.get(f"{args.mock_url.rstrip('/')}/stats")
+            print(f"=== mock server stats ===\n{resp.json()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /pdfs/{pdf_id}/analyze")
+    parser.add_argument("--base-url", default="http://localhost:8000", help="Backend base URL")
+    parser.add_argument("--pdf-ids", required=True, help="Comma separated PDF ids to analyse (round robin)")
+    parser.add_argument("--requests", type=int, default=20, help="Total analyze requests")
+    parser.add_argument("--concurrency", type=int, default=5, help="Concurrent analyze requests")
+    parser.add_argument("--mode", choices=["auto", "text", "image"], help="Analysis mode")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Per request timeout (seconds)")
+    parser.add_argument("--probe-interval", type=float, default=0.1, help="/health probe interval (seconds)")
+    parser.add_argument("--mock-url", help="Mock Anthropic server URL, to print its stats")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Benchmark the hot crud queries on a synthetic database before and after
+the secondary indexes from backend/migrations.py are created.
+
+Usage:
+  python3 scripts/benchmark_indexes.py --rows 100000
+
+Notes:
+  - Uses a throwaway SQLite file in a temp directory (never touches pdfs.db)
+  - Prints per-query mean latency and the SQLite query plan for each case
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+SCHOOLS = [f"テスト中学校{i:03d}" for i in range(200)]
+SUBJECTS = ["算数", "国語", "理科", "社会"]
+YEARS = list(range(2010, 2025))
+INDEX_NAMES = [
+    "ix_pdfs_filename",
+    "ix_pdfs_filename_nonunique",
+    "ix_pdfs_school_subject_year",
+    "ix_questions_pdf_id",
+]
+
+
+def seed(engine, rows: int):
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        now = datetime.utcnow().isoformat(sep=" ")
+        rng = random.Random(42)
+        cursor.execute("INSERT INTO question_types (id, name, created_at) VALUES (1, '計算問題', ?)", (now,))
+        cursor.executemany(
+            "INSERT INTO pdfs (id, url, school, subject, year, filename, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (i, f"https://example.com/{i}.pdf", rng.choice(SCHOOLS), rng.choice(SUBJECTS),
+                 rng.choice(YEARS), f"exam_{i:07d}.pdf", now)
+                for i in range(1, rows + 1)
+            ),
+        )
+        cursor.executemany(
+            "INSERT INTO questions (pdf_id, question_type_id, question_number, question_text, created_at) "
+            "VALUES (?, 1, ?, ?, ?)",
+            ((rng.randint(1, rows), str(i % 10 + 1), f"問題文 {i}", now) for i in range(rows)),
+        )
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def run_cases(crud, schemas, session, rows: int, repeat: int):
+    rng = random.Random(7)
+    filename = f"exam_{rows // 2:07d}.pdf"
+    school = rng.choice(SCHOOLS)
+    pdf_id = rows // 3
+
+    def duplicate_check():
+        try:
+            crud.create_pdf(session, schemas.PDFCreate(url="u", school=school, subject="算数", year=2020, filename=filename))
+        except ValueError:
+            pass
+
+    return [
+        ("get_pdf_by_filename", lambda: crud.get_pdf_by_filename(session, filename)),
+        ("create_pdf duplicate check", duplicate_check),
+        ("get_pdfs_by_school", lambda: crud.get_pdfs_by_school(session, school)),
+        ("get_distinct_schools", lambda: crud.get_distinct_schools(session)),
+        ("get_questions_by_pdf_id", lambda: crud.get_questions_by_pdf_id(session, pdf_id)),
+    ], {
+        "get_pdf_by_filename": ("SELECT * FROM pdfs WHERE filename = :v", {"v": filename}),
+        "create_pdf duplicate check": ("SELECT * FROM pdfs WHERE filename = :v", {"v": filename}),
+        "get_pdfs_by_school": ("SELECT * FROM pdfs WHERE school = :v", {"v": school}),
+        "get_distinct_schools": ("SELECT DISTINCT school FROM pdfs", {}),
+        "get_questions_by_pdf_id": ("SELECT * FROM questions WHERE pdf_id = :v", {"v": pdf_id}),
+    }
+
+
+def measure(label, crud, schemas, session, engine, rows, repeat):
+    from sqlalchemy import text
+
+    cases, plans = run_cases(crud, schemas, session, rows, repeat)
+    results = {}
+    print(f"\n=== {label} ===")
+    for name, fn in cases:
+        fn()  # warm up
+        mean = timed(fn, repeat)
+        results[name] = mean
+        with engine.connect() as conn:
+            sql, params = plans[name]
+            plan = " | ".join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params))
+        print(f"{name:28s} {mean * 1000:9.3f} ms   {plan}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark crud queries with and without secondary indexes")
+    parser.add_argument("--rows", type=int, default=100000, help="Rows in pdfs and in questions")
+    parser.add_argument("--repeat", type=int, default=20, help="Iterations per query")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_indexes_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+    os.environ["DB_GROUP_COMMIT"] = "false"
+    sys.path.insert(0, BACKEND_DIR)
+
+    from sqlalchemy import text
+    import crud, schemas, models, migrations
+    from database import engine, SessionLocal
+
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for name in INDEX_NAMES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+    print(f"Seeding {args.rows} pdfs and {args.rows} questions into {tmp_dir} ...")
+    seed(engine, args.rows)
+
+    session = SessionLocal()
+    try:
+        before = measure("without secondary indexes", crud, schemas, session, engine, args.rows, args.repeat)
+        migrations.run_migrations(engine)
+        after = measure("after migrations.run_migrations", crud, schemas, session, engine, args.rows, args.repeat)
+    finally:
+        session.close()
+
+    print("\n=== speedup ===")
+    for name, mean in before.items():
+        print(f"{name:28s} {mean / after[name]:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark the per-row cost of serialising list responses.
+
+Compares FastAPI's default path (response_model validation row by row,
+jsonable_encoder, json.dumps) with the paths in backend/serialization.py
+(TypeAdapter bulk validation + dump_json, orjson, streamed NDJSON).
+
+Usage:
+  python3 scripts/benchmark_serialization.py --rows 1000
+
+Notes:
+  - Rows are in-memory ORM objects (no database is touched)
+  - Prints microseconds per row for each case and the speedup over FastAPI's default
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+
+def make_rows(models, rows: int):
+    rng = random.Random(42)
+    start = datetime(2024, 4, 1, 9, 0, 0, 123456)
+    pdf = models.PDF(id=1, url="https://example.com/a.pdf", school="テスト中学校", subject="算数", year=2024,
+                     filename="a.pdf", created_at=start)
+    question_type = models.QuestionType(id=1, name="計算問題", description="四則演算", created_at=start)
+    questions = []
+    for i in range(rows):
+        question = models.Question(
+            id=i + 1,
+            pdf_id=1,
+            question_type_id=1,
+            question_number=f"{i % 10 + 1}({rng.randint(1, 5)})",
+            question_text="次の計算をしなさい。" * rng.randint(1, 20),
+            answer_text=str(rng.randint(1, 1000)),
+            difficulty_level=rng.randint(1, 5),
+            points=float(rng.randint(1, 10)),
+            page_number=rng.randint(1, 20),
+            extracted_text=None,
+            keywords="計算,分数",
+            created_at=start + timedelta(seconds=i),
+        )
+        question.pdf = pdf
+        question.question_type = question_type
+        questions.append(question)
+    return questions
+
+
+def timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark list response serialisation per row")
+    parser.add_argument("--rows", type=int, default=1000, help="Rows per response")
+    parser.add_argument("--repeat", type=int, default=20, help="Iterations per case")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+    import models, schemas, serialization
+
+    rows = make_rows(models, args.rows)
+    sparse = [{"id": row.id, "question_number": row.question_number, "created_at": row.created_at} for row in rows]
+    print(f"orjson available: {serialization.ORJSON_AVAILABLE}, rows per response: {args.rows}")
+
+    for model in (schemas.QuestionOut, schemas.QuestionWithRelations):
+        field = create_response_field(name="Response", type_=List[model])
+
+        def fastapi_default(response_class=JSONResponse):
+            content = asyncio.run(serialize_response(field=field, response_content=rows))
+            return response_class(content).body
+
+        cases = [
+            ("fastapi default", fastapi_default),
+            ("fastapi + FastJSONResponse", lambda: fastapi_default(serialization.FastJSONResponse)),
+            ("TypeAdapter dump_list", lambda: serialization.dump_list(model, rows)),
+            ("streamed json array", lambda: b"".join(serialization.iter_json_array(model, [rows]))),
+            ("streamed ndjson", lambda: b"".join(serialization.iter_ndjson(model, [rows]))),
+        ]
+        assert cases[0][1]() == cases[2][1](), "TypeAdapter output differs from FastAPI's"
+        print(f"\n=== {model.__name__} ===")
+        baseline = None
+        for name, fn in cases:
+            fn()  # warm up
+            per_row = timed(fn, args.repeat) / args.rows
+            baseline = baseline or per_row
+            print(f"{name:28s} {per_row * 1e6:9.2f} us/row {baseline / per_row:7.1f}x")
+
+    print("\n=== sparse rows (fields=) ===")
+    cases = [
+        ("jsonable_encoder + json", lambda: JSONResponse(jsonable_encoder(sparse)).body),
+        ("FastJSONResponse", lambda: serialization.FastJSONResponse(sparse).body),
+    ]
+    baseline = None
+    for name, fn in cases:
+        fn()
+        per_row = timed(fn, args.repeat) / args.rows
+        baseline = baseline or per_row
+        print(f"{name:28s} {per_row * 1e6:9.2f} us/row {baseline / per_row:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Check that listing questions with their PDF and question type costs a
+constant number of SQL queries (no N+1 lazy loading).
+
+Usage:
+  python3 scripts/check_query_count.py --questions 1000
+
+Notes:
+  - Uses a throwaway SQLite file in a temp directory (never touches pdfs.db)
+  - Serialises through schemas.QuestionWithRelations, like the API does
+  - Exits with status 1 if the eager-loading path issues more queries
+    than expected
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+# 問題一覧: 問題+PDF（JOIN）1回（問題タイプはプロセス内キャッシュから設定する）
+MAX_LIST_QUERIES = 1
+# 問題タイプのキャッシュが空の場合は問題タイプの読み込みが1回増える
+MAX_LIST_QUERIES_COLD = 2
+# 問題1件: 問題+PDF+問題タイプ（JOIN）1回
+MAX_DETAIL_QUERIES = 1
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def seed(session, models, n_questions: int, n_pdfs: int, n_types: int):
+    types = [models.QuestionType(name=f"タイプ{i}") for i in range(n_types)]
+    pdfs = [
+        models.PDF(url=f"https://example.com/{i}.pdf", school=f"学校{i % 20}", subject="算数",
+                   year=2020 + i % 5, filename=f"exam_{i}.pdf")
+        for i in range(n_pdfs)
+    ]
+    session.add_all(types + pdfs)
+    session.flush()
+    session.add_all(
+        models.Question(pdf_id=pdfs[i % n_pdfs].id, question_type_id=types[i % n_types].id,
+                        question_number=str(i % 10 + 1), question_text=f"問題文 {i}")
+        for i in range(n_questions)
+    )
+    session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Assert constant query count for QuestionWithRelations")
+    parser.add_argument("--questions", type=int, default=1000, help="Questions to seed and list")
+    parser.add_argument("--pdfs", type=int, default=300, help="PDFs the questions belong to")
+    parser.add_argument("--types", type=int, default=8, help="Question types")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="query_count_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'check.db')}"
+    os.environ["DB_GROUP_COMMIT"] = "false"
+    sys.path.insert(0, BACKEND_DIR)
+
+    import crud, models, schemas
+    from database import engine, SessionLocal
+
+    models.Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    seed(session, models, args.questions, args.pdfs, args.types)
+    session.close()
+
+    results = []
+
+    def measure(label, fn, limit):
+        session = SessionLocal()
+        try:
+            with QueryCounter(engine) as counter:
+                fn(session)
+            results.append((label, counter.count, limit))
+        finally:
+            session.close()
+
+    def lazy_list(session):
+        questions = crud.get_questions(session, limit=args.questions)
+        [schemas.QuestionWithRelations.model_validate(q) for q in questions]
+
+    def eager_list(session):
+        questions = crud.get_questions_with_relations(session, limit=args.questions)
+        assert len(questions) == args.questions
+        [schemas.QuestionWithRelations.model_validate(q) for q in questions]
+
+    def eager_detail(session):
+        question = crud.get_question_with_relations(session, args.questions // 2)
+        schemas.QuestionWithRelations.model_validate(question)
+
+    measure("lazy list (get_questions)", lazy_list, None)
+    measure("eager list, cold type cache (get_questions_with_relations)", eager_list, MAX_LIST_QUERIES_COLD)
+    measure("eager list (get_questions_with_relations)", eager_list, MAX_LIST_QUERIES)
+    measure("eager detail (get_question_with_relations)", eager_detail, MAX_DETAIL_QUERIES)
+
+    failed = False
+    for label, count, limit in results:
+        status = "info" if limit is None else ("ok" if count <= limit else "FAIL")
+        failed = failed or status == "FAIL"
+        expected = "" if limit is None else f" (expected <= {limit})"
+        print(f"[{status:4s}] {label}: {count} queries for {args.questions} questions{expected}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
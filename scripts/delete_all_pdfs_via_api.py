@@ -4,8 +4,12 @@ Delete all PDFs (and related questions) from the backend via REST API.
 This calls DELETE /pdfs/{id} for each existing PDF. The backend endpoint
 also removes the physical file from UPLOAD_DIR when present.
 
+With --bulk, PDFs are deleted in chunks through DELETE /pdfs?ids=...,
+which removes each chunk (and its questions) in a single transaction.
+
 Usage:
   python3 scripts/delete_all_pdfs_via_api.py --base-url https://your-backend --yes
+  python3 scripts/delete_all_pdfs_via_api.py --base-url https://your-backend --yes --bulk
 
 Notes:
   - Supports pagination (limit=100) until all PDFs are collected
@@ -48,6 +52,32 @@ def http_delete(url: str):
         return code, body
 
 
+def delete_in_bulk(base_url: str, pdfs, chunk_size: int):
+    successes = 0
+    failures = 0
+    for start in range(0, len(pdfs), chunk_size):
+        chunk = pdfs[start:start + chunk_size]
+        ids = ",".join(str(pdf.get("id")) for pdf in chunk)
+        url = urljoin(base_url + "/", f"pdfs?{urlencode({'ids': ids})}")
+        try:
+            code, body = http_delete(url)
+            deleted = body.get("deleted_count", 0)
+            successes += deleted
+            failures += len(chunk) - deleted
+            print(f"[{start + len(chunk)}/{len(pdfs)}] Deleted {deleted}/{len(chunk)} (code={code})")
+        except HTTPError as e:
+            failures += len(chunk)
+            try:
+                detail = e.read().decode("utf-8")
+            except Exception:
+                detail = str(e)
+            print(f"[{start + len(chunk)}/{len(pdfs)}] ERROR deleting chunk: {e.code} {detail}")
+        except URLError as e:
+            failures += len(chunk)
+            print(f"[{start + len(chunk)}/{len(pdfs)}] URL ERROR deleting chunk: {e}")
+    return successes, failures
+
+
 def list_all_pdfs(base_url: str, page_size: int = 100):
     pdfs = []
     skip = 0
@@ -69,6 +99,8 @@ def main():
     parser.add_argument("--base-url", required=True, help="Backend base URL, e.g. https://example.com")
     parser.add_argument("--yes", action="store_true", help="Do not ask for confirmation")
     parser.add_argument("--sleep", type=float, default=0.1, help="Sleep seconds between delete calls")
+    parser.add_argument("--bulk", action="store_true", help="Delete in chunks via DELETE /pdfs?ids=...")
+    parser.add_argument("--chunk-size", type=int, default=500, help="PDFs per bulk delete request")
     args = parser.parse_args()
 
     base_url = args.base_url.rstrip("/")
@@ -89,6 +121,14 @@ def main():
         print("Nothing to delete.")
         return
 
+    if args.bulk:
+        successes, failures = delete_in_bulk(base_url, pdfs, args.chunk_size)
+        print("\nSummary:")
+        print(f"  Total:     {len(pdfs)}")
+        print(f"  Deleted:   {successes}")
+        print(f"  Failed:    {failures}")
+        return
+
     successes = 0
     failures = 0
     for i, pdf in enumerate(pdfs, 1):
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Anthropic Messages API, for load testing the
+analysis pipeline offline.
+
+It answers POST /v1/messages with a canned analysis (JSON or SSE
+streaming when "stream": true). Latency, 429 rate limits and hanging
+requests (client timeouts) can be simulated.
+
+Usage:
+  python3 scripts/mock_anthropic_server.py --port 8090 --latency-ms 2000 --jitter-ms 500 \
+      --rate-limit-ratio 0.1 --retry-after 2 --timeout-ratio 0.02
+
+  # point the backend at it
+  ANTHROPIC_API_KEY=mock ANTHROPIC_BASE_URL=http://localhost:8090 uvicorn main:app
+
+Notes:
+  - GET /stats returns request counters; POST /stats/reset clears them
+  - Requires fastapi and uvicorn (already backend dependencies)
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MOCK_ANALYSIS = """**1. PDF概要・基本情報**
+- 試験の種類: 入学試験（モック応答）
+- 出題形式: 記述式と選択式の混合
+
+**2. 問題構成の詳細分析**
+- 大問1: 計算問題
+- 大問2: 図形問題
+
+**3. 難易度の詳細評価**
+- 全体の難易度レベル: 普通
+"""
+
+
+class MockConfig:
+    latency_ms = 1000.0
+    jitter_ms = 0.0
+    rate_limit_ratio = 0.0
+    retry_after = 1.0
+    timeout_ratio = 0.0
+    hang_seconds = 600.0
+    stream_chunk_delay_ms = 20.0
+    output_text = MOCK_ANALYSIS
+
+
+config = MockConfig()
+stats = {"requests": 0, "ok": 0, "streamed": 0, "rate_limited": 0, "hung": 0, "in_flight": 0, "max_in_flight": 0}
+
+app = FastAPI()
+
+
+def count_images(body: dict) -> int:
+    images = 0
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            images += sum(1 for block in content if block.get("type") == "image")
+    return images
+
+
+def estimate_input_tokens(body: dict) -> int:
+    # 画像1枚 ≒ 1600トークン、テキストは4文字 ≒ 1トークンで概算
+    text_chars = 0
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            text_chars += len(content)
+        elif isinstance(content, list):
+            text_chars += sum(len(block.get("text", "")) for block in content if block.get("type") == "text")
+    return text_chars // 4 + count_images(body) * 1600
+
+
+def make_message(body: dict) -> dict:
+    return {
+        "id": f"msg_mock_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model", "mock"),
+        "content": [{"type": "text", "text": config.output_text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {
+            "input_tokens": estimate_input_tokens(body),
+            "output_tokens": len(config.output_text) // 4,
+        },
+    }
+
+
+def sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def stream_message(message: dict):
+    try:
+        async for chunk in _stream_events(message):
+            yield chunk
+    finally:
+        # 本文を送り終える（または切断される）まで処理中として数える
+        stats["in_flight"] -= 1
+
+
+async def _stream_events(message: dict):
+    text = message["content"][0]["text"]
+    start = dict(message, content=[], stop_reason=None)
+    yield sse("message_start", {"type": "message_start", "message": start})
+    yield sse("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+    for i in range(0, len(text), 32):
+        await asyncio.sleep(config.stream_chunk_delay_ms / 1000)
+        yield sse("content_block_delta", {
+            "type": "content_block_delta",
+            "index": 0,
+            "delta": {"type": "text_delta", "text": text[i:i + 32]},
+        })
+    yield sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+    yield sse("message_delta", {
+        "type": "message_delta",
+        "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+        "usage": {"output_tokens": message["usage"]["output_tokens"]},
+    })
+    yield sse("message_stop", {"type": "message_stop"})
+
+
+@app.post("/v1/messages")
+async def create_message(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    stats["in_flight"] += 1
+    stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+    streaming = False
+    try:
+        if random.random() < config.rate_limit_ratio:
+            stats["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"retry-after": str(config.retry_after)},
+                content={"type": "error", "error": {"type": "rate_limit_error", "message": "Mock rate limit exceeded"}},
+            )
+
+        if random.random() < config.timeout_ratio:
+            # クライアント側のタイムアウトを再現するため応答を返さずに待つ
+            stats["hung"] += 1
+            await asyncio.sleep(config.hang_seconds)
+
+        latency = max(0.0, random.gauss(config.latency_ms, config.jitter_ms)) if config.jitter_ms else config.latency_ms
+        await asyncio.sleep(latency / 1000)
+
+        message = make_message(body)
+        if body.get("stream"):
+            stats["streamed"] += 1
+            # in_flightはstream_messageが終わったときに減らす
+            streaming = True
+            return StreamingResponse(stream_message(message), media_type="text/event-stream")
+        stats["ok"] += 1
+        return message
+    finally:
+        if not streaming:
+            stats["in_flight"] -= 1
+
+
+@app.get("/stats")
+def get_stats():
+    return dict(stats, uptime_seconds=round(time.monotonic() - started_at, 1))
+
+
+@app.post("/stats/reset")
+def reset_stats():
+    for key in stats:
+        stats[key] = 0
+    return stats
+
+
+started_at = time.monotonic()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Anthropic Messages API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=1000.0, help="Mean response latency")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Std deviation of the latency")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after header value (seconds) for 429s")
+    parser.add_argument("--timeout-ratio", type=float, default=0.0, help="Fraction of requests that hang")
+    parser.add_argument("--hang-seconds", type=float, default=600.0, help="How long hanging requests wait")
+    parser.add_argument("--stream-chunk-delay-ms", type=float, default=20.0, help="Delay between SSE deltas")
+    parser.add_argument("--output-file", help="Text file used as the canned analysis")
+    args = parser.parse_args()
+
+    config.latency_ms = args.latency_ms
+    config.jitter_ms = args.jitter_ms
+    config.rate_limit_ratio = args.rate_limit_ratio
+    config.retry_after = args.retry_after
+    config.timeout_ratio = args.timeout_ratio
+    config.hang_seconds = args.hang_seconds
+    config.stream_chunk_delay_ms = args.stream_chunk_delay_ms
+    if args.output_file:
+        with open(args.output_file, encoding="utf-8") as f:
+            config.output_text = f.read()
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+-- scripts/check_database.py 用のテスト専用データベース（テーブルを作り直すため本番データと分ける）
+CREATE DATABASE pdfs_test OWNER app;
@@ -44,11 +44,18 @@ def get_local_pdfs() -> List[Dict]:
         return []
 
 def get_production_pdfs() -> List[Dict]:
-    """本番環境からPDF情報を取得"""
+    """本番環境からPDF情報を全件取得（X-Next-Cursorヘッダーでページを辿る）"""
     try:
-        response = requests.get(f"{PRODUCTION_API_URL}/pdfs/", timeout=30)
-        response.raise_for_status()
-        return response.json()
+        pdfs = []
+        params = {"limit": 500}
+        while True:
+            response = requests.get(f"{PRODUCTION_API_URL}/pdfs/", params=params, timeout=30)
+            response.raise_for_status()
+            pdfs.extend(response.json())
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if not next_cursor:
+                return pdfs
+            params["after"] = next_cursor
     except Exception as e:
         print(f"本番環境PDF取得エラー: {e}")
         return []